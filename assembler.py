@@ -15,8 +15,9 @@ import rv32i
 
 
 class AssemblyProgram:
-    def __init__(self, start_address=0, labels=None):
+    def __init__(self, start_address=0, labels=None, trace=None):
         self.address = start_address
+        self.trace = trace  # optional trace sink for assembler notes
         self.line_number = 0
         self.labels = {}
         if labels:
@@ -78,6 +79,13 @@ class AssemblyProgram:
         if parsed["instruction"] == "ret":
             parsed["instruction"] = "jalr"
             parsed["args"] = ["x0", "ra", "0"]
+        if parsed["instruction"] in ["rdcycle", "rdcycleh", "rdtime",
+                                     "rdtimeh", "rdinstret", "rdinstreth"]:
+            parsed["args"] = [parsed["args"][0], parsed["instruction"][2:], "x0"]
+            parsed["instruction"] = "csrrs"
+        if parsed["instruction"] == "csrr":
+            parsed["instruction"] = "csrrs"
+            parsed["args"].append("x0")
         self.address += 4
         self.parsed_lines.append(parsed)
         return parsed
@@ -85,7 +93,7 @@ class AssemblyProgram:
     def return_line(self,line,address):
         try:
             bits = rv32i.line_to_bits(
-                line, labels=self.labels, address=address
+                line, labels=self.labels, address=address, trace=self.trace
             )
         except rv32i.LineException as e:
             print(
@@ -111,7 +119,7 @@ class AssemblyProgram:
         for line in self.parsed_lines:
             try:
                 bits = rv32i.line_to_bits(
-                    line, labels=self.labels, address=address
+                    line, labels=self.labels, address=address, trace=self.trace
                 )
             except rv32i.LineException as e:
                 print(
@@ -151,7 +159,7 @@ class AssemblyProgram:
         for line in self.parsed_lines:
             try:
                 bits = rv32i.line_to_bits(
-                    line, labels=self.labels, address=address
+                    line, labels=self.labels, address=address, trace=self.trace
                 )
             except rv32i.LineException as e:
                 print(
@@ -0,0 +1,265 @@
+"""
+Batched lockstep simulator. Runs the same program on N independent harts at
+once with all of the state in NumPy arrays: every step runs one instruction
+on every hart, grouped by opcode class (and ALU code) with masks, so harts
+that branch different ways just end up at different pcs. Needs numpy.
+
+Data memory is per hart and sparse: each word that is touched gets a
+column in an (N, columns) array, shared by all harts, so scattered
+addresses (like a stack at 0x3000_0000) cost one column each. Bytes and
+halfwords are shifted and masked in and out of their word.
+"""
+try:
+    import numpy as np
+except ImportError:
+    raise Exception(
+        "Missing a library, try `pip install numpy`"
+    )
+
+from decoder import (OP_L, OP_I, OP_S, OP_R, OP_B, OP_JALR, OP_JAL, OP_LUI,
+                     OP_AUI, OP_SYSTEM, MVP_CYCLES, FUNCT3_CSRRS, CSR_CYCLE,
+                     CSR_TIME, CSR_INSTRET, CSR_CYCLEH, CSR_TIMEH, CSR_INSTRETH)
+from vector_decode import decode_program
+
+SIGN = np.uint32(0x80000000)
+
+
+def _lt(a, b):
+    """signed less than on uint32 arrays"""
+    return (a ^ SIGN) < (b ^ SIGN)
+
+
+# vector versions of the ALU operations, keyed by the same codes as
+# MVP_Model.ALU (funct3 followed by bit 30)
+VECTOR_ALU = {
+    '0000': lambda a, b: a + b,
+    '0001': lambda a, b: a - b,
+    '0010': lambda a, b: a << (b & 31),
+    '0100': lambda a, b: _lt(a, b).astype(np.uint32),
+    '0110': lambda a, b: (a < b).astype(np.uint32),
+    '1000': lambda a, b: a ^ b,
+    '1010': lambda a, b: a >> (b & 31),
+    '1011': lambda a, b: (a.view(np.int32) >> (b & 31).astype(np.int32)).view(np.uint32),
+    '1100': lambda a, b: a | b,
+    '1110': lambda a, b: a & b,
+}
+# the same table indexed by the alu code as an int (funct3 << 1 | bit 30)
+_ALU_BY_CODE = {int(code, 2): function for code, function in VECTOR_ALU.items()}
+
+# branch conditions keyed by funct3
+BRANCHES = {
+    0: lambda a, b: a == b,
+    1: lambda a, b: a != b,
+    4: _lt,
+    5: lambda a, b: ~_lt(a, b),
+    6: lambda a, b: a < b,
+    7: lambda a, b: a >= b,
+}
+
+_CYCLES = np.array(MVP_CYCLES, dtype=np.int64)
+
+# value masks of the loads and stores by funct3 (lb, lh, lw, lbu, lhu)
+_WIDTH_MASK = np.array([0xFF, 0xFFFF, 0xFFFFFFFF, 0, 0xFF, 0xFFFF, 0, 0],
+                       dtype=np.uint32)
+
+
+class BatchSimulator:
+    """
+    Runs one program on many harts in lockstep.
+
+    Attributes:
+        program: The vector_decode.DecodedProgram being run.
+        regs: (N, 32) uint32 register values.
+        pc: (N,) uint32 pcs.
+        halted: (N,) True for harts that have stopped.
+        instret: (N,) number of instructions each hart has retired.
+        cycles: (N,) clock cycles each hart would have taken on the MVP.
+        steps: Number of lockstep steps run.
+
+    A hart stops when its pc has no instruction or when it jumps or branches
+    to itself (the usual `DONE: beq zero, zero, DONE` end of program) or
+    runs a system instruction that is not a counter read.
+    Loads from addresses nobody has written read 0. Byte, halfword and word
+    loads and stores are supported as long as they do not cross a word
+    boundary.
+    """
+
+    def __init__(self, memory, harts):
+        """
+        Args:
+            memory: {address: BitArray} instruction memory (from return_mem)
+            harts: number of harts
+        """
+        self.program = decode_program(memory)
+        program = self.program
+        self._imm = (program.imm & 0xFFFFFFFF).astype(np.uint32)
+        self._size = len(program)
+        self.harts = harts
+        self.regs = np.zeros((harts, 32), dtype=np.uint32)
+        self.pc = np.zeros(harts, dtype=np.uint32)
+        self.halted = np.zeros(harts, dtype=bool)
+        self.instret = np.zeros(harts, dtype=np.int64)
+        self.cycles = np.zeros(harts, dtype=np.int64)
+        self.steps = 0
+        self._columns = {}  # address -> column in self._data
+        self._data = np.zeros((harts, 16), dtype=np.uint32)
+        self._all = np.arange(harts)
+
+    def set_register(self, index, values):
+        """sets register x<index> on every hart (values is a scalar or (N,))"""
+        if index:
+            self.regs[:, index] = np.asarray(values, dtype=np.int64) & 0xFFFFFFFF
+
+    def store_word(self, address, values):
+        """writes the word at address on every hart (scalar or (N,))"""
+        column = self._column_of(np.full(1, address, dtype=np.uint32))[0]
+        self._data[:, column] = np.asarray(values, dtype=np.int64) & 0xFFFFFFFF
+
+    def load_word(self, address):
+        """returns the (N,) words at address"""
+        column = self._columns.get(int(address))
+        if column is None:
+            return np.zeros(self.harts, dtype=np.uint32)
+        return self._data[:, column].copy()
+
+    def _column_of(self, addresses):
+        """returns the data columns for an array of addresses (adding new ones)"""
+        unique, inverse = np.unique(addresses, return_inverse=True)
+        columns = np.empty(len(unique), dtype=np.int64)
+        for i, address in enumerate(unique.tolist()):
+            column = self._columns.get(address)
+            if column is None:
+                column = len(self._columns)
+                self._columns[address] = column
+                if column == self._data.shape[1]:
+                    grown = np.zeros((self.harts, column * 2), dtype=np.uint32)
+                    grown[:, :column] = self._data
+                    self._data = grown
+            columns[i] = column
+        return columns[inverse]
+
+    def step(self):
+        """
+        Runs one instruction on every running hart. Returns the number of
+        harts that ran.
+        """
+        program = self.program
+        index = (self.pc >> 2).astype(np.int64)
+        # harts that ran off the program stop
+        inside = index < self._size
+        self.halted |= ~inside
+        self.halted[inside] |= ~program.valid[index[inside]] | \
+            (program.op_class[index[inside]] < 0)
+        running = np.flatnonzero(~self.halted)
+        if len(running) == 0:
+            return 0
+        index = index[running]
+        op = program.op_class[index]
+        funct3 = program.funct3[index]
+        alu = program.alu[index]
+        rd = program.rd[index]
+        imm = self._imm[index]
+        regs = self.regs
+        pc = self.pc[running]
+        rs1 = regs[running, program.rs1[index]]
+        rs2 = regs[running, program.rs2[index]]
+        next_pc = pc + np.uint32(4)
+        result = np.zeros(len(running), dtype=np.uint32)
+        write = np.zeros(len(running), dtype=bool)
+
+        for code in np.unique(alu[(op == OP_I) | (op == OP_R)]).tolist():
+            for op_class, b in ((OP_I, imm), (OP_R, rs2)):
+                m = (op == op_class) & (alu == code)
+                if m.any():
+                    result[m] = _ALU_BY_CODE[code](rs1[m], b[m])
+                    write |= m
+        m = op == OP_B
+        if m.any():
+            for f3 in np.unique(funct3[m]).tolist():
+                mf = m & (funct3 == f3)
+                taken = mf.copy()
+                taken[mf] = BRANCHES[f3](rs1[mf], rs2[mf])
+                next_pc[taken] = pc[taken] + imm[taken]
+        m = op == OP_L
+        if m.any():
+            address = rs1[m] + imm[m]
+            columns = self._column_of(address & np.uint32(0xFFFFFFFC))
+            shift = (address & np.uint32(3)) << np.uint32(3)
+            f3 = funct3[m]
+            value = (self._data[running[m], columns] >> shift) & _WIDTH_MASK[f3]
+            # lb and lh sign extend
+            sign = np.where(f3 == 0, 0x80, np.where(f3 == 1, 0x8000, 0)).astype(np.uint32)
+            result[m] = value | (np.uint32(0) - (value & sign))
+            write |= m
+        m = op == OP_S
+        if m.any():
+            address = rs1[m] + imm[m]
+            columns = self._column_of(address & np.uint32(0xFFFFFFFC))
+            shift = (address & np.uint32(3)) << np.uint32(3)
+            mask = _WIDTH_MASK[funct3[m]] << shift
+            old = self._data[running[m], columns]
+            self._data[running[m], columns] = (old & ~mask) | ((rs2[m] << shift) & mask)
+        m = op == OP_JAL
+        if m.any():
+            result[m] = next_pc[m]
+            write |= m
+            next_pc[m] = pc[m] + imm[m]
+        m = op == OP_JALR
+        if m.any():
+            result[m] = next_pc[m]
+            write |= m
+            next_pc[m] = (rs1[m] + imm[m]) & np.uint32(0xFFFFFFFE)
+        m = op == OP_LUI
+        if m.any():
+            result[m] = imm[m]
+            write |= m
+        m = op == OP_AUI
+        if m.any():
+            result[m] = pc[m] + imm[m]
+            write |= m
+        m = op == OP_SYSTEM
+        if m.any():
+            # counter reads, the counters are still as of the start of the step
+            hart = running[m]
+            csr = imm[m]
+            cycles = self.cycles[hart]
+            instret = self.instret[hart]
+            value = np.select(
+                [(csr == CSR_CYCLE) | (csr == CSR_TIME), csr == CSR_INSTRET,
+                 (csr == CSR_CYCLEH) | (csr == CSR_TIMEH), csr == CSR_INSTRETH],
+                [cycles, instret, cycles >> 32, instret >> 32], -1)
+            result[m] = value & 0xFFFFFFFF
+            write |= m
+            bad = (value < 0) | (funct3[m] != FUNCT3_CSRRS) | (program.rs1[index[m]] != 0)
+            if bad.any():
+                where = np.flatnonzero(m)[bad]
+                write[where] = False
+                next_pc[where] = pc[where]  # stops below
+
+        write &= rd != 0
+        regs[running[write], rd[write]] = result[write]
+        self.halted[running[next_pc == pc]] = True  # jumped to itself
+        self.pc[running] = next_pc
+        self.instret[running] += 1
+        self.cycles[running] += _CYCLES[op]
+        self.steps += 1
+        return len(running)
+
+    def run(self, max_steps=None):
+        """
+        Steps until every hart has stopped or max_steps steps have run.
+        Returns the number of steps run.
+        """
+        steps = 0
+        while steps != max_steps and self.step():
+            steps += 1
+        return steps
+
+    def results(self):
+        """
+        Returns the final state of each hart as a list of dicts with the
+        pc, halted flag, instret, cycles and registers (a list of 32 ints).
+        """
+        return [{"pc": int(self.pc[h]), "halted": bool(self.halted[h]),
+                 "instret": int(self.instret[h]), "cycles": int(self.cycles[h]),
+                 "registers": self.regs[h].tolist()} for h in range(self.harts)]
@@ -0,0 +1,238 @@
+"""
+Cache hierarchy simulator for the RISC-V simulator. Models set associative
+LRU caches (an L1 instruction cache, an L1 data cache and an optional shared
+L2) that see every fetch and every load and store of the guest, and counts
+hits, misses, evictions and write backs per level and per pc, so the counts
+can be matched up with the assembly like a HeatReport.
+
+Each cache keeps its tags, LRU stamps and dirty bits in flat arrays indexed
+by set * ways + way. The last line used is remembered so a run of accesses
+to the same line (most instruction fetches) is counted without a lookup,
+that line is already the most recently used one in its set.
+"""
+from array import array
+
+
+def _grow(counts, index):
+    """makes a per pc count array long enough for index"""
+    counts.extend(array('Q', bytes(8 * (max(index + 1, 2 * len(counts)) - len(counts)))))
+
+
+class Cache:
+    """
+    One level of set associative LRU cache.
+
+    Attributes:
+        name: Name for reports (L1I, L1D, L2).
+        size, line_size, ways: Geometry in bytes, bytes and lines per set.
+        write_back: Writes stay in the cache until the line is evicted (or
+            go straight to the next level if False).
+        write_allocate: A write miss brings the line in (or just goes to
+            the next level if False).
+        next_level: The Cache misses and write backs go to, or None.
+        hits, misses, evictions, writebacks: The counts.
+    """
+
+    def __init__(self, name, size=32 * 1024, line_size=64, ways=8,
+                 write_back=True, write_allocate=True, next_level=None):
+        if line_size & (line_size - 1) or size % (line_size * ways):
+            raise ValueError("line_size has to be a power of 2 and size a multiple of line_size * ways")
+        sets = size // (line_size * ways)
+        if sets & (sets - 1):
+            raise ValueError("The number of sets has to be a power of 2")
+        self.name = name
+        self.size = size
+        self.line_size = line_size
+        self.ways = ways
+        self.write_back = write_back
+        self.write_allocate = write_allocate
+        self.next_level = next_level
+        self._line_bits = line_size.bit_length() - 1
+        self._set_mask = sets - 1
+        self.tags = array('q', [-1]) * (sets * ways)  # line number in each way
+        self.stamps = array('Q', bytes(8 * sets * ways))  # last use, for LRU
+        self.dirty = bytearray(sets * ways)
+        # per pc (indexed by pc >> 2)
+        self.pc_accesses = array('Q', bytes(8 * 1024))
+        self.pc_misses = array('Q', bytes(8 * 1024))
+        self.pc_evictions = array('Q', bytes(8 * 1024))
+        self.reset_stats()
+        self.flush()
+
+    def reset_stats(self):
+        """sets every count back to 0 (the cache contents stay)"""
+        self.hits = self.misses = self.evictions = self.writebacks = 0
+        for counts in (self.pc_accesses, self.pc_misses, self.pc_evictions):
+            counts[:] = array('Q', bytes(8 * len(counts)))
+
+    def flush(self):
+        """empties the cache (dirty lines are dropped, not written back)"""
+        self.tags[:] = array('q', [-1]) * len(self.tags)
+        self.dirty[:] = bytes(len(self.dirty))
+        self._clock = 0
+        self._last_line = -1
+        self._last_slot = -1
+
+    def access(self, addr, write=False, pc=None):
+        """
+        Looks up the line holding addr, for the instruction at pc (an int,
+        or None to not count it per pc). Returns True on a hit.
+        """
+        line = addr >> self._line_bits
+        if pc is not None:
+            try:
+                self.pc_accesses[pc >> 2] += 1
+            except IndexError:
+                _grow(self.pc_accesses, pc >> 2)
+                self.pc_accesses[pc >> 2] += 1
+        if line == self._last_line:
+            slot = self._last_slot
+        else:
+            base = (line & self._set_mask) * self.ways
+            try:
+                slot = self.tags.index(line, base, base + self.ways)
+            except ValueError:
+                return self._miss(line, base, write, pc)
+            self._clock += 1
+            self.stamps[slot] = self._clock
+            self._last_line = line
+            self._last_slot = slot
+        self.hits += 1
+        if write:
+            if self.write_back:
+                self.dirty[slot] = 1
+            elif self.next_level is not None:
+                self.next_level.access(addr, True, pc)
+        return True
+
+    def _miss(self, line, base, write, pc):
+        self.misses += 1
+        if pc is not None:
+            self._count(self.pc_misses, pc)
+        next_level = self.next_level
+        if write and not self.write_allocate:
+            if next_level is not None:
+                next_level.access(line << self._line_bits, True, pc)
+            return False
+        if next_level is not None:  # fill the line
+            next_level.access(line << self._line_bits, False, pc)
+        stamps = self.stamps
+        ways = range(base, base + self.ways)
+        slot = min(ways, key=stamps.__getitem__)  # least recently used
+        victim = self.tags[slot]
+        if victim >= 0:
+            self.evictions += 1
+            if pc is not None:
+                self._count(self.pc_evictions, pc)
+            if self.dirty[slot]:
+                self.writebacks += 1
+                if next_level is not None:
+                    next_level.access(victim << self._line_bits, True, pc)
+        self.tags[slot] = line
+        self._clock += 1
+        stamps[slot] = self._clock
+        self.dirty[slot] = 0
+        if write:
+            if self.write_back:
+                self.dirty[slot] = 1
+            elif next_level is not None:
+                next_level.access(line << self._line_bits, True, pc)
+        self._last_line = line
+        self._last_slot = slot
+        return False
+
+    @staticmethod
+    def _count(counts, pc):
+        try:
+            counts[pc >> 2] += 1
+        except IndexError:
+            _grow(counts, pc >> 2)
+            counts[pc >> 2] += 1
+
+    def stats(self):
+        """returns the counts as a dict"""
+        accesses = self.hits + self.misses
+        return {
+            "level": self.name,
+            "accesses": accesses,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "writebacks": self.writebacks,
+            "hit_rate": round(self.hits / accesses, 4) if accesses else 0.0,
+        }
+
+    def pc_stats(self, pc):
+        """returns (accesses, hits, misses, evictions) for the instruction at pc"""
+        index = pc >> 2
+        if index >= len(self.pc_accesses):
+            return 0, 0, 0, 0
+        accesses = self.pc_accesses[index]
+        misses = self.pc_misses[index] if index < len(self.pc_misses) else 0
+        evictions = self.pc_evictions[index] if index < len(self.pc_evictions) else 0
+        return accesses, accesses - misses, misses, evictions
+
+
+class CacheHierarchy:
+    """
+    An L1 instruction cache and an L1 data cache, both backed by an optional
+    L2. Set it as controller.caches and every model sends its fetches,
+    loads and stores through it.
+
+    Attributes:
+        l1i, l1d: The L1 Caches.
+        l2: The shared L2 Cache or None.
+    """
+
+    def __init__(self, l1i=None, l1d=None, l2=None):
+        """
+        Args:
+            l1i, l1d: the L1 Caches (default 32 KiB, 8 way, 64 byte lines)
+            l2: an L2 Cache the L1s miss to, or None
+        """
+        self.l1i = l1i if l1i is not None else Cache("L1I")
+        self.l1d = l1d if l1d is not None else Cache("L1D")
+        self.l2 = l2
+        if l2 is not None:
+            self.l1i.next_level = l2
+            self.l1d.next_level = l2
+
+    @property
+    def levels(self):
+        """returns the list of caches, L1s first"""
+        return [self.l1i, self.l1d] + ([self.l2] if self.l2 is not None else [])
+
+    def fetch(self, pc):
+        """an instruction fetch from pc"""
+        return self.l1i.access(pc, False, pc)
+
+    def load(self, addr, pc=None):
+        """a load from addr by the instruction at pc"""
+        return self.l1d.access(addr, False, pc)
+
+    def store(self, addr, pc=None):
+        """a store to addr by the instruction at pc"""
+        return self.l1d.access(addr, True, pc)
+
+    def report(self):
+        """returns the stats of every level as a list of dicts"""
+        return [cache.stats() for cache in self.levels]
+
+    def line_report(self, program):
+        """
+        Returns a list of dicts (level, pc, line, source, accesses, hits,
+        misses, evictions) for every source line of program (an
+        AssemblyProgram, the pc of parsed_lines[i] is 4 * i) that used a
+        cache, most misses first.
+        """
+        lines = []
+        for cache in self.levels:
+            for i, line in enumerate(program.parsed_lines):
+                accesses, hits, misses, evictions = cache.pc_stats(4 * i)
+                if accesses:
+                    lines.append({"level": cache.name, "pc": 4 * i,
+                                  "line": line["line_number"], "source": line["original"],
+                                  "accesses": accesses, "hits": hits,
+                                  "misses": misses, "evictions": evictions})
+        lines.sort(key=lambda line: (-line["misses"], line["level"], line["pc"]))
+        return lines
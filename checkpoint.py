@@ -0,0 +1,247 @@
+"""
+Checkpoints for the RISC-V simulator. Saves the whole machine (the model's
+pc, fsm state, latches and control signals, the register file and the
+controller's instruction and data memory) in a small binary format made
+with struct, and puts it back in place, so a long setup phase only has to
+be run once and every experiment can start from the checkpoint.
+
+Layout (little endian): a header of magic, version and model kind, then the
+model section, the performance counters, the register file, the instruction
+memory and the data memory (only the pages holding something). Words that
+can be None (registers that were never written, unset latches) are stored
+behind a bitmask of which ones are there.
+"""
+import struct
+
+from bitstring import BitArray
+
+from decoder import decode
+from model import MVP_Model, Functional_Model, STATE_FETCH, STATE_DECODE
+
+MAGIC = b"RVCK"
+VERSION = 3
+
+KIND_MVP = 0
+KIND_FUNCTIONAL = 1
+
+_HEADER = struct.Struct("<4sBB")
+
+# the MVP registers (latches) in the order they are saved
+MVP_LATCHES = ('_pc', '_pc_old', '_current_instruction', 'rs1_data',
+               'rs2_data', '_alu_result_old', '_data_mem_adr')
+# the MVP control signals, these stay set from one cycle to the next
+MVP_FLAGS = ('_IR_write', '_write_to_register', '_addr_slt', '_PC_write',
+             '_write_mem')
+MVP_SELECTS = ('_alu_a_slt', '_alu_b_slt', '_alu_control', '_result_slt')
+
+
+class _Writer:
+    """collects the packed pieces of a checkpoint"""
+
+    def __init__(self):
+        self.parts = []
+
+    def pack(self, fmt, *values):
+        self.parts.append(struct.pack(fmt, *values))
+
+    def words(self, values):
+        """a bitmask of which values are not None then the 32 bit words"""
+        mask = 0
+        present = []
+        for i, value in enumerate(values):
+            if value is not None:
+                mask |= 1 << i
+                present.append(value.uint)
+        self.pack(f"<I{len(present)}I", mask, *present)
+
+    def text(self, value):
+        """a short string, or None"""
+        if value is None:
+            self.pack("<B", 0xFF)
+        else:
+            data = str(value).encode()
+            self.pack(f"<B{len(data)}s", len(data), data)
+
+    def counts(self, counts):
+        """a list of 64 bit counters"""
+        self.pack(f"<I{len(counts)}Q", len(counts), *counts)
+
+    def memory(self, memory):
+        """a {address: BitArray or None} memory"""
+        addresses = list(memory)
+        empty = [i for i, addr in enumerate(addresses) if memory[addr] is None]
+        words = [0 if memory[addr] is None else memory[addr].uint
+                 for addr in addresses]
+        n = len(addresses)
+        self.pack(f"<I{n}I{n}II{len(empty)}I", n, *addresses, *words,
+                  len(empty), *empty)
+
+    def segments(self, memory):
+        """
+        the written pages of a data memory (anything with segments(), like
+        PagedMemory or FlatMemory) as (address, length, bytes)
+        """
+        segments = list(memory.segments())
+        self.pack("<I", len(segments))
+        for addr, data in segments:
+            self.pack(f"<II{len(data)}s", addr, len(data), data)
+
+    def getvalue(self):
+        return b"".join(self.parts)
+
+
+class _Reader:
+    """reads the pieces of a checkpoint back in the same order"""
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values
+
+    def words(self, count):
+        mask, = self.unpack("<I")
+        present = iter(self.unpack(f"<{bin(mask).count('1')}I"))
+        return [BitArray(uint=next(present), length=32) if mask >> i & 1 else None
+                for i in range(count)]
+
+    def text(self):
+        length, = self.unpack("<B")
+        if length == 0xFF:
+            return None
+        return self.unpack(f"<{length}s")[0].decode()
+
+    def counts(self):
+        n, = self.unpack("<I")
+        return list(self.unpack(f"<{n}Q"))
+
+    def memory(self):
+        n, = self.unpack("<I")
+        values = self.unpack(f"<{2 * n}I")
+        addresses, words = values[:n], values[n:]
+        empty, = self.unpack("<I")
+        empty = set(self.unpack(f"<{empty}I"))
+        return dict((addr, None if i in empty else BitArray(uint=word, length=32))
+                    for i, (addr, word) in enumerate(zip(addresses, words)))
+
+    def segments(self):
+        n, = self.unpack("<I")
+        segments = []
+        for _ in range(n):
+            addr, length = self.unpack("<II")
+            segments.append((addr, self.unpack(f"<{length}s")[0]))
+        return segments
+
+
+def _kind(model):
+    if isinstance(model, MVP_Model):
+        return KIND_MVP
+    if isinstance(model, Functional_Model):
+        return KIND_FUNCTIONAL
+    raise TypeError(f"Can not checkpoint a {type(model).__name__}")
+
+
+def snapshot(controller):
+    """
+    Returns a checkpoint (bytes) of the controller's model, its register
+    file and the controller's memories.
+    """
+    model = controller.model
+    kind = _kind(model)
+    out = _Writer()
+    out.parts.append(_HEADER.pack(MAGIC, VERSION, kind))
+    if kind == KIND_MVP:
+        flags = 0
+        for i, name in enumerate(MVP_FLAGS):  # 2 bits each, 2 is None
+            value = getattr(model, name, None)
+            flags |= (2 if value is None else int(bool(value))) << (2 * i)
+        out.pack("<BBH", model._fsm_state, model._op_class, flags)
+        for name in MVP_SELECTS:
+            out.text(getattr(model, name, None))
+        out.words([getattr(model, name, None) for name in MVP_LATCHES])
+        out.counts([model._cycles, model._instret])
+        out.counts(model._state_cycles)
+    else:
+        instruction = model._current_instruction
+        out.pack("<IB", model._pc, instruction is not None)
+        if instruction is not None:
+            out.pack("<I", instruction.uint)
+    out.counts(model._all_op_counts() if kind == KIND_FUNCTIONAL else model._op_counts)
+    out.words([reg.data for reg in model.get_registers.regfile])
+    out.pack("<B", controller._at_end_of_mem)
+    out.memory(controller.instruction_memory)
+    out.segments(controller.data_memory)
+    return out.getvalue()
+
+
+def restore(controller, data):
+    """
+    Puts the machine back the way it was when `data` (from snapshot) was
+    taken. The controller's model has to be the same kind of model.
+    """
+    model = controller.model
+    if len(data) < _HEADER.size:
+        raise ValueError("Not a checkpoint")
+    magic, version, kind = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a checkpoint")
+    if version != VERSION:
+        raise ValueError(f"Unsupported checkpoint version: {version}")
+    if kind != _kind(model):
+        raise ValueError(f"Checkpoint is for a different model than {type(model).__name__}")
+    src = _Reader(data)
+    src.offset = _HEADER.size
+    model.reset_counters()
+    if kind == KIND_MVP:
+        state, op_class, flags = src.unpack("<BBH")
+        for i, name in enumerate(MVP_FLAGS):
+            value = flags >> (2 * i) & 3
+            setattr(model, name, None if value == 2 else bool(value))
+        for name in MVP_SELECTS:
+            setattr(model, name, src.text())
+        for name, value in zip(MVP_LATCHES, src.words(len(MVP_LATCHES))):
+            setattr(model, name, value)
+        model._cycles, model._instret = src.counts()
+        model._state_cycles = src.counts()
+        model._fsm_state = state
+        model._op_class = op_class
+        model._wires = {}
+        # past decode the fsm uses the decoded instruction
+        model._decoded = None
+        if state not in (STATE_FETCH, STATE_DECODE) and \
+                model._current_instruction is not None:
+            model._decoded = decode(model._current_instruction.uint)
+    else:
+        pc, has_instruction = src.unpack("<IB")
+        model._pc = pc
+        model._current_instruction = None
+        if has_instruction:
+            model._current_instruction = BitArray(uint=src.unpack("<I")[0], length=32)
+    model._op_counts = src.counts()
+    registers = src.words(32)
+    for reg, value in zip(model.get_registers.regfile[1:], registers[1:]):
+        reg.write_data(value)
+    if kind == KIND_FUNCTIONAL:
+        model._regs = [0 if value is None else value.uint for value in registers]
+        model._dirty = 0
+    controller._at_end_of_mem = bool(src.unpack("<B")[0])
+    controller.instruction_memory = src.memory()
+    data_memory = controller.data_memory
+    data_memory.clear()
+    for addr, segment in src.segments():
+        data_memory.write_bytes(addr, segment)
+
+
+def save(controller, filename):
+    """writes a checkpoint of the controller's machine to a file"""
+    with open(filename, "wb") as f:
+        f.write(snapshot(controller))
+
+
+def load(controller, filename):
+    """restores the controller's machine from a checkpoint file"""
+    with open(filename, "rb") as f:
+        restore(controller, f.read())
@@ -1,12 +1,22 @@
 """
 Controller for the RISC-V simulator. Gets assembly from user and passes binary 
-to the model to be executed. Stores instruction and data memory as dictionaries.
+to the model to be executed. Stores instruction memory as an array of words
+(InstructionMemory) and data memory as a sparse, byte addressable PagedMemory.
 """
 import os
 from abc import ABC, abstractmethod
 
+from bitstring import BitArray
+
 from assembler import AssemblyProgram
-from model import Model
+from memory import InstructionMemory, PagedMemory, FUNCT3_W
+from mmio import Bus
+from model import Model, STOP_MAX_INSTRUCTIONS
+
+try:
+    from vector_decode import decode_program
+except Exception:  # vector_decode needs numpy
+    decode_program = None
 
 
 class Controller:
@@ -26,19 +36,27 @@ class Controller:
         self.model.do_reset()
 
         # create empty memory
-        self.instruction_memory = {}
-        self.data_memory = {}
+        self.instruction_memory = InstructionMemory()
+        self.data_memory = PagedMemory()
 
         # conversion toolkit object for later
         self._at_end_of_mem = False
 
-    def run(self, filename=None):
+        # a cache.CacheHierarchy that sees every fetch, load and store
+        self.caches = None
+
+        # why the last run stopped
+        self.stop_reason = None
+
+    def run(self, filename=None, max_instructions=None):
         """
         Gets assembly from user (either line-by-line instructions or from an
         .s file), compiles it to binary, writes to instruction memory, and
-        runs the model.
+        runs the model. A file runs until the model halts or
+        max_instructions have run, the reason (a model.STOP_* constant) is
+        printed, kept in self.stop_reason and returned.
         """
-        self.ap = AssemblyProgram()
+        self.ap = AssemblyProgram(trace=self.model.trace)
         # get PC from model (begins at 0)
 
         # line-by-line mode
@@ -52,6 +70,7 @@ class Controller:
                     instruction.lower()
                     instruction = instruction.replace(',', '')
                     if 'stop' in instruction or 'escape' in instruction:
+                        self.view.flush()
                         print(self.model)
                         return
                     # compile assembly to binary (bitstring)
@@ -66,28 +85,90 @@ class Controller:
         # Assembly *file* mode
         else:
             # compile assembly
-            self.ap
-            with open(os.path.join(os.path.curdir, filename), "r") as f:
-                for line in f:
-                    self.ap.parse_line(line)
-
-            self.instruction_memory = self.ap.return_mem()
-
-            # run through each instruction
-            old_reg = None
-            old_pc = None
-            # (while PC not changing and register file not changing)
-            while not (self.model.get_registers == old_reg) or \
-                    not (old_pc == self.model.get_pc) and not self._at_end_of_mem:
-
-                old_reg = self.model.get_registers
-                old_pc = self.model.get_pc
-
-                self.model.do_instruction()
+            self.load_program(filename)
+
+            # run through each instruction until the model halts (ecall,
+            # ebreak, a jump to itself or the end of the program) or the
+            # budget runs out
+            self.stop_reason = STOP_MAX_INSTRUCTIONS
+            count = 0
+            while count != max_instructions:
+                # one instruction at a time whatever the model (a
+                # do_instruction of the block model runs a whole block)
+                count += self.model.run_until(max_instructions=1).instructions
                 reg = self.model.get_registers
                 reg.fullreg = False
                 self.view.draw()
+                if self.model.halt_reason is not None:
+                    self.stop_reason = self.model.halt_reason
+                    break
+            self.view.flush()
+            self.flush_devices()
             print(self.model.get_registers)
+            print(f"Stopped: {self.stop_reason}")
+            return self.stop_reason
+
+    def load_program(self, filename):
+        """
+        Assembles an .s file, puts it in instruction memory and decodes it
+        into the model's decode cache.
+
+        Args:
+            filename (str): path to the assembly file
+
+        Raises ValueError if the file does not assemble.
+        """
+        self.ap = AssemblyProgram(trace=self.model.trace)
+        with open(os.path.join(os.path.curdir, filename), "r") as f:
+            for line in f:
+                self.ap.parse_line(line)
+        memory = self.ap.return_mem()
+        if memory == -1:  # the assembler has printed what went wrong
+            raise ValueError(f"{filename} did not assemble")
+        self.instruction_memory = memory
+        self.preload_decode_cache()
+
+    def preload_decode_cache(self):
+        """
+        Decodes the whole program into the model's decode cache, in one go
+        with vector_decode if numpy is installed, so running it does not
+        decode as it goes.
+        """
+        cache = self.model.decode_cache
+        if decode_program is not None:
+            cache.preload(decode_program(self._instruction_memory))
+        else:
+            cache.preload_words(self._instruction_memory.words)
+
+    def run_batch(self, filename=None, max_instructions=None, max_cycles=None,
+                  until_pc=None, predicate=None):
+        """
+        Runs the model in one go without drawing after each instruction.
+        Stops after max_instructions/max_cycles, when the pc reaches
+        until_pc, when predicate(model) returns True (use
+        model.read_register for register conditions) or when the program
+        ends.
+
+        Args:
+            filename (str): assembly file to load first (optional)
+            max_instructions (int): instruction budget
+            max_cycles (int): cycle budget
+            until_pc (int): pc to stop at
+            predicate (function): called with the model after each instruction
+
+        Returns:
+            RunSummary: instructions retired, cycles and the stop reason
+        """
+        if filename is not None:
+            self.load_program(filename)
+        try:
+            return self.model.run_until(pc=until_pc, predicate=predicate,
+                                        max_instructions=max_instructions,
+                                        max_cycles=max_cycles)
+        finally:
+            if self.model.trace is not None:
+                self.model.trace.flush()
+            self.flush_devices()
 
     def reg_number(self, reg):
         """
@@ -132,6 +213,23 @@ class Controller:
             return -1
         return self.ap.return_line(line, pc)
 
+    @property
+    def instruction_memory(self):
+        """the program (an InstructionMemory)"""
+        return self._instruction_memory
+
+    @instruction_memory.setter
+    def instruction_memory(self, memory):
+        """takes an InstructionMemory or a {pc: BitArray} dict like return_mem gives"""
+        if not isinstance(memory, InstructionMemory):
+            memory = InstructionMemory(memory)
+        self._instruction_memory = memory
+
+    def flush_devices(self):
+        """writes out what the I/O devices have buffered (console output)"""
+        if isinstance(self.data_memory, Bus):
+            self.data_memory.flush()
+
     def get_instruct_mem(self, address):
         """
         Returns instruction at address
@@ -139,8 +237,11 @@ class Controller:
         Args:
             address (int): address to get
         """
-        if address in self.instruction_memory:
-            return self.instruction_memory[address]
+        if self.caches is not None:
+            self.caches.fetch(address)
+        instruction = self.instruction_memory.get(address)
+        if instruction is not None:
+            return instruction
 
         # throws error if trying to access mem that doesn't exist
         else:
@@ -148,31 +249,46 @@ class Controller:
             self._at_end_of_mem = True
             return None
 
-    def get_data_mem(self, address):
+    def add_device(self, base, size, device):
+        """
+        Maps an I/O device (see mmio.py) at [base, base + size) of data
+        memory, putting a Bus in front of the data memory the first time.
+        Returns the device.
+        """
+        if not isinstance(self.data_memory, Bus):
+            self.data_memory = Bus(self.data_memory)
+        return self.data_memory.add_device(base, size, device)
+
+    def get_data_mem(self, address, funct3=FUNCT3_W, pc=None):
         """
-        Returns data at address
+        Returns data at address (a word unless funct3 says otherwise, bytes
+        and halfwords are sign or zero extended to 32 bits like the loads)
         Args:
             address (int): address to get
+            funct3 (int): the load width, see memory.py
+            pc (int): pc of the load, for the cache stats
         """
-        if address in self.data_memory:
-            return self.data_memory[address]
+        if self.caches is not None:
+            self.caches.load(address, pc)
+        return BitArray(uint=self.data_memory.load(address, funct3), length=32)
 
-        # throws error if trying to access mem that doesn't exist
-        else:
-            raise Exception("Address does not exist in data memory")
-
-    def set_data_mem(self, address, data):
+    def set_data_mem(self, address, data, funct3=FUNCT3_W, pc=None):
         """
         Sets data at address
 
         Args:
             address (int): address to set
-            data (bitstring): data to set
+            data (bitstring or int): data to set (None stores 0)
+            funct3 (int): the store width, see memory.py
+            pc (int): pc of the store, for the cache stats
         """
-        try:
-            self.data_memory[address] = data
-        except:
-            raise Exception("Data could not be set in data memory")
+        if self.caches is not None:
+            self.caches.store(address, pc)
+        if data is None:
+            data = 0
+        elif not isinstance(data, int):
+            data = data.uint
+        self.data_memory.store(address, data, funct3)
 
 
 # abstract base class for prompts since they may be different for different
@@ -1,10 +1,13 @@
 """
 RISC-V Single Cycle CPU
 """
+import sys
 from abc import ABC, abstractmethod
 
 import bitstring
 
+from register_file import format_register
+
 bitstring.lsb0 = True
 BitArray = bitstring.BitArray
 
@@ -35,6 +38,12 @@ class CPUView(ABC):
         A draw method that is an abstract method.
         """
 
+    def flush(self):
+        """
+        Draws anything the view is holding back, called at the end of a run.
+        """
+        pass
+
 
 class TextView(CPUView):
     """
@@ -54,3 +63,97 @@ class TextView(CPUView):
             print()
         print(f"PC : {self.cpu.get_pc.hex}")
         print(self.cpu)
+
+
+class NullView(CPUView):
+    """
+    View that draws nothing, for batch runs where nobody is watching.
+    """
+
+    def draw(self):
+        pass
+
+
+class DiffTextView(CPUView):
+    """
+    Text view that only prints the registers that changed since the last
+    frame, so the output grows with the number of register changes and not
+    with steps x registers. Each register's line is formatted once and kept
+    until the register is written with a new value.
+
+    With a CompactRegisterFile the view keeps a snapshot of its values and
+    a frame where nothing changed is one array compare (the register
+    file's modified mask is left alone), other register files are compared
+    register by register.
+
+    Attributes:
+        coalesce: Number of draws (steps) shown as one frame.
+        out: Where frames are written (stdout by default).
+    """
+
+    def __init__(self, cpu, coalesce=1, out=None):
+        super().__init__(cpu)
+        self.coalesce = coalesce
+        self.out = out
+        self._values = [None] * 32  # value each register had in the last frame
+        self._lines = [None] * 32  # its formatted line
+        self._snapshot = None  # CompactRegisterFile.snapshot() at the last frame
+        self._pending = 0
+
+    def draw(self):
+        """
+        Counts a step, every coalesce steps prints the instruction, the pc
+        and the lines of the registers that changed.
+        """
+        self._pending += 1
+        if self._pending >= self.coalesce:
+            self._frame()
+
+    def flush(self):
+        """prints the steps since the last frame, if any"""
+        if self._pending:
+            self._frame()
+
+    def _changed(self, registers):
+        """returns (index, data) for the registers that may have changed"""
+        if not hasattr(registers, "snapshot"):
+            return enumerate(reg.data for reg in registers.regfile)
+        last = self._snapshot
+        self._snapshot = valid, values = registers.snapshot()
+        if last is None:
+            return enumerate(reg.data for reg in registers.regfile)
+        last_valid, last_values = last
+        if valid == last_valid and values == last_values:
+            return []
+        return [(index, registers.get_data(index)) for index in range(32)
+                if values[index] != last_values[index] or (valid ^ last_valid) >> index & 1]
+
+    def _frame(self):
+        cpu = self.cpu
+        steps = self._pending
+        self._pending = 0
+        lines = []
+        if cpu.instruction is not None:
+            lines.append(f"Instruction : {cpu.instruction.hex}")
+        else:
+            lines.append("")
+        lines.append(f"PC : {cpu.get_pc.hex}" + (f" ({steps} steps)" if steps > 1 else ""))
+        values = self._values
+        for index, data in self._changed(cpu.get_registers):
+            value = None if data is None else data.uint
+            if value != values[index]:
+                values[index] = value
+                line = format_register(index, data)
+                self._lines[index] = None if data is None else line
+                lines.append(line)
+        lines.append("")
+        out = self.out if self.out is not None else sys.stdout
+        out.write("\n".join(lines))
+
+    def table(self):
+        """
+        Returns the registers as of the last frame (the registers that hold
+        a value, like the register file printout) from the cached lines.
+        """
+        lines = [line for line in self._lines if line is not None]
+        return "\n".join(["+----Register File----+"] + lines + ["+---------------------+"])
@@ -0,0 +1,291 @@
+"""
+Instruction decoder for the RISC-V simulator. Turns 32 bit instruction words
+into small decoded records and caches them by word so that loops only pay
+for decoding once.
+"""
+
+# opcode classes, these follow the paths through the fsm after decode
+OP_L = 0
+OP_I = 1
+OP_S = 2
+OP_R = 3
+OP_B = 4
+OP_JALR = 5
+OP_JAL = 6
+OP_LUI = 7
+OP_AUI = 8
+OP_SYSTEM = 9
+
+# display names for the opcode classes (the same names the MVP fsm uses)
+OP_NAMES = ['l type', 'i type', 's type', 'r type', 'b type', 'jr type',
+            'jal type', 'lui type', 'aui type', 'system type']
+
+# clock cycles each opcode class takes on the MVP (the length of its path
+# through the fsm), the functional models count cycles with these
+MVP_CYCLES = [5, 4, 4, 4, 3, 4, 4, 3, 3, 3]
+
+OPCODE_CLASS = {
+    0b0000011: OP_L,
+    0b0010011: OP_I,
+    0b0100011: OP_S,
+    0b0110011: OP_R,
+    0b1100011: OP_B,
+    0b1100111: OP_JALR,
+    0b1101111: OP_JAL,
+    0b0110111: OP_LUI,
+    0b0010111: OP_AUI,
+    0b1110011: OP_SYSTEM,
+}
+
+# the counter csrs (Zicntr), guest code reads them with csrrs rd, csr, x0
+# (rdcycle, rdinstret, ...). There is no wall clock so time counts cycles.
+CSR_CYCLE = 0xC00
+CSR_TIME = 0xC01
+CSR_INSTRET = 0xC02
+CSR_CYCLEH = 0xC80
+CSR_TIMEH = 0xC81
+CSR_INSTRETH = 0xC82
+FUNCT3_CSRRS = 2
+
+# ecall and ebreak stop the machine, they run as an instruction that leaves
+# the pc where it is (like a jump to itself)
+WORD_ECALL = 0x00000073
+WORD_EBREAK = 0x00100073
+
+# why an instruction that left the pc where it was stopped the machine
+HALT_ECALL = 'ecall'
+HALT_EBREAK = 'ebreak'
+HALT_SELF_LOOP = 'self loop'
+
+
+def _sign_extend(value, bits):
+    """sign extends the lowest `bits` bits of value"""
+    sign = 1 << (bits - 1)
+    return (value & (sign - 1)) - (value & sign)
+
+
+# immediate extractors, one per instruction format. Each takes the 32 bit
+# instruction as an int and returns the sign extended immediate as an int.
+def imm_i(word):
+    """imm[11:0] = inst[31:20]"""
+    return _sign_extend(word >> 20, 12)
+
+
+def imm_s(word):
+    """imm[11:5] = inst[31:25], imm[4:0] = inst[11:7]"""
+    return _sign_extend(((word >> 20) & 0xFE0) | ((word >> 7) & 0x1F), 12)
+
+
+def imm_b(word):
+    """imm[12|10:5] = inst[31:25], imm[4:1|11] = inst[11:7]"""
+    return _sign_extend(((word >> 19) & 0x1000) | ((word << 4) & 0x800)
+                        | ((word >> 20) & 0x7E0) | ((word >> 7) & 0x1E), 13)
+
+
+def imm_j(word):
+    """imm[20|10:1|11|19:12] = inst[31:12]"""
+    return _sign_extend(((word >> 11) & 0x100000) | (word & 0xFF000)
+                        | ((word >> 9) & 0x800) | ((word >> 20) & 0x7FE), 21)
+
+
+def imm_u(word):
+    """imm[31:12] = inst[31:12], the low 12 bits are 0"""
+    return _sign_extend(word & 0xFFFFF000, 32)
+
+
+def imm_none(word):
+    """r types have no immediate"""
+    return 0
+
+
+def imm_csr(word):
+    """csr[11:0] = inst[31:20], not sign extended"""
+    return word >> 20
+
+
+# the extractor to use for each opcode class
+IMM_EXTRACTORS = {
+    OP_L: imm_i,
+    OP_I: imm_i,
+    OP_S: imm_s,
+    OP_R: imm_none,
+    OP_B: imm_b,
+    OP_JALR: imm_i,
+    OP_JAL: imm_j,
+    OP_LUI: imm_u,
+    OP_AUI: imm_u,
+    OP_SYSTEM: imm_csr,
+}
+
+
+def decode_imm(word):
+    """
+    Returns the sign extended immediate of an instruction word (an int).
+    Raises ValueError for opcodes the simulator does not support.
+    """
+    try:
+        op = OPCODE_CLASS[word & 0x7F]
+    except KeyError:
+        raise ValueError(f"Unsupported opcode: {word & 0x7F:07b}")
+    return IMM_EXTRACTORS[op](word)
+
+
+class Decoded:
+    """
+    A decoded instruction.
+
+    Attributes:
+        word: The instruction as a 32 bit int.
+        op: The opcode class (one of the OP_* constants).
+        rd, rs1, rs2: Register numbers.
+        funct3: The funct3 field.
+        imm: The sign extended immediate (0 if the format has none).
+        alu: The ALU control code (same codes as MVP_Model.ALU) or None.
+    """
+    __slots__ = ('word', 'op', 'rd', 'rs1', 'rs2', 'funct3', 'imm', 'alu')
+
+    def __init__(self, word, op, rd, rs1, rs2, funct3, imm, alu):
+        self.word = word
+        self.op = op
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+        self.funct3 = funct3
+        self.imm = imm
+        self.alu = alu
+
+    def __repr__(self):
+        return (f"Decoded({self.word:08x}, {OP_NAMES[self.op]}, rd={self.rd}, "
+                f"rs1={self.rs1}, rs2={self.rs2}, imm={self.imm}, alu={self.alu})")
+
+
+def decode(word):
+    """
+    Decodes an instruction word (an int) into a Decoded record.
+    Raises ValueError for opcodes the simulator does not support.
+    """
+    opcode = word & 0x7F
+    try:
+        op = OPCODE_CLASS[opcode]
+    except KeyError:
+        raise ValueError(f"Unsupported opcode: {opcode:07b}")
+    funct3 = (word >> 12) & 0x7
+    imm = IMM_EXTRACTORS[op](word)
+    alu = 'add'
+    # the alu code is funct3 with bit 30 on the end (only sra/srai/sub use it)
+    if op == OP_R or (op == OP_I and funct3 == 5):
+        alu = f"{funct3:03b}{(word >> 30) & 1}"
+    elif op == OP_I:
+        alu = f"{funct3:03b}0"
+    elif op in (OP_LUI, OP_SYSTEM):
+        alu = None
+    return Decoded(word, op, (word >> 7) & 0x1F, (word >> 15) & 0x1F,
+                   (word >> 20) & 0x1F, funct3, imm, alu)
+
+
+def check_counter_read(inst):
+    """
+    Raises ValueError unless the system instruction `inst` (a Decoded) is a
+    counter read (csrrs rd, csr, x0 of one of the CSR_* counters), the only
+    system instructions the simulator runs.
+    """
+    if inst.funct3 != FUNCT3_CSRRS or inst.rs1 or \
+            inst.imm not in (CSR_CYCLE, CSR_TIME, CSR_INSTRET,
+                             CSR_CYCLEH, CSR_TIMEH, CSR_INSTRETH):
+        raise ValueError(f"Unsupported system instruction: {inst.word:08x}")
+
+
+def is_halt(word):
+    """returns True if the instruction `word` (an int) is ecall or ebreak"""
+    return word == WORD_ECALL or word == WORD_EBREAK
+
+
+def halt_reason(word):
+    """
+    Returns why the instruction `word` (an int), having left the pc at
+    itself, stopped the machine: ecall, ebreak or a jump to itself (nothing
+    can change after that, the loop never ends).
+    """
+    if word == WORD_ECALL:
+        return HALT_ECALL
+    if word == WORD_EBREAK:
+        return HALT_EBREAK
+    return HALT_SELF_LOOP
+
+
+def read_counter(inst, cycles, instret):
+    """
+    Returns the value the counter read `inst` gives when the machine has
+    run `cycles` cycles and retired `instret` instructions.
+    """
+    check_counter_read(inst)
+    csr = inst.imm
+    value = instret if csr & 0x7F == CSR_INSTRET & 0x7F else cycles
+    if csr & 0x80:  # the h versions read the top half
+        value >>= 32
+    return value & 0xFFFFFFFF
+
+
+class DecodeCache:
+    """
+    Cache of decoded instructions keyed by the instruction word. Decoding
+    only depends on the word, so a record is good wherever the word is and
+    loading a new program does not need a flush.
+
+    Attributes:
+        records: Dict of word to Decoded, hot loops can read it directly.
+        hits: Number of lookups that were already decoded.
+        misses: Number of lookups that had to be decoded.
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, word):
+        """
+        Returns the Decoded record for the instruction `word` (an int),
+        decoding it the first time it is seen.
+        """
+        record = self.records.get(word)
+        if record is not None:
+            self.hits += 1
+            return record
+        self.misses += 1
+        record = decode(word)
+        self.records[word] = record
+        return record
+
+    def preload(self, program):
+        """
+        Fills the cache with every instruction of a
+        vector_decode.DecodedProgram, so the first fetches do not miss.
+        """
+        for index in range(len(program)):
+            record = program.record(index)
+            if record is not None:
+                self.records[record.word] = record
+
+    def preload_words(self, words):
+        """
+        Decodes every instruction word in `words` into the cache one at a
+        time (for when numpy is not there for preload). Words that do not
+        decode are left for lookup to raise on.
+        """
+        records = self.records
+        for word in set(words):
+            if word and word not in records:
+                try:
+                    records[word] = decode(word)
+                except ValueError:
+                    pass
+
+    def clear(self):
+        """drops every cached record and resets the counters"""
+        self.records = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.records)
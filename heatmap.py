@@ -0,0 +1,140 @@
+"""
+Execution heat map for the RISC-V simulator. The models count how many
+times each pc runs in an array indexed by pc >> 2, and HeatReport maps the
+counts back to the assembly (AssemblyProgram.parsed_lines and labels) to
+show the hot lines and the hot labels. Reports export as JSON or as an
+annotated memh listing like the one AssemblyProgram.write_mem writes.
+"""
+import json
+from array import array
+
+
+class HeatMap:
+    """
+    Execution counts per pc.
+
+    Attributes:
+        counts: Array of counts indexed by pc >> 2 (grows when a pc past
+            the end runs).
+    """
+
+    def __init__(self, size=1024):
+        self.counts = array('Q', bytes(8 * size))
+
+    def hit(self, pc):
+        """counts one run of the instruction at pc (an int)"""
+        index = pc >> 2
+        try:
+            self.counts[index] += 1
+        except IndexError:
+            self.counts.extend(bytes(8 * max(index + 1, 2 * len(self.counts))
+                                     - 8 * len(self.counts)))
+            self.counts[index] += 1
+
+    def count(self, pc):
+        """returns how many times the instruction at pc ran"""
+        index = pc >> 2
+        return self.counts[index] if index < len(self.counts) else 0
+
+    def total(self):
+        """returns the number of instructions counted"""
+        return sum(self.counts)
+
+    def hot_pcs(self):
+        """returns a list of (pc, count) for every pc that ran, hottest first"""
+        hot = [(index << 2, count) for index, count in enumerate(self.counts) if count]
+        hot.sort(key=lambda item: -item[1])
+        return hot
+
+    def clear(self):
+        """sets every count back to 0"""
+        self.counts = array('Q', bytes(8 * len(self.counts)))
+
+
+class HeatReport:
+    """
+    A heat map matched up with the program it was counted on.
+
+    Attributes:
+        total: The number of instructions run.
+        lines: List of dicts (pc, line, source, label, count, percent) for
+            every line that ran, hottest first.
+        labels: List of dicts (label, pc, instructions, count, percent)
+            for every label, hottest first. A label counts everything from
+            its address up to the next label.
+    """
+
+    def __init__(self, heat, program):
+        """
+        Args:
+            heat: the HeatMap
+            program: the AssemblyProgram the counts are for (the pc of
+                parsed_lines[i] is 4 * i, like return_mem)
+        """
+        self._heat = heat
+        self._program = program
+        self.total = heat.total()
+        labels_at = dict((address, label) for label, address in program.labels.items())
+
+        def percent(count):
+            return round(100 * count / self.total, 2) if self.total else 0.0
+
+        self.lines = []
+        for i, line in enumerate(program.parsed_lines):
+            count = heat.count(4 * i)
+            if count:
+                self.lines.append({
+                    "pc": 4 * i,
+                    "line": line["line_number"],
+                    "source": line["original"],
+                    "label": labels_at.get(4 * i),
+                    "count": count,
+                    "percent": percent(count),
+                })
+        self.lines.sort(key=lambda line: (-line["count"], line["pc"]))
+
+        self.labels = []
+        starts = sorted(program.labels.items(), key=lambda item: item[1])
+        end = 4 * len(program.parsed_lines)
+        for i, (label, start) in enumerate(starts):
+            stop = starts[i + 1][1] if i + 1 < len(starts) else end
+            count = sum(heat.count(pc) for pc in range(start, stop, 4))
+            self.labels.append({
+                "label": label,
+                "pc": start,
+                "instructions": max(0, (stop - start) // 4),
+                "count": count,
+                "percent": percent(count),
+            })
+        self.labels.sort(key=lambda label: (-label["count"], label["pc"]))
+
+    def to_json(self, indent=2):
+        """returns the report as a JSON string"""
+        return json.dumps({"total": self.total, "lines": self.lines,
+                           "labels": self.labels}, indent=indent)
+
+    def listing(self):
+        """
+        returns the program as a memh listing with the pc, line and source
+        of every instruction (like write_mem) followed by its count
+        """
+        memory = self._program.return_mem()
+        out = []
+        for i, line in enumerate(self._program.parsed_lines):
+            address = 4 * i
+            count = self._heat.count(address)
+            percent = 100 * count / self.total if self.total else 0.0
+            out.append(f"{memory[address].hex} // PC={hex(address)} "
+                       f"line={line['line_number']}: {line['original']}"
+                       f" // count={count} ({percent:.2f}%)")
+        return "\n".join(out) + "\n"
+
+    def write_json(self, fn):
+        """writes the JSON report to a file"""
+        with open(fn, "w") as f:
+            f.write(self.to_json())
+
+    def write_listing(self, fn):
+        """writes the annotated listing to a file"""
+        with open(fn, "w") as f:
+            f.write(self.listing())
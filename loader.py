@@ -0,0 +1,132 @@
+"""
+Loads data and program images from files into the controller's memories.
+
+Raw binaries are mapped into the data memory with mmap, so nothing is read
+up front: guest loads read the file's pages through the mapping the first
+time they touch them, and loading costs the same whatever the size of the
+file. The mapping is copy on write by default (the guest can store to it but
+the file never changes) or shared (guest stores are written to the file).
+
+memh files are text (hex words, one or more per line, with // comments and
+@address lines giving the word address of the next word, like $readmemh)
+so they are parsed and written into the memory. A loaded program is decoded
+into the model's decode cache (see Controller.preload_decode_cache).
+"""
+import mmap
+import os
+import struct
+
+from memory import InstructionMemory
+
+# file extensions that are read as memh, anything else is a raw binary
+MEMH_EXTENSIONS = ('.memh', '.mem', '.hex')
+
+_WORD = struct.Struct("<I")
+
+
+def is_memh(filename):
+    """returns True if the file is read as memh (by its extension)"""
+    return os.path.splitext(filename)[1].lower() in MEMH_EXTENSIONS
+
+
+def _map_file(filename, shared):
+    """an mmap of the whole file (None if it is empty), copy on write unless shared"""
+    with open(filename, "r+b" if shared else "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return None
+        # the mapping stays valid after the file is closed
+        return mmap.mmap(f.fileno(), size,
+                         access=mmap.ACCESS_WRITE if shared else mmap.ACCESS_COPY)
+
+
+def map_binary(memory, filename, address=0, shared=False):
+    """
+    Maps a raw binary file into a data memory at address (page aligned)
+    without copying it, guest loads read straight from the mapping.
+    Memories that can not map buffers (FlatMemory) get a copy instead.
+    Returns the number of bytes mapped.
+    """
+    mapped = _map_file(filename, shared)
+    if mapped is None:
+        return 0
+    if hasattr(memory, "map"):
+        memory.map(address, mapped)
+    else:
+        memory.write_bytes(address, mapped)
+        mapped.close()
+    return len(mapped)
+
+
+def parse_memh(text):
+    """
+    Yields (word address, word) for every word in memh text. Words follow
+    each other from word address 0 or from the last @address line.
+    """
+    index = 0
+    for line in text.splitlines():
+        for token in line.split("//")[0].split():
+            if token.startswith("@"):
+                index = int(token[1:], 16)
+                continue
+            yield index, int(token, 16)
+            index += 1
+
+
+def load_memh(memory, filename, address=0):
+    """
+    Writes the words of a memh file into a data memory, word address 0 is
+    at address. Returns the number of words written.
+    """
+    with open(filename) as f:
+        text = f.read()
+    count = 0
+    run = bytearray()
+    start = None
+    for index, word in parse_memh(text):
+        # write contiguous words with one write_bytes
+        if start is None or index != start + len(run) // 4:
+            if run:
+                memory.write_bytes(address + 4 * start, run)
+            run = bytearray()
+            start = index
+        run += _WORD.pack(word & 0xFFFFFFFF)
+        count += 1
+    if run:
+        memory.write_bytes(address + 4 * start, run)
+    return count
+
+
+def load_data(controller, filename, address=0, shared=False):
+    """
+    Loads a data image (memh or raw binary, by the file's extension) into
+    the controller's data memory at address. Raw binaries are mapped, see
+    map_binary. Returns the number of bytes loaded.
+    """
+    if is_memh(filename):
+        return 4 * load_memh(controller.data_memory, filename, address)
+    return map_binary(controller.data_memory, filename, address, shared)
+
+
+def load_program(controller, filename, address=0):
+    """
+    Loads a program image (memh or raw little endian binary, by the file's
+    extension) at address into a new instruction memory that replaces the
+    controller's (so the block model drops blocks translated from the old
+    one), and preloads the model's decode cache with it.
+    Returns the number of instructions loaded.
+    """
+    memory = InstructionMemory()
+    if is_memh(filename):
+        with open(filename) as f:
+            words = list(parse_memh(f.read()))
+    else:
+        with open(filename, "rb") as f:
+            data = f.read()
+        data += bytes(-len(data) % 4)
+        words = [(i, word) for i, (word,) in enumerate(_WORD.iter_unpack(data))]
+    for index, word in words:
+        memory[address + 4 * index] = word & 0xFFFFFFFF
+    controller.instruction_memory = memory
+    controller.preload_decode_cache()
+    return len(words)
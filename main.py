@@ -1,11 +1,144 @@
+"""
+Command line entry point for the RISC-V simulator.
+
+With no arguments it starts the interactive line by line prompt. Given an
+assembly (.s) file or a program image (memh, or a raw binary) it runs it
+headless, with no drawing between instructions, until the program halts
+(ecall, ebreak, a jump to itself or the end of the program) or the
+instruction budget runs out, then prints the final registers as text or
+JSON. The exit code says how the run ended (see the EXIT_* constants).
+"""
+import argparse
+import contextlib
+import json
+import sys
+import time
+
 from controller import Controller
-from cpu_view import TextView
-from model import MVP_Model
-from register_file import RegisterFile
-
-model = MVP_Model(register_file=RegisterFile())
-view = TextView(model)
-controller = Controller(model, view)
-# file = controller.prompt.get_file()
-controller.run()  # file)
-None
+from cpu_view import NullView, TextView
+from loader import load_program
+from model import MVP_Model, Functional_Model, Block_Model, STOP_MAX_INSTRUCTIONS
+from register_file import CompactRegisterFile
+from tracing import TextSink, TRACE_CYCLE, TRACE_LEVELS
+
+MODELS = {
+    'mvp': MVP_Model,
+    'functional': Functional_Model,
+    'block': Block_Model,
+}
+
+# exit codes (argparse exits with 2 for bad arguments)
+EXIT_HALTED = 0  # the program halted
+EXIT_ERROR = 1  # the file could not be loaded or an instruction failed
+EXIT_BUDGET = 3  # ran out of instructions before halting
+
+
+def interactive():
+    """the line by line prompt"""
+    model = MVP_Model(register_file=CompactRegisterFile())
+    # show the pc and fsm state every cycle, written straight away
+    model.set_trace(TextSink(level=TRACE_CYCLE, buffer_lines=1))
+    view = TextView(model)
+    controller = Controller(model, view)
+    controller.run()
+    return EXIT_HALTED
+
+
+def stats(model, summary, seconds):
+    """returns the stats of a run as a dict"""
+    counters = model.counters()
+    cache = model.decode_cache
+    return {
+        "cycles": counters.cycles,
+        "instret": counters.instret,
+        "cpi": round(counters.cpi, 4),
+        "op_mix": counters.op_mix,
+        "decode_cache": {"hits": cache.hits, "misses": cache.misses},
+        "seconds": round(seconds, 6),
+        "instructions_per_second": int(summary.instructions / seconds) if seconds else 0,
+    }
+
+
+def report(model, summary, run_stats, output_format, out):
+    """writes the final registers (and stats if there are any) to out"""
+    if output_format == "json":
+        result = {
+            "stop_reason": summary.stop_reason,
+            "instructions": summary.instructions,
+            # MVP cycles whatever the model, like --stats
+            "cycles": model.counters().cycles,
+            "pc": summary.pc,
+            "registers": [model.read_register(i) for i in range(32)],
+        }
+        if run_stats is not None:
+            result["stats"] = run_stats
+        out.write(json.dumps(result) + "\n")
+        return
+    lines = [repr(model.get_registers),
+             f"Stopped: {summary.stop_reason} after {summary.instructions} "
+             f"instructions, pc {summary.pc:#010x}"]
+    if run_stats is not None:
+        lines.append(f"cycles: {run_stats['cycles']}  instret: {run_stats['instret']}  "
+                     f"cpi: {run_stats['cpi']:.2f}")
+        lines.append("op mix: " + ", ".join(f"{name} {count}" for name, count
+                                            in run_stats["op_mix"].items() if count))
+        lines.append(f"decode cache: {run_stats['decode_cache']['hits']} hits, "
+                     f"{run_stats['decode_cache']['misses']} misses")
+        lines.append(f"time: {run_stats['seconds']:.3f}s "
+                     f"({run_stats['instructions_per_second']} instructions/s)")
+    out.write("\n".join(lines) + "\n")
+
+
+def run_file(args, out=None):
+    """runs a file headless, returns the exit code"""
+    out = out if out is not None else sys.stdout
+    model = MODELS[args.model](register_file=CompactRegisterFile())
+    if args.trace != "off":
+        # the trace goes to stderr so it does not mix with the results
+        model.set_trace(TextSink(stream=sys.stderr, level=TRACE_LEVELS[args.trace]))
+    controller = Controller(model, NullView(model))
+    # the assembler and controller print as they go, keep stdout for the results
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            if args.file.endswith(".s"):
+                controller.load_program(args.file)
+            else:
+                load_program(controller, args.file)
+        except (OSError, ValueError) as e:
+            print(f"error: could not load {args.file}: {e}")
+            return EXIT_ERROR
+        start = time.perf_counter()
+        try:
+            summary = controller.run_batch(max_instructions=args.max_instructions or None)
+        except Exception as e:  # anything an instruction raises
+            print(f"error: {type(e).__name__}: {e} at pc {model.get_pc.uint:#010x}")
+            return EXIT_ERROR
+        seconds = time.perf_counter() - start
+    run_stats = stats(model, summary, seconds) if args.stats else None
+    report(model, summary, run_stats, args.format, out)
+    return EXIT_BUDGET if summary.stop_reason == STOP_MAX_INSTRUCTIONS else EXIT_HALTED
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="RISC-V simulator. Runs FILE headless, or starts the "
+                    "line by line prompt if no file is given.")
+    parser.add_argument("file", nargs="?",
+                        help="assembly (.s), memh (.memh, .mem, .hex) or raw binary program")
+    parser.add_argument("-n", "--max-instructions", type=int, default=10_000_000,
+                        help="instruction budget, 0 for none (default 10000000)")
+    parser.add_argument("--model", choices=sorted(MODELS), default="functional")
+    parser.add_argument("--trace", choices=list(TRACE_LEVELS), default="off",
+                        help="trace level, the trace is written to stderr (default off)")
+    parser.add_argument("--format", choices=["text", "json"], default="text",
+                        help="how the final registers are printed (default text)")
+    parser.add_argument("--stats", action="store_true",
+                        help="print cycles, cpi, op mix and run time as well")
+    args = parser.parse_args(argv)
+    if args.file is None:
+        return interactive()
+    return run_file(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
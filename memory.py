@@ -0,0 +1,455 @@
+"""
+Data memory for the RISC-V simulator. Little endian and byte addressable,
+with byte, halfword and word accessors that read and write the backing
+buffer in place with precompiled structs, so an access makes no slices,
+BitArrays or other objects besides the int it returns.
+
+There are two kinds. FlatMemory is one buffer, a bytearray when it is small
+and an anonymous private mapping when it is big, which the OS fills with
+zero pages on first touch. PagedMemory (the controller's default) covers the
+whole 32 bit address space with a table of 4 KiB pages that are made when
+they are first written, so a program that touches a few scattered MB costs
+a few MB, and it can say which pages are resident.
+
+Instruction memory is separate, an InstructionMemory holds the program as
+an array of words indexed by pc >> 2.
+"""
+import mmap
+import struct
+from array import array
+
+from bitstring import BitArray
+
+MASK32 = 0xFFFFFFFF
+
+# the load and store widths by funct3 (lb, lh, lw, lbu, lhu and sb, sh, sw)
+FUNCT3_B = 0
+FUNCT3_H = 1
+FUNCT3_W = 2
+FUNCT3_BU = 4
+FUNCT3_HU = 5
+
+# bytes a store of each funct3 writes
+STORE_WIDTHS = {FUNCT3_B: 1, FUNCT3_H: 2, FUNCT3_W: 4}
+
+# memories bigger than this are mapped instead of allocated
+MAP_THRESHOLD = 1 << 24
+
+# bytes in a page, the unit segments() and clear() work in
+PAGE_SIZE = 4096
+
+# the instruction array runs from pc 0, so instructions above this are
+# refused instead of allocating everything below them (64 MiB of array)
+MAX_PROGRAM_ADDRESS = 1 << 26
+
+_WORD = struct.Struct("<I")
+_HALF = struct.Struct("<H")
+_BYTE = struct.Struct("<B")
+
+# the struct and size of each load (signed for lb and lh) and the struct,
+# size and value mask of each store
+_LOADS = {
+    FUNCT3_B: (struct.Struct("<b"), 1),
+    FUNCT3_H: (struct.Struct("<h"), 2),
+    FUNCT3_W: (_WORD, 4),
+    FUNCT3_BU: (_BYTE, 1),
+    FUNCT3_HU: (_HALF, 2),
+}
+_STORES = {
+    FUNCT3_B: (_BYTE, 1, 0xFF),
+    FUNCT3_H: (_HALF, 2, 0xFFFF),
+    FUNCT3_W: (_WORD, 4, MASK32),
+}
+
+
+def _buffer(size):
+    """a zeroed writable buffer of size bytes"""
+    if size <= MAP_THRESHOLD:
+        return bytearray(size)
+    flags = mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS | getattr(mmap, "MAP_NORESERVE", 0)
+    return mmap.mmap(-1, size, flags=flags)
+
+
+class Memory:
+    """
+    Base class for the data memories, the accessors here are built on the
+    load, store and segments every memory has.
+    """
+
+    def read_word(self, addr):
+        """returns the 32 bit word at addr (unsigned)"""
+        return self.load(addr, FUNCT3_W)
+
+    def read_half(self, addr):
+        """returns the 16 bit halfword at addr (unsigned)"""
+        return self.load(addr, FUNCT3_HU)
+
+    def read_byte(self, addr):
+        """returns the byte at addr (unsigned)"""
+        return self.load(addr, FUNCT3_BU)
+
+    def write_word(self, addr, value):
+        """writes the low 32 bits of value at addr"""
+        self.store(addr, value, FUNCT3_W)
+
+    def write_half(self, addr, value):
+        """writes the low 16 bits of value at addr"""
+        self.store(addr, value, FUNCT3_H)
+
+    def write_byte(self, addr, value):
+        """writes the low 8 bits of value at addr"""
+        self.store(addr, value, FUNCT3_B)
+
+    def words(self):
+        """returns a dict of {address: word} for every aligned non-zero word"""
+        out = {}
+        for addr, chunk in self.segments():
+            for i, (word,) in enumerate(_WORD.iter_unpack(chunk[:len(chunk) & ~3])):
+                if word:
+                    out[addr + 4 * i] = word
+        return out
+
+
+class FlatMemory(Memory):
+    """
+    A flat little endian memory of `size` bytes starting at address `base`.
+    Every byte reads 0 until it is written. Accesses do not have to be
+    aligned. Accesses outside the memory raise IndexError, except that a
+    memory covering the whole 32 bit address space wraps around at the top
+    like the address arithmetic does.
+
+    Attributes:
+        base: The address of the first byte.
+        size: The number of bytes.
+    """
+
+    def __init__(self, size=1 << 32, base=0):
+        self.base = base
+        self.size = size
+        self._data = _buffer(size)
+        self._wraps = base == 0 and size == 1 << 32
+        self._pages = set()  # pages that have been written (by offset >> 12)
+
+    def _span(self, addr, n):
+        """
+        the buffer offset of an n byte access at addr and how many of its
+        bytes come before the top (the rest wrap around to the bottom)
+        """
+        offset = addr - self.base
+        if self._wraps:
+            offset &= MASK32
+            return offset, min(n, self.size - offset)
+        if offset < 0 or offset + n > self.size:
+            raise IndexError(f"Address {addr:#x} is outside data memory")
+        return offset, n
+
+    def load(self, addr, funct3=FUNCT3_W):
+        """
+        returns the value a load with this funct3 (lb, lh, lw, lbu or lhu)
+        reads from addr, sign extended to 32 bits as an unsigned int
+        """
+        try:
+            unpack, n = _LOADS[funct3]
+        except KeyError:
+            raise ValueError(f"Unsupported load width: funct3={funct3}")
+        offset = addr - self.base
+        if offset < 0 or offset + n > self.size:
+            return unpack.unpack(self.read_bytes(addr, n))[0] & MASK32
+        return unpack.unpack_from(self._data, offset)[0] & MASK32
+
+    def store(self, addr, value, funct3=FUNCT3_W):
+        """writes the low bytes of value (an int) for a sb, sh or sw at addr"""
+        try:
+            pack, n, mask = _STORES[funct3]
+        except KeyError:
+            raise ValueError(f"Unsupported store width: funct3={funct3}")
+        offset = addr - self.base
+        if offset < 0 or offset + n > self.size:
+            self.write_bytes(addr, pack.pack(value & mask))
+            return
+        pack.pack_into(self._data, offset, value & mask)
+        self._pages.add(offset >> 12)
+        if ((offset + n - 1) ^ offset) >> 12:  # ran onto the next page
+            self._pages.add((offset + n - 1) >> 12)
+
+    def read_bytes(self, addr, n):
+        """returns n bytes starting at addr"""
+        offset, fits = self._span(addr, n)
+        data = bytes(self._data[offset:offset + fits])
+        if fits < n:
+            data += bytes(self._data[:n - fits])
+        return data
+
+    def write_bytes(self, addr, data):
+        """writes the bytes of data starting at addr"""
+        n = len(data)
+        offset, fits = self._span(addr, n)
+        for start, chunk in ((offset, data[:fits]), (0, data[fits:])):
+            if chunk:
+                self._data[start:start + len(chunk)] = chunk
+                for page in range(start >> 12, ((start + len(chunk) - 1) >> 12) + 1):
+                    self._pages.add(page)
+
+    def segments(self):
+        """
+        yields (address, bytes) for every page that has been written and is
+        not all zeros, in address order
+        """
+        zero = bytes(PAGE_SIZE)
+        for page in sorted(self._pages):
+            offset = page * PAGE_SIZE
+            chunk = bytes(self._data[offset:min(offset + PAGE_SIZE, self.size)])
+            if chunk != zero[:len(chunk)]:
+                yield self.base + offset, chunk
+
+    def clear(self):
+        """sets every byte back to 0"""
+        for page in self._pages:
+            offset = page * PAGE_SIZE
+            end = min(offset + PAGE_SIZE, self.size)
+            self._data[offset:end] = bytes(end - offset)
+        self._pages = set()
+
+
+class PagedMemory(Memory):
+    """
+    A sparse little endian memory covering the whole 32 bit address space.
+    Pages are bytearrays made the first time something is written to them,
+    reading a page that was never written gives 0 without making it. The
+    last page used is kept aside so runs of accesses to the same page skip
+    the page table. Accesses do not have to be aligned and wrap around at
+    the top of the address space.
+
+    Buffers (like an mmap of a file, see loader.py) can be mapped in with
+    map(), their pages become views of the buffer the first time they are
+    used so mapping is the same cost whatever the size.
+    """
+
+    def __init__(self):
+        self._pages = {}  # page number (address >> 12) -> bytearray or view
+        self._regions = []  # (first page, page after the last, buffer)
+        self._last_page = -1
+        self._last = None
+
+    def map(self, address, buffer):
+        """
+        Puts a writable buffer (bytearray, mmap, ...) into the address space
+        at address (which has to be page aligned) without copying it. Guest
+        stores write to the buffer. A part page at the end is copied when
+        it is first used, so writes to that page do not reach the buffer.
+        """
+        if address & (PAGE_SIZE - 1):
+            raise ValueError(f"Mapping address {address:#x} is not page aligned")
+        if address < 0 or address + len(buffer) > 1 << 32:
+            raise ValueError("Mapping does not fit in the address space")
+        first = address >> 12
+        stop = first + (len(buffer) + PAGE_SIZE - 1) // PAGE_SIZE
+        # the mapping replaces whatever was there
+        for page in [page for page in self._pages if first <= page < stop]:
+            del self._pages[page]
+        self._regions = [region for region in self._regions
+                         if region[1] <= first or region[0] >= stop]
+        self._regions.append((first, stop, memoryview(buffer)))
+        self._last_page = -1
+        self._last = None
+
+    def _page(self, page, make):
+        """
+        the bytearray (or view) of a page, None if it was never written and
+        not make
+        """
+        data = self._pages.get(page)
+        if data is None:
+            for first, stop, view in self._regions:
+                if first <= page < stop:
+                    data = view[(page - first) * PAGE_SIZE:(page - first + 1) * PAGE_SIZE]
+                    if len(data) < PAGE_SIZE:
+                        data = bytearray(data) + bytes(PAGE_SIZE - len(data))
+                    break
+            else:
+                if not make:
+                    return None
+                data = bytearray(PAGE_SIZE)
+            self._pages[page] = data
+        self._last_page = page
+        self._last = data
+        return data
+
+    def load(self, addr, funct3=FUNCT3_W):
+        """
+        returns the value a load with this funct3 (lb, lh, lw, lbu or lhu)
+        reads from addr, sign extended to 32 bits as an unsigned int
+        """
+        try:
+            unpack, n = _LOADS[funct3]
+        except KeyError:
+            raise ValueError(f"Unsupported load width: funct3={funct3}")
+        offset = addr & 0xFFF
+        if offset + n > PAGE_SIZE:  # runs onto the next page
+            return unpack.unpack(self.read_bytes(addr, n))[0] & MASK32
+        page = (addr & MASK32) >> 12
+        if page == self._last_page:
+            data = self._last
+        else:
+            data = self._page(page, False)
+            if data is None:
+                return 0
+        return unpack.unpack_from(data, offset)[0] & MASK32
+
+    def store(self, addr, value, funct3=FUNCT3_W):
+        """writes the low bytes of value (an int) for a sb, sh or sw at addr"""
+        try:
+            pack, n, mask = _STORES[funct3]
+        except KeyError:
+            raise ValueError(f"Unsupported store width: funct3={funct3}")
+        offset = addr & 0xFFF
+        if offset + n > PAGE_SIZE:
+            self.write_bytes(addr, pack.pack(value & mask))
+            return
+        page = (addr & MASK32) >> 12
+        data = self._last if page == self._last_page else self._page(page, True)
+        pack.pack_into(data, offset, value & mask)
+
+    def read_bytes(self, addr, n):
+        """returns n bytes starting at addr"""
+        out = bytearray()
+        while len(out) < n:
+            addr &= MASK32
+            offset = addr & 0xFFF
+            chunk = min(n - len(out), PAGE_SIZE - offset)
+            data = self._page(addr >> 12, False)
+            out += bytes(chunk) if data is None else data[offset:offset + chunk]
+            addr += chunk
+        return bytes(out)
+
+    def write_bytes(self, addr, data):
+        """writes the bytes of data starting at addr"""
+        done = 0
+        while done < len(data):
+            addr &= MASK32
+            offset = addr & 0xFFF
+            chunk = min(len(data) - done, PAGE_SIZE - offset)
+            self._page(addr >> 12, True)[offset:offset + chunk] = data[done:done + chunk]
+            addr += chunk
+            done += chunk
+
+    def segments(self):
+        """
+        yields (address, bytes) for every page that has been written and is
+        not all zeros, in address order
+        """
+        zero = bytes(PAGE_SIZE)
+        pages = set(self._pages)
+        for first, stop, view in self._regions:
+            pages.update(range(first, stop))
+        for page in sorted(pages):
+            data = self._page(page, False)
+            if data != zero:
+                yield page << 12, bytes(data)
+
+    def resident_pages(self):
+        """
+        returns the addresses of the pages that are in memory (written or
+        used from a mapping), in order
+        """
+        return [page << 12 for page in sorted(self._pages)]
+
+    def resident_bytes(self):
+        """returns how many bytes of pages are in memory"""
+        return len(self._pages) * PAGE_SIZE
+
+    def clear(self):
+        """drops every page and mapping"""
+        self._pages = {}
+        self._regions = []
+        self._last_page = -1
+        self._last = None
+
+
+class InstructionMemory:
+    """
+    The program as an array('I') of instruction words indexed by pc >> 2,
+    so a fetch is a bounds check and an index. A word of 0 (which is not a
+    valid instruction) means there is no instruction at that pc.
+
+    It also works like the {pc: BitArray} dicts AssemblyProgram.return_mem
+    gives (get, [], in, items, ...) for code that wants BitArrays, like the
+    MVP and TextView. Those BitArrays are made the first time they are
+    asked for and kept until the word changes.
+
+    Attributes:
+        words: The array of instruction words.
+    """
+
+    def __init__(self, memory=None):
+        """
+        Args:
+            memory: optional {pc: BitArray or int} to fill it from
+        """
+        self.words = array('I')
+        self._bits = {}
+        if memory:
+            for pc, bits in memory.items():
+                self[pc] = bits
+
+    def word(self, pc):
+        """returns the instruction word at pc as an int, or None"""
+        index = pc >> 2
+        if pc & 3 or index >= len(self.words):
+            return None
+        return self.words[index] or None
+
+    def get(self, pc, default=None):
+        """returns the instruction at pc as a BitArray, or default"""
+        bits = self._bits.get(pc)
+        if bits is None:
+            word = self.word(pc)
+            if word is None:
+                return default
+            bits = self._bits[pc] = BitArray(uint=word, length=32)
+        return bits
+
+    def __getitem__(self, pc):
+        bits = self.get(pc)
+        if bits is None:
+            raise KeyError(pc)
+        return bits
+
+    def __setitem__(self, pc, bits):
+        """
+        sets the instruction at pc (a BitArray or an int). Raises
+        ValueError if pc is not word aligned or is MAX_PROGRAM_ADDRESS or
+        above.
+        """
+        if pc & 3:
+            raise ValueError(f"Instruction address {pc:#x} is not word aligned")
+        if pc >= MAX_PROGRAM_ADDRESS:
+            raise ValueError(f"Instruction address {pc:#x} is too high, programs "
+                             f"have to be below {MAX_PROGRAM_ADDRESS:#x}")
+        index = pc >> 2
+        words = self.words
+        if index >= len(words):
+            words.frombytes(bytes(4 * (index + 1 - len(words))))
+        words[index] = bits if isinstance(bits, int) else bits.uint
+        self._bits.pop(pc, None)
+
+    def __contains__(self, pc):
+        return self.word(pc) is not None
+
+    def __iter__(self):
+        """the pcs that hold an instruction, in order"""
+        for index, word in enumerate(self.words):
+            if word:
+                yield index << 2
+
+    def __len__(self):
+        return len(self.words) - self.words.count(0)
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[pc] for pc in self]
+
+    def items(self):
+        return [(pc, self[pc]) for pc in self]
@@ -0,0 +1,220 @@
+"""
+Memory mapped I/O for the RISC-V simulator. A Bus sits between the models
+(the MVP's MemRead/MemWrite states, the functional models' loads and stores)
+and the data memory, and sends accesses in device regions to the device.
+
+Devices are registered as (base, size, device). The bus keeps the set of
+pages any device region touches, so a RAM access is one set lookup before it
+goes to the memory, only accesses to those pages look for the device (a
+bisect over the region bases).
+
+The devices here are a console (a UART like transmit register, output is
+buffered and written out in bulk), a timer (reads the machine's cycle count)
+and an exit register the guest writes its exit code to. A store to the exit
+register raises GuestExit, the models catch it and stop with the 'exit'
+halt reason once the store has retired.
+"""
+import sys
+from bisect import bisect_right
+
+from memory import Memory, FUNCT3_B, FUNCT3_H, FUNCT3_W, FUNCT3_BU, FUNCT3_HU
+
+# where add_default_devices puts the devices
+CONSOLE_BASE = 0x1000_0000
+TIMER_BASE = 0x0200_0000
+EXIT_BASE = 0x0010_0000
+
+# bytes a load or store of each funct3 reads or writes, and whether it is
+# sign extended
+_SIZES = {FUNCT3_B: 1, FUNCT3_H: 2, FUNCT3_W: 4, FUNCT3_BU: 1, FUNCT3_HU: 2}
+_SIGNED = (FUNCT3_B, FUNCT3_H)
+
+
+class GuestExit(Exception):
+    """raised by a store to the exit register, the store has been done"""
+
+    def __init__(self, code):
+        super().__init__(f"guest exited with {code}")
+        self.code = code
+
+
+class Device:
+    """
+    Base class for devices. Offsets are from the start of the device's
+    region, size is the width of the access in bytes.
+    """
+
+    def read(self, offset, size):
+        """returns the value (an unsigned int) of a load from the device"""
+        return 0
+
+    def write(self, offset, value, size):
+        """takes a store to the device (value is masked to size bytes)"""
+        pass
+
+    def flush(self):
+        """writes out anything the device has buffered"""
+        pass
+
+
+class ConsoleDevice(Device):
+    """
+    A transmit only UART. A byte stored at offset 0 is output, a load from
+    offset 4 (status) reads 1 (always ready). Output is kept in a buffer and
+    written to `out` (stdout by default) when it gets to `buffer_size` bytes
+    or on flush.
+    """
+    TX = 0
+    STATUS = 4
+
+    def __init__(self, out=None, buffer_size=4096):
+        self.out = out
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+
+    def read(self, offset, size):
+        return 1 if offset == self.STATUS else 0
+
+    def write(self, offset, value, size):
+        if offset == self.TX:
+            self.buffer.append(value & 0xFF)
+            if len(self.buffer) >= self.buffer_size:
+                self.flush()
+
+    def flush(self):
+        if self.buffer:
+            out = self.out if self.out is not None else sys.stdout
+            out.write(self.buffer.decode(errors="replace"))
+            out.flush()
+            self.buffer = bytearray()
+
+
+class TimerDevice(Device):
+    """
+    A free running 64 bit timer, offset 0 reads the low word and offset 4
+    the high word. It counts whatever `clock` (a function returning an int)
+    does, add_default_devices uses the model's cycle count.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+
+    def read(self, offset, size):
+        return (self.clock() >> (8 * offset)) & ((1 << (8 * size)) - 1)
+
+
+class ExitDevice(Device):
+    """
+    The guest stores its exit code at offset 0 to stop. The store raises
+    GuestExit, which the models turn into the 'exit' halt reason.
+
+    Attributes:
+        exited: True once the guest has written the exit register.
+        code: The exit code written.
+    """
+
+    def __init__(self):
+        self.exited = False
+        self.code = None
+
+    def write(self, offset, value, size):
+        if offset == 0:
+            self.exited = True
+            self.code = value
+            raise GuestExit(value)
+
+
+class Bus(Memory):
+    """
+    Address decoding in front of a data memory. It has the same interface
+    as the memories (load, store, read_bytes, ...) so it can stand in for
+    the controller's data_memory. read_bytes, write_bytes, segments and
+    clear (what undo and checkpoints use) only see the RAM.
+
+    Attributes:
+        ram: The memory behind the bus.
+    """
+
+    def __init__(self, ram):
+        self.ram = ram
+        self._bases = []  # sorted region bases
+        self._regions = []  # (base, end, device) in the same order
+        self._device_pages = set()
+
+    def add_device(self, base, size, device):
+        """maps device at [base, base + size), regions can not overlap"""
+        for start, end, _ in self._regions:
+            if base < end and start < base + size:
+                raise ValueError(f"Device region at {base:#x} overlaps the one at {start:#x}")
+        i = bisect_right(self._bases, base)
+        self._bases.insert(i, base)
+        self._regions.insert(i, (base, base + size, device))
+        self._device_pages.update(range(base >> 12, ((base + size - 1) >> 12) + 1))
+        return device
+
+    def device_at(self, addr):
+        """returns (base, device) for the region holding addr, or None"""
+        if addr >> 12 not in self._device_pages:
+            return None
+        i = bisect_right(self._bases, addr) - 1
+        if i >= 0:
+            base, end, device = self._regions[i]
+            if addr < end:
+                return base, device
+        return None
+
+    @property
+    def devices(self):
+        """returns the list of (base, size, device)"""
+        return [(base, end - base, device) for base, end, device in self._regions]
+
+    def load(self, addr, funct3=FUNCT3_W):
+        if addr >> 12 in self._device_pages:
+            found = self.device_at(addr)
+            if found is not None:
+                size = _SIZES[funct3]
+                value = found[1].read(addr - found[0], size)
+                if funct3 in _SIGNED and value >> (8 * size - 1) & 1:
+                    value -= 1 << (8 * size)
+                return value & 0xFFFFFFFF
+        return self.ram.load(addr, funct3)
+
+    def store(self, addr, value, funct3=FUNCT3_W):
+        if addr >> 12 in self._device_pages:
+            found = self.device_at(addr)
+            if found is not None:
+                size = _SIZES[funct3]
+                found[1].write(addr - found[0], value & ((1 << (8 * size)) - 1), size)
+                return
+        self.ram.store(addr, value, funct3)
+
+    def read_bytes(self, addr, n):
+        return self.ram.read_bytes(addr, n)
+
+    def write_bytes(self, addr, data):
+        self.ram.write_bytes(addr, data)
+
+    def segments(self):
+        return self.ram.segments()
+
+    def clear(self):
+        """clears the RAM (the devices keep their state)"""
+        self.ram.clear()
+
+    def flush(self):
+        """flushes every device (writes out buffered console output)"""
+        for _, _, device in self._regions:
+            device.flush()
+
+
+def add_default_devices(controller, out=None):
+    """
+    Puts a bus in front of the controller's data memory (if there is not
+    one already) with a console, timer and exit device at CONSOLE_BASE,
+    TIMER_BASE and EXIT_BASE. Returns (bus, console, timer, exit).
+    """
+    console = controller.add_device(CONSOLE_BASE, 8, ConsoleDevice(out))
+    timer = controller.add_device(TIMER_BASE, 8, TimerDevice(
+        lambda: controller.model.counters().cycles))
+    exit_device = controller.add_device(EXIT_BASE, 4, ExitDevice())
+    return controller.data_memory, console, timer, exit_device
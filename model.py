@@ -3,21 +3,117 @@ from abc import ABC, abstractmethod
 import bitstring
 from bitstring import BitArray
 
+from tracing import TRACE_OFF, TRACE_CYCLE
+from translator import BlockTranslator, fault_index
+from memory import STORE_WIDTHS
+from mmio import GuestExit
+from register_file import CompactRegisterFile
+from decoder import (DecodeCache, read_counter, is_halt, halt_reason,
+                     MVP_CYCLES, OP_NAMES, OP_L, OP_I, OP_S, OP_R, OP_B, OP_JALR,
+                     OP_JAL, OP_LUI, OP_AUI, OP_SYSTEM, HALT_ECALL, HALT_EBREAK,
+                     HALT_SELF_LOOP)
+
 # bitstring.lsb0 = True
 # BitArray = bitstring.BitArray
 
 
 class Model(ABC):
-    """Abstract class for the model"""
+    """
+    Abstract class for the model
+
+    Attributes:
+        halt_reason: Why the machine stopped (STOP_HALT, STOP_ECALL,
+            STOP_EBREAK, STOP_SELF_LOOP or STOP_EXIT), None while it can
+            still run.
+            Set by the instruction that halts, cleared when stepping again.
+    """
 
     def __init__(self, register_file) -> None:
         self._register_file = register_file
         self._controller = None
+        self._trace = None
+        self._trace_level = TRACE_OFF
+        self._undo = None
+        self._heat = None
+        self.halt_reason = None
 
     def set_controller(self, controller):
         """sets he controller of the memory"""
         self._controller = controller
 
+    def set_trace(self, sink):
+        """
+        sets the trace sink (None turns tracing off). The sink's level is
+        read here, so call this again if the level changes.
+        """
+        self._trace = sink
+        self._trace_level = TRACE_OFF if sink is None else sink.level
+
+    @property
+    def trace(self):
+        """returns the trace sink (or None)"""
+        return self._trace
+
+    def set_undo(self, log):
+        """
+        sets the undo.UndoLog every instruction is recorded in (None turns
+        recording off). step_back and run_back_until need one.
+        """
+        self._undo = log
+
+    @property
+    def undo_log(self):
+        """returns the undo log (or None)"""
+        return self._undo
+
+    def set_heat_map(self, heat):
+        """
+        sets the heatmap.HeatMap that counts how often each pc runs (None
+        turns counting off)
+        """
+        self._heat = heat
+
+    @property
+    def heat_map(self):
+        """returns the heat map (or None)"""
+        return self._heat
+
+    def step_back(self, n=1):
+        """
+        Undoes the last n instructions (an unfinished MVP instruction counts
+        as one). Returns how many were undone, fewer if the log runs out.
+        """
+        log = self._undo
+        undone = 0
+        while undone < n and log:
+            self._undo_instruction(log.pop())
+            undone += 1
+        if undone:
+            self._controller._at_end_of_mem = False
+            self.halt_reason = None
+        return undone
+
+    def run_back_until(self, pc):
+        """
+        Steps back at least once and then until the pc is `pc` (an int) or
+        the log runs out. Returns how many instructions were undone.
+        """
+        undone = 0
+        while self.step_back():
+            undone += 1
+            if self.get_pc.uint == pc:
+                break
+        return undone
+
+    def _undo_memory(self, addr, old):
+        """puts back the data memory bytes from an undo record"""
+        self._controller.data_memory.write_bytes(addr, old)
+
+    @abstractmethod
+    def _undo_instruction(self, record):
+        """puts back the pc, register and memory word from an undo record"""
+        pass
+
     @abstractmethod
     def __repr__(self):
         pass
@@ -36,14 +132,46 @@ class Model(ABC):
     def do_clock(self):
         pass
 
+    @abstractmethod
+    def do_instruction(self):
+        pass
+
     @abstractmethod
     def do_reset(self):
         pass
 
+    @abstractmethod
+    def read_register(self, index):
+        pass
+
+    @abstractmethod
+    def counters(self):
+        """returns a PerfCounters of what has run since the last reset"""
+        pass
+
+    @abstractmethod
+    def reset_counters(self):
+        pass
+
+    @abstractmethod
+    def run_until(self, pc=None, predicate=None, max_instructions=None,
+                  max_cycles=None):
+        pass
+
+    def run(self, max_instructions=None, max_cycles=None):
+        """
+        Runs up to max_instructions instructions or max_cycles cycles (or
+        until the program ends) without stopping to draw. Returns a RunSummary.
+        """
+        return self.run_until(max_instructions=max_instructions,
+                              max_cycles=max_cycles)
+
 
 # the imm value is stored in different ways depending on the instruction, this
 # just standardizes it. None represents 0 and an empty list represents no imm.
 # MSB is a index 0 so the list is reversed
+# (the models use the decoder's shift and mask extractors now, this is kept
+# as the readable reference they are tested against)
 IMM_DICT = {
     # L
     BitArray('0b0000011', length=7).bin: [*range(-32, -20)],
@@ -64,13 +192,110 @@ IMM_DICT = {
         *range(-32, -12), None, None, None, None, None, None, None, None, None, None, None, None]  # aui
 }
 
-# this is the funct3 codes functions for the branch match case
-FUNCT3_BEQ = BitArray('0b000', length=3)
-FUNCT3_BNE = BitArray('0b001', length=3)
-FUNCT3_BLT = BitArray('0b100', length=3)
-FUNCT3_BGE = BitArray('0b101', length=3)
-FUNCT3_BLTU = BitArray('0b110', length=3)
-FUNCT3_BGEU = BitArray('0b111', length=3)
+# this is the funct3 codes functions for the branch
+FUNCT3_BEQ = 0b000
+FUNCT3_BNE = 0b001
+FUNCT3_BLT = 0b100
+FUNCT3_BGE = 0b101
+FUNCT3_BLTU = 0b110
+FUNCT3_BGEU = 0b111
+
+# the 5 bit register addresses the register file takes, by register number
+REG_ADDRS = tuple(BitArray(uint=i, length=5) for i in range(32))
+
+
+# fsm states, the names are only used for display
+STATE_FETCH = 0
+STATE_DECODE = 1
+STATE_MEM_ADR = 2
+STATE_MEM_READ = 3
+STATE_MEM_WRITE_BACK = 4
+STATE_MEM_WRITE = 5
+STATE_EXECUTE_I = 6
+STATE_EXECUTE_R = 7
+STATE_JALR = 8
+STATE_JAL = 9
+STATE_ALU_WRITE_BACK = 10
+STATE_JALR_WRITE_BACK = 11
+STATE_BRANCH = 12
+STATE_AUI = 13
+STATE_LUI = 14
+STATE_CSR = 15
+
+STATE_NAMES = ['Fetch', 'Decode', 'MemAdr', 'MemRead', 'MemWriteBack',
+               'MemWrite', 'Execute I', 'Execute R', 'Jump and link register',
+               'Jump and link', 'alu writeback', 'jalr writeback', 'Branch',
+               'Add Upper Immediate to PC', 'Load Upper Immediate', 'CSR read']
+
+# reasons a batch run can stop
+STOP_MAX_INSTRUCTIONS = 'max instructions'
+STOP_MAX_CYCLES = 'max cycles'
+STOP_PC = 'pc'
+STOP_PREDICATE = 'predicate'
+STOP_HALT = 'halt'  # ran out of instructions
+# an instruction that leaves the pc where it is halts the machine, it is
+# retired and the pc stays at it (like batch_sim)
+STOP_ECALL = HALT_ECALL
+STOP_EBREAK = HALT_EBREAK
+STOP_SELF_LOOP = HALT_SELF_LOOP  # a jump or branch to itself
+# the guest wrote the exit register (mmio.ExitDevice), the store is retired
+# and the pc is past it
+STOP_EXIT = 'exit'
+
+
+class RunSummary:
+    """
+    The result of a batch run.
+
+    Attributes:
+        instructions: The number of instructions retired.
+        cycles: The number of clock cycles run.
+        stop_reason: Why the run stopped (one of the STOP_* constants).
+        pc: The pc when the run stopped (an int).
+    """
+
+    def __init__(self, instructions, cycles, stop_reason, pc):
+        self.instructions = instructions
+        self.cycles = cycles
+        self.stop_reason = stop_reason
+        self.pc = pc
+
+    def __repr__(self):
+        return (f"RunSummary(instructions={self.instructions}, cycles={self.cycles}, "
+                f"stop_reason={self.stop_reason!r}, pc={self.pc:#010x})")
+
+
+class PerfCounters:
+    """
+    The performance counters of a model.
+
+    Attributes:
+        cycles: Clock cycles run. The functional models don't have a clock,
+            they count the cycles the MVP would have taken (MVP_CYCLES).
+        instret: Instructions retired.
+        state_cycles: Dict of fsm state name to cycles spent in it (MVP only).
+        op_mix: Dict of opcode class name to instructions run.
+    """
+
+    def __init__(self, cycles, instret, state_cycles, op_mix):
+        self.cycles = cycles
+        self.instret = instret
+        self.state_cycles = state_cycles
+        self.op_mix = op_mix
+
+    @property
+    def cpi(self):
+        """cycles per instruction (0 if nothing has run)"""
+        return self.cycles / self.instret if self.instret else 0.0
+
+    def __repr__(self):
+        return (f"PerfCounters(cycles={self.cycles}, instret={self.instret}, "
+                f"cpi={self.cpi:.2f})")
+
+
+def _op_mix(counts):
+    """turns a list of counts by opcode class into a dict by name"""
+    return dict(zip(OP_NAMES, counts))
 
 
 class MVP_Model(Model):
@@ -80,23 +305,17 @@ class MVP_Model(Model):
 
     def __init__(self, register_file) -> None:
         """inits the model with a register file"""
-        self._register_file = register_file
-        self._controller = None
+        super().__init__(register_file)
         # PC set to none b/c it needs to be reset first (like the real model)
         self._pc = None
-        self.OP_DICT = {  # this shows the track for every path through the fsm (this only stores after the decode state)
-            BitArray('0b0000011', length=7).bin: 'l type',    # L
-            BitArray('0b0010011', length=7).bin: 'i type',    # i
-            BitArray('0b0100011', length=7).bin: 's type',    # s
-            BitArray('0b0110011', length=7).bin: 'r type',    # r
-            BitArray('0b1100011', length=7).bin: 'b type',    # b
-            BitArray('0b1100111', length=7).bin: 'jr type',   # jalr
-            BitArray('0b1101111', length=7).bin: 'jal type',  # jal
-            BitArray('0b0110111', length=7).bin: 'lui type',  # lui
-            BitArray('0b0010111', length=7).bin: 'aui type',  # aui
-        }
         self._alu = self.ALU(self)  # init alu class
+        self._decode_cache = DecodeCache()
+        self._decoded = None
+        self._wires = {}  # combinational nets worked out this cycle
         self._fsm_state = None
+        self._op_class = OP_L
+        self._dispatch = self._build_dispatch()
+        self.reset_counters()
         self._PC_write = None
         self._result_slt = None
         self._alu_control = None
@@ -115,10 +334,18 @@ class MVP_Model(Model):
         """returns the register file"""
         return self._register_file
 
+    @property
+    def decode_cache(self):
+        """returns the decode cache (has hits and misses counters)"""
+        return self._decode_cache
+
     def do_reset(self):
         """resets the state of the model to the start of the program and
         clears all registers"""
-        self._fsm_state = 'Fetch'
+        self._fsm_state = STATE_FETCH
+        self._op_class = OP_L
+        self._decoded = None
+        self._wires = {}
         # resets the pc counter to 0
         self._pc = BitArray('0x00000000', length=32)
         self._data_mem_adr = BitArray('0x00000000', length=32)
@@ -130,155 +357,174 @@ class MVP_Model(Model):
         self.rs1_data = BitArray('0x00000000', length=32)
         self.rs2_data = BitArray('0x00000000', length=32)
         self._alu_result_old = BitArray('0x00000000', length=32)
+        self.halt_reason = None
+        self.reset_counters()
+
+    def counters(self):
+        """returns a PerfCounters of what has run since the last reset"""
+        return PerfCounters(self._cycles, self._instret,
+                            dict(zip(STATE_NAMES, self._state_cycles)),
+                            _op_mix(self._op_counts))
+
+    def reset_counters(self):
+        """sets the performance counters back to 0 (so does do_reset)"""
+        self._cycles = 0
+        self._instret = 0
+        self._state_cycles = [0] * len(STATE_NAMES)
+        self._op_counts = [0] * len(OP_NAMES)
 
     def do_instruction(self):
         """
         runs the clock (which runs the FSM) until the instruction is
         complete. It stops right before the next fetch state.
         """
-        if (self._fsm_state == 'Fetch'):
+        self.halt_reason = None
+        if (self._fsm_state == STATE_FETCH):
             self.do_clock()
-        while self._fsm_state != 'Fetch':
+        while self._fsm_state != STATE_FETCH:
             if self.do_clock() < 1:
                 return
         pass
 
+    def read_register(self, index):
+        """returns the value of register x<index> as an int (0 if never written)"""
+        data = self._register_file.get_data(BitArray(uint=index, length=5))
+        return 0 if data is None else data.uint
+
+    def run_until(self, pc=None, predicate=None, max_instructions=None,
+                  max_cycles=None):
+        """
+        Runs the clock until the pc reaches `pc`, `predicate(model)` returns
+        True, the program ends or a limit is hit. The pc and predicate are
+        checked each time an instruction finishes. Returns a RunSummary.
+        """
+        instructions = 0
+        cycles = 0
+        do_clock = self.do_clock
+        self.halt_reason = None
+        while True:
+            if instructions == max_instructions:
+                reason = STOP_MAX_INSTRUCTIONS
+                break
+            if cycles == max_cycles:
+                reason = STOP_MAX_CYCLES
+                break
+            if do_clock() < 1:
+                reason = STOP_HALT
+                break
+            cycles += 1
+            if self._fsm_state == STATE_FETCH:  # an instruction just finished
+                instructions += 1
+                if self.halt_reason is not None:
+                    reason = self.halt_reason
+                    break
+                if pc is not None and self._pc.uint == pc:
+                    reason = STOP_PC
+                    break
+                if predicate is not None and predicate(self):
+                    reason = STOP_PREDICATE
+                    break
+        return RunSummary(instructions, cycles, reason, self._pc.uint)
+
+    def _undo_instruction(self, record):
+        """puts back the pc, register and memory word from an undo record"""
+        pc, rd, old_rd, addr, old_mem = record
+        if rd:
+            self._register_file.set_data(BitArray(uint=rd, length=5), old_rd)
+        if addr is not None:
+            self._undo_memory(addr, old_mem)
+        # back to the start of the instruction
+        self._pc, self._pc_old, self._current_instruction = pc
+        self._fsm_state = STATE_FETCH
+        self._wires = {}
+
+    @property
+    def fsm_state_name(self):
+        """returns the name of the current fsm state (for display)"""
+        return STATE_NAMES[self._fsm_state]
+
+    def _build_dispatch(self):
+        """
+        Builds the fsm table. self._dispatch[state][op class] is the
+        (handler, next state) pair for that state and opcode class, where the
+        handler sets the control signals (None if there is nothing to set).
+        Combinations the fsm can never reach are None.
+        """
+        table = [[None] * len(OP_NAMES) for _ in STATE_NAMES]
+
+        def every_class(state, handler, next_state):
+            table[state] = [(handler, next_state)] * len(OP_NAMES)
+
+        every_class(STATE_FETCH, self._fetch, STATE_DECODE)
+        # decode picks the path through the fsm for each opcode class
+        decode = table[STATE_DECODE]
+        decode[OP_L] = (None, STATE_MEM_ADR)
+        decode[OP_S] = (None, STATE_MEM_ADR)
+        decode[OP_I] = (None, STATE_EXECUTE_I)
+        decode[OP_R] = (None, STATE_EXECUTE_R)
+        decode[OP_B] = (self._decode_branch, STATE_BRANCH)
+        decode[OP_JALR] = (self._decode_jump_and_link_register, STATE_JALR)
+        decode[OP_JAL] = (self._decode_jump_and_link, STATE_JAL)
+        decode[OP_LUI] = (None, STATE_LUI)
+        decode[OP_AUI] = (None, STATE_AUI)
+        decode[OP_SYSTEM] = (None, STATE_CSR)
+        table[STATE_MEM_ADR][OP_L] = (self._memory_address, STATE_MEM_READ)
+        table[STATE_MEM_ADR][OP_S] = (self._memory_address, STATE_MEM_WRITE)
+        table[STATE_MEM_READ][OP_L] = (self.memory_read, STATE_MEM_WRITE_BACK)
+        table[STATE_MEM_WRITE_BACK][OP_L] = (self.memory_write_back, STATE_FETCH)
+        table[STATE_MEM_WRITE][OP_S] = (self.memory_write, STATE_FETCH)
+        table[STATE_EXECUTE_I][OP_I] = (self.execute_i, STATE_ALU_WRITE_BACK)
+        table[STATE_EXECUTE_R][OP_R] = (self.execute_r, STATE_ALU_WRITE_BACK)
+        table[STATE_JALR][OP_JALR] = (self.jump_and_link_register, STATE_JALR_WRITE_BACK)
+        table[STATE_JAL][OP_JAL] = (self.jump_and_link, STATE_ALU_WRITE_BACK)
+        table[STATE_ALU_WRITE_BACK][OP_I] = (self.alu_writeback, STATE_FETCH)
+        table[STATE_ALU_WRITE_BACK][OP_R] = (self.alu_writeback, STATE_FETCH)
+        table[STATE_ALU_WRITE_BACK][OP_JAL] = (self.alu_writeback, STATE_FETCH)
+        table[STATE_JALR_WRITE_BACK][OP_JALR] = (self.jalr_writeback, STATE_FETCH)
+        table[STATE_BRANCH][OP_B] = (self.branch, STATE_FETCH)
+        table[STATE_AUI][OP_AUI] = (self.execute_aui, STATE_FETCH)
+        table[STATE_LUI][OP_LUI] = (self.load_upper_immediate, STATE_FETCH)
+        table[STATE_CSR][OP_SYSTEM] = (self.csr_read, STATE_FETCH)
+        return table
+
     def do_clock(self):
         """
         A processor clock cycle. This is the main function of the model and
         handles the FSM.
         """
-        print(self._pc)
-        print(self._fsm_state)
-
-        # this is the FSM
-        match(self._fsm_state):
-
-            # Fetch state
-            case 'Fetch':
-                self._IR_write = True
-                self._alu_a_slt = 'pc'
-                self._alu_b_slt = 'four'
-                self._alu_control = 'add'
-                self.next_fsm_state = 'Decode'
-                self._result_slt = 'alu_result'
-                self._write_to_register = False
-                self._addr_slt = False
-                self._PC_write = True
-                self._write_mem = False
-
-            # Decode state
-            case 'Decode':
-                if self._current_instruction is None:  # this is for the end of the loop where is there is no instruction
-                    return 0
-                self._IR_write = False
-                self._PC_write = False
-                # all the data is weirdly reserve indexed b/c of issues with the BitArray lib
-                op = self._current_instruction[-7:]
-                self.current_op = op
-                self._op_type = self.OP_DICT[op.bin]
-
-                # internal FSM for the decode state determines the next
-                # state and potentially the ALU control/ inputs
-                match(self._op_type):
-                    case 'l type' | 's type':
-                        self.next_fsm_state = 'MemAdr'
-                    case 'i type':
-                        self.next_fsm_state = 'Execute I'
-                    case 'r type':
-                        self.next_fsm_state = 'Execute R'
-                    case 'b type':
-                        self.next_fsm_state = 'Branch'
-                        self._alu_a_slt = 'old pc'
-                        self._alu_b_slt = 'imm'
-                    case 'jr type':
-                        self.next_fsm_state = 'Jump and link register'
-                        self._alu_a_slt = 'rs1'
-                        self._alu_b_slt = 'imm'
-                        self._alu_control = 'add'
-                    case 'jal type':
-                        self.next_fsm_state = 'Jump and link'
-                        self._alu_a_slt = 'old pc'
-                        self._alu_b_slt = 'imm'
-                        self._alu_control = 'add'
-                    case 'lui type':
-                        self.next_fsm_state = 'Load Upper Immediate'
-                    case 'aui type':
-                        self.next_fsm_state= 'Add Upper Immediate to PC'
-
-            # Memory address state
-            case 'MemAdr':
-                self._memory_address()
-                if self._op_type == 'l type':
-                    self.next_fsm_state = 'MemRead'
-                else:
-                    self.next_fsm_state = 'MemWrite'
-            # Memory read state
-            case 'MemRead':
-                self.memory_read()
-                self.next_fsm_state = 'MemWriteBack'
-
-            # Memory write back state
-            case 'MemWriteBack':
-                self.memory_write_back()
-                self.next_fsm_state = 'Fetch'
-
-            # Memory write state
-            case 'MemWrite':
-                self.memory_write()
-                self.next_fsm_state = 'Fetch'
-
-            # Execute I state
-            case 'Execute I':
-                self.execute_i()
-                self.next_fsm_state = 'alu writeback'
-
-            # Execute R state
-            case 'Execute R':
-                self.execute_r()
-                self.next_fsm_state = 'alu writeback'
-
-            # Jump and link register state
-            case 'Jump and link register':
-                self.jump_and_link_register()
-                self.next_fsm_state = 'jalr writeback'
-
-            # Jump and link state
-            case 'Jump and link':
-                self.jump_and_link()
-                self.next_fsm_state = 'alu writeback'
-
-            # ALU write back state
-            case 'alu writeback':
-                self._PC_write = False
-                self.alu_writeback()
-                self.next_fsm_state = 'Fetch'
-
-            # Jump and link register write back state
-            case 'jalr writeback':
-                self._PC_write = False
-                self.jalr_writeback()
-                self.next_fsm_state = 'Fetch'
-
-            # Branch state
-            case 'Branch':
-                self.branch()
-                self.next_fsm_state = 'Fetch'
-
-            # Add upper immediate to pc state
-            case 'Add Upper Immediate to PC':
-                self.execute_aui()
-                self.next_fsm_state = "Fetch"
-
-            # Load upper immediate state
-            case 'Load Upper Immediate':
-                self._write_to_register = True
-                self._result_slt = 'imm'
-                self.next_fsm_state = 'Fetch'
+        state = self._fsm_state
+        if self._trace_level >= TRACE_CYCLE:
+            self._trace.cycle(self._pc.uint, STATE_NAMES[state])
+        undo = self._undo
+        if undo is not None and state == STATE_FETCH:
+            # the instruction latches go with the pc so the fetch can be redone
+            undo.begin((self._pc, self._pc_old, self._current_instruction))
+
+        if state == STATE_DECODE:
+            if self._current_instruction is None:  # this is for the end of the loop where is there is no instruction
+                self.halt_reason = STOP_HALT
+                return 0
+            self._decode()
+
+        # this is the FSM, the table gives the control for this state
+        handler, self.next_fsm_state = self._dispatch[state][self._op_class]
+        if handler is not None:
+            handler()
+
+        # the control signals are set now so the nets need working out again
+        self._wires = {}
 
         # only write to data mem if needed
         if self._write_mem:
-            self._controller.set_data_mem((self._addr).uint, self.rs2_data)
+            funct3 = self._decoded.funct3
+            if undo is not None:
+                undo.memory_write(self._addr.uint, self._controller.data_memory.read_bytes(
+                    self._addr.uint, STORE_WIDTHS[funct3]))
+            try:
+                self._controller.set_data_mem((self._addr).uint, self.rs2_data, funct3,
+                                              self._pc_old.uint)
+            except GuestExit:  # the store is done, stop once it retires
+                self.halt_reason = STOP_EXIT
 
         # note: the reason we need 2 steps here is because python is serial and real logic is parallel
 
@@ -292,16 +538,19 @@ class MVP_Model(Model):
         if self._IR_write:
             instruction = self._controller.get_instruct_mem((self._pc).uint)
 
-        self.rs1_addr = self._current_instruction[-20:-15]
-        self.rs2_addr = self._current_instruction[-25:-20]
-        rs1 = self._register_file.get_data(self.rs1_addr)
-        rs2 = self._register_file.get_data(self.rs2_addr)
+        # the register numbers come from the decoded record (x0 before the
+        # first decode)
+        decoded = self._decoded
+        rs1 = self._register_file.get_data(REG_ADDRS[decoded.rs1 if decoded else 0])
+        rs2 = self._register_file.get_data(REG_ADDRS[decoded.rs2 if decoded else 0])
         alu_result = self._alu_result
 
         # register data storage
         self._data_mem_adr = _data_addr
 
         if self._write_to_register:
+            if undo is not None:
+                undo.register_write(self.rd.uint, self._register_file.get_data(self.rd))
             self._register_file.set_data(self.rd, _result)
         if self._PC_write:
             self._pc = _result
@@ -314,28 +563,44 @@ class MVP_Model(Model):
         self.rs2_data = rs2
         self._alu_result_old = alu_result
         self._fsm_state = self.next_fsm_state
+        self._wires = {}  # clock edge
+
+        self._cycles += 1
+        self._state_cycles[state] += 1
+        if self.next_fsm_state == STATE_FETCH:
+            self._instret += 1
+            if self._pc == self._pc_old:  # nothing moves the pc from here
+                self.halt_reason = halt_reason(self._current_instruction.uint)
         return 1  # flag for good
 
     # how we are doing combinational logic is using properties with the datapath inside them TODO: BETTER WORDING
+    # each net is worked out at most once per cycle and kept in self._wires,
+    # which is cleared once the control signals are set and at the clock edge
 
     # work around for only calling data mem when its needed so as not to raise an error
     @property
     def _memory_result(self):
         """this the this output of the data memory when called"""
-        return self._controller.get_data_mem(self._data_mem_adr.uint)
+        wires = self._wires
+        if 'memory_result' not in wires:
+            wires['memory_result'] = self._controller.get_data_mem(
+                self._data_mem_adr.uint, self._decoded.funct3, self._pc_old.uint)
+        return wires['memory_result']
 
     @property
     def rd(self):
         """this the rd value of the current instruction"""
-        return self._current_instruction[-12:-7]
+        return REG_ADDRS[self._decoded.rd]
 
     ######################## alu ########################
     @property
     def _alu_result(self):
         """this calls the alu class and plugs in the right info from the a and b muxes"""
-        if self._alu_a == None or self._alu_b == None:
-            None
-        return self._alu.calculate(self._alu_control, self._alu_a, self._alu_b)
+        wires = self._wires
+        if 'alu_result' not in wires:
+            wires['alu_result'] = self._alu.calculate(
+                self._alu_control, self._alu_a, self._alu_b)
+        return wires['alu_result']
 
     ####################### muxes #######################
     @property
@@ -347,77 +612,140 @@ class MVP_Model(Model):
         alu_result
         memory_result
         imm"""
+        wires = self._wires
+        if 'result' in wires:
+            return wires['result']
         match(self._result_slt):
             case 'alu_result_old':
-                return self._alu_result_old
+                value = self._alu_result_old
             case 'alu_result':
-                return self._alu_result
+                value = self._alu_result
             case 'memory_result':
-                return self._memory_result
+                value = self._memory_result
             case 'imm':  # this was added for the lui types as a workaround for some last minute bugs
-                return self._imm
-        return None
+                value = self._imm
+            case 'old pc':
+                value = self._pc_old
+            case 'csr':  # counter as of the start of the instruction (fetch and decode are done)
+                value = BitArray(uint=read_counter(
+                    self._decoded, self._cycles - 2, self._instret), length=32)
+            case _:
+                value = None
+        wires['result'] = value
+        return value
 
     @property
     def _alu_a(self):
         """this is the alu a mux"""
+        wires = self._wires
+        if 'alu_a' in wires:
+            return wires['alu_a']
         match(self._alu_a_slt):
             case 'pc':
-                return self._pc
+                value = self._pc
             case 'old pc':
-                return self._pc_old
+                value = self._pc_old
             case 'rs1':
-                return self.rs1_data
-        return None
+                value = self.rs1_data
+            case _:
+                value = None
+        wires['alu_a'] = value
+        return value
 
     @property
     def _alu_b(self):
         """this is the alu b mux"""
+        wires = self._wires
+        if 'alu_b' in wires:
+            return wires['alu_b']
         match(self._alu_b_slt):
             case 'imm' | 'immediate':
-                return self._imm
+                value = self._imm
             case 'four' | '4' | 4:
-                return BitArray(int=4, length=32)
+                value = BitArray(int=4, length=32)
             case 'rs2':
-                return self.rs2_data
-        return None
+                value = self.rs2_data
+            case _:
+                value = None
+        wires['alu_b'] = value
+        return value
 
     @property
     def _addr(self):
         """this is the addr mux
         if self._addr_slt: it returns the _result mux
         otherwise its the _pc reg"""
-        if self._addr_slt:
-            return self._result
-        return self._pc
+        wires = self._wires
+        if 'addr' not in wires:
+            wires['addr'] = self._result if self._addr_slt else self._pc
+        return wires['addr']
 
     def wire_states(self):
-        """returns the states of the names wires in dict"""
+        """
+        returns the states of the named wires in a dict. The registers are
+        always there, the combinational nets are only there once they have
+        been worked out this cycle.
+        """
         out = {
-            "PC": self._pc
+            "PC": self._pc,
+            "old PC": self._pc_old,
+            "instruction": self._current_instruction,
+            "alu_result_old": self._alu_result_old,
+            "rs1_data": self.rs1_data,
+            "rs2_data": self.rs2_data,
         }
+        out.update(self._wires)
+        return out
 
     @property
     def _imm(self):  # return the imm of the current instruction
-        # get order of bits  and iter though bits
-        order = IMM_DICT[self.current_op.bin]
-        imm = [self._current_instruction[index]
-               if index is not None else False for index in order]
-        b = BitArray(imm).int  # make it signed
-        return BitArray(int=b, length=32)  # and extend it to 32 bits
-
-    def _get_imm(self, instruction):  # return the imm of the current instruction
-        # get order of bits  and iter though bits
-        order = IMM_DICT[self.current_op.bin]
-        imm = [instruction[index]
-               if index is not None else False for index in order]
-        b = BitArray(imm).int  # make it signed
-        return BitArray(int=b, length=32)  # and extend it to 32 bits
+        # the decoder already sign extended it
+        wires = self._wires
+        if 'imm' not in wires:
+            wires['imm'] = BitArray(int=self._decoded.imm, length=32)
+        return wires['imm']
 
     @property
     def instruction(self):
         return self._current_instruction
 
+    def _fetch(self):
+        self._IR_write = True
+        self._alu_a_slt = 'pc'
+        self._alu_b_slt = 'four'
+        self._alu_control = 'add'
+        self._result_slt = 'alu_result'
+        self._write_to_register = False
+        self._addr_slt = False
+        self._PC_write = True
+        self._write_mem = False
+
+    def _decode(self):
+        self._IR_write = False
+        self._PC_write = False
+        # decoding is cached by word so loops only decode once
+        self._decoded = self._decode_cache.lookup(self._current_instruction.uint)
+        self._op_class = self._decoded.op
+        self._op_counts[self._op_class] += 1
+        if self._heat is not None:
+            self._heat.hit(self._pc_old.uint)
+        if self._trace_level:
+            self._trace.instruction(self._pc_old.uint, self._decoded.word)
+
+    def _decode_branch(self):
+        self._alu_a_slt = 'old pc'
+        self._alu_b_slt = 'imm'
+
+    def _decode_jump_and_link_register(self):
+        self._alu_a_slt = 'rs1'
+        self._alu_b_slt = 'imm'
+        self._alu_control = 'add'
+
+    def _decode_jump_and_link(self):
+        self._alu_a_slt = 'old pc'
+        self._alu_b_slt = 'imm'
+        self._alu_control = 'add'
+
     def _memory_address(self):
         self._alu_control = 'add'
         self._alu_a_slt = 'rs1'
@@ -443,22 +771,14 @@ class MVP_Model(Model):
     def execute_i(self):
         self._alu_a_slt = 'rs1'
         self._alu_b_slt = 'imm'
-        # workaround for some weird issues
-        code = self._current_instruction[-15:-11]
-        # if its the only i type that has cares about the bit in fucnt7
-        if code.startswith('0b101'):
-            code[3] = self._current_instruction[-31]  # use the bit then
-        else:
-            code[3] = False  # ignore the bit
-        self._alu_control = code.bin
+        # funct3 plus the funct7 bit for srai only, worked out by the decoder
+        self._alu_control = self._decoded.alu
         pass
 
     def execute_r(self):
         self._alu_a_slt = 'rs1'
         self._alu_b_slt = 'rs2'
-        code = self._current_instruction[-15:-11]
-        code[3] = self._current_instruction[-31]  # always use the bit
-        self._alu_control = code.bin
+        self._alu_control = self._decoded.alu  # always uses the funct7 bit
         pass
 
     def execute_aui(self):
@@ -472,24 +792,20 @@ class MVP_Model(Model):
         rs1 = self.rs1_data
         rs2 = self.rs2_data
         branch = False
-        bcode = self._current_instruction[-15:-12]
-        match bcode.bin:  # sort by branch code (sadly not using alu)
-            case FUNCT3_BEQ.bin:
-                branch = rs1 == rs2  # this is if the branch will return
-            case FUNCT3_BNE.bin:
-                branch = rs1 != rs2
-            case FUNCT3_BGE.bin:
-                branch = rs1.int >= rs2.int
-            case FUNCT3_BGEU.bin:
-                a = rs1.uint
-                b = rs2.uint
-                branch = a >= b
-            case FUNCT3_BLT.bin:
-                branch = rs1.int < rs2.int
-            case FUNCT3_BLTU.bin:
-                a = rs1.uint
-                b = rs2.uint
-                branch = a < b
+        bcode = self._decoded.funct3
+        # sort by branch code (sadly not using alu)
+        if bcode == FUNCT3_BEQ:
+            branch = rs1 == rs2  # this is if the branch will return
+        elif bcode == FUNCT3_BNE:
+            branch = rs1 != rs2
+        elif bcode == FUNCT3_BGE:
+            branch = rs1.int >= rs2.int
+        elif bcode == FUNCT3_BGEU:
+            branch = rs1.uint >= rs2.uint
+        elif bcode == FUNCT3_BLT:
+            branch = rs1.int < rs2.int
+        elif bcode == FUNCT3_BLTU:
+            branch = rs1.uint < rs2.uint
         if branch:  # and do the branch
             self._PC_write = True
             self._result_slt = "alu_result_old"
@@ -504,6 +820,18 @@ class MVP_Model(Model):
 
         return None
 
+    def load_upper_immediate(self):
+        self._write_to_register = True
+        self._result_slt = 'imm'  # the imm is already shifted up
+
+    def csr_read(self):  # read a counter into rd
+        if is_halt(self._decoded.word):  # ecall/ebreak put the pc back on themselves
+            self._result_slt = 'old pc'
+            self._PC_write = True
+            return None
+        self._result_slt = 'csr'
+        self._write_to_register = True
+
     def alu_writeback(self):  # write the data from the alu
         self._PC_write = False
         self._result_slt = "alu_result_old"
@@ -517,7 +845,6 @@ class MVP_Model(Model):
         self._alu_control = 'add'
         self._result_slt = "alu_result"
         self._write_to_register = True
-        self.next_fsm_state = "Fetch"
         return None
 
     def jump_and_link(self):
@@ -570,7 +897,8 @@ class MVP_Model(Model):
         # below are the functions the codes run
         def add(self, a, b):
             """
-            Adds two numbers together and returns the result.
+            Adds two numbers together and returns the result (wrapping
+            around like the hardware).
             """
             try:
                 a = a.int
@@ -580,11 +908,12 @@ class MVP_Model(Model):
                 b = b.int
             except AttributeError:
                 None
-            return BitArray(int=a+b, length=32)
+            return BitArray(uint=(a + b) & 0xFFFFFFFF, length=32)
 
         def sub(self, a, b):
             """
-            Subtracts two numbers and returns the result.
+            Subtracts two numbers and returns the result (wrapping
+            around like the hardware).
             """
             try:
                 a = a.int
@@ -594,7 +923,7 @@ class MVP_Model(Model):
                 b = b.int
             except AttributeError:
                 None
-            return BitArray(int=a-b, length=32)
+            return BitArray(uint=(a - b) & 0xFFFFFFFF, length=32)
 
         def slt(self, a, b):
             """
@@ -644,7 +973,7 @@ class MVP_Model(Model):
 
         def sll(self, a, b):
             """
-            Shifts a left (logical) by b bits.
+            Shifts a left (logical) by the low 5 bits of b.
             """
             try:
                 a = BitArray(a)
@@ -654,11 +983,11 @@ class MVP_Model(Model):
                 b = b.uint
             except AttributeError:
                 None
-            return a.__ilshift__(b)
+            return a.__ilshift__(b & 31)
 
         def srl(self, a, b):
             """
-            Shifts a right (logical) by b bits.
+            Shifts a right (logical) by the low 5 bits of b.
             """
             try:
                 a = a.uint
@@ -668,10 +997,476 @@ class MVP_Model(Model):
                 b = b.uint
             except AttributeError:
                 None
-            return BitArray(uint=a >> (b), length=32)
+            return BitArray(uint=a >> (b & 31), length=32)
 
         def sra(self, a, b):
             """
-            Shifts a right arithmetic by b bits.
+            Shifts a right arithmetic by the low 5 bits of b.
             """
-            return BitArray(int=a.int//2**b.uint, length=32)
+            return BitArray(int=a.int >> (b.uint & 31), length=32)
+
+
+MASK32 = 0xFFFFFFFF
+
+
+def _signed(value):
+    """returns a 32 bit unsigned int as a python signed int"""
+    return value - 0x100000000 if value & 0x80000000 else value
+
+
+# integer versions of the ALU operations, keyed by the same codes as MVP_Model.ALU
+_INT_ALU = {
+    '0000': lambda a, b: (a + b) & MASK32,
+    '0001': lambda a, b: (a - b) & MASK32,
+    '0010': lambda a, b: (a << (b & 31)) & MASK32,
+    '0100': lambda a, b: int(_signed(a) < _signed(b)),
+    '0110': lambda a, b: int(a < b),
+    '1000': lambda a, b: a ^ b,
+    '1010': lambda a, b: a >> (b & 31),
+    '1011': lambda a, b: (_signed(a) >> (b & 31)) & MASK32,
+    '1100': lambda a, b: a | b,
+    '1110': lambda a, b: a & b,
+}
+
+
+class Functional_Model(Model):
+    """
+    A functional (instruction level) version of the model. All of the state is
+    kept as plain ints masked to 32 bits and every clock retires one whole
+    instruction, so there is no FSM and no BitArray work on the hot path.
+    The register file is only updated when something asks for it.
+    """
+
+    def __init__(self, register_file) -> None:
+        """inits the model with a register file"""
+        super().__init__(register_file)
+        # PC set to none b/c it needs to be reset first (like the real model)
+        self._pc = None
+        self._regs = [0] * 32
+        self._dirty = 0  # bitmask of registers not copied to the register file yet
+        self._current_instruction = None
+        self._decode_cache = DecodeCache()
+        self._op_counts = [0] * len(OP_NAMES)
+
+    def __repr__(self):
+        """returns the string representation of the model"""
+        return self.get_registers.__repr__()
+
+    @property
+    def get_pc(self):
+        """returns the pc, a bitArray."""
+        return BitArray(uint=self._pc, length=32)
+
+    @property
+    def get_registers(self):
+        """returns the register file"""
+        self._sync_registers()
+        return self._register_file
+
+    @property
+    def instruction(self):
+        return self._current_instruction
+
+    @property
+    def decode_cache(self):
+        """returns the decode cache (has hits and misses counters)"""
+        return self._decode_cache
+
+    def _sync_registers(self):
+        """copies the registers written since the last sync to the register file"""
+        dirty = self._dirty
+        index = 0
+        if isinstance(self._register_file, CompactRegisterFile):
+            # ints go straight into its array, no BitArrays made
+            write = self._register_file.set_data
+            regs = self._regs
+            while dirty:
+                if dirty & 1:
+                    write(index, regs[index])
+                dirty >>= 1
+                index += 1
+            self._dirty = 0
+            return
+        while dirty:
+            if dirty & 1:
+                self._register_file.set_data(BitArray(uint=index, length=5),
+                                             BitArray(uint=self._regs[index], length=32))
+            dirty >>= 1
+            index += 1
+        self._dirty = 0
+
+    def do_reset(self):
+        """resets the state of the model to the start of the program and
+        clears all registers"""
+        self._pc = 0
+        self._regs = [0] * 32
+        self._dirty = 0
+        self._current_instruction = None
+        self.halt_reason = None
+        self.reset_counters()
+
+    def _all_op_counts(self):
+        """returns the list of instructions run by opcode class"""
+        return self._op_counts
+
+    def counters(self):
+        """
+        returns a PerfCounters of what has run since the last reset, the
+        cycles are the ones the MVP would have taken
+        """
+        counts = self._all_op_counts()
+        return PerfCounters(sum(n * c for n, c in zip(counts, MVP_CYCLES)),
+                            sum(counts), {}, _op_mix(counts))
+
+    def reset_counters(self):
+        """sets the performance counters back to 0 (so does do_reset)"""
+        self._op_counts = [0] * len(OP_NAMES)
+
+    def _read_counter(self, inst, instret, cycles):
+        """
+        does the counter read `inst`, instret and cycles are taken off the
+        counts so far to get them as of the start of the instruction
+        """
+        counts = self._all_op_counts()
+        return read_counter(inst, sum(n * c for n, c in zip(counts, MVP_CYCLES)) + cycles,
+                            sum(counts) + instret)
+
+    def do_instruction(self):
+        """runs a single instruction, same as a clock for this model"""
+        return self.do_clock()
+
+    def do_clock(self):
+        """
+        Fetches, decodes and executes one instruction. Returns 1 if an
+        instruction was run and 0 if there is no instruction at the pc.
+        """
+        return self._run(1)[0]
+
+    def read_register(self, index):
+        """returns the value of register x<index> as an int"""
+        return self._regs[index]
+
+    def run_until(self, pc=None, predicate=None, max_instructions=None,
+                  max_cycles=None):
+        """
+        Runs until the pc reaches `pc`, `predicate(model)` returns True, the
+        program ends or a limit is hit. The stop conditions are checked after
+        every instruction. Every instruction is one cycle for this model.
+        Returns a RunSummary.
+        """
+        if max_cycles is not None and (max_instructions is None or
+                                       max_cycles < max_instructions):
+            max_instructions = max_cycles
+        count, reason = self._run(max_instructions, pc, predicate)
+        if reason == STOP_MAX_INSTRUCTIONS and max_instructions == max_cycles:
+            reason = STOP_MAX_CYCLES
+        return RunSummary(count, count, reason, self._pc)
+
+    def _run(self, max_instructions=None, stop_pc=None, predicate=None):
+        """
+        The main loop of the model, everything is kept in locals so there is
+        no call per instruction. Returns (instructions run, stop reason).
+        """
+        regs = self._regs
+        pc = self._pc
+        words = self._controller.instruction_memory.words
+        cache = self._decode_cache
+        records = cache.records
+        alu = _INT_ALU
+        trace = self._trace
+        trace_level = self._trace_level
+        undo = self._undo
+        heat = self._heat
+        op_counts = self._op_counts
+        data = self._controller.data_memory
+        load = data.load
+        store = data.store
+        icache = dcache = None
+        if self._controller.caches is not None:
+            icache = self._controller.caches.l1i.access
+            dcache = self._controller.caches.l1d.access
+        count = 0
+        hits = 0
+        dirty = 0
+        word = 0
+        reason = STOP_MAX_INSTRUCTIONS
+        self.halt_reason = None
+        try:
+            while count != max_instructions:
+                try:
+                    word = words[pc >> 2]
+                except IndexError:
+                    word = 0
+                if not word or pc & 3:
+                    # let the controller flag the end of the program
+                    self._controller.get_instruct_mem(pc)
+                    reason = self.halt_reason = STOP_HALT
+                    break
+                inst = records.get(word)
+                if inst is not None:
+                    hits += 1
+                else:
+                    inst = cache.lookup(word)
+                if trace_level:
+                    trace.instruction(pc, inst.word)
+                if undo is not None:
+                    undo.begin(pc)
+
+                op = inst.op
+                op_counts[op] += 1
+                if heat is not None:
+                    heat.hit(pc)
+                if icache is not None:
+                    icache(pc, False, pc)
+                rs1 = regs[inst.rs1]
+                next_pc = (pc + 4) & MASK32
+                result = None
+                if op == OP_I:
+                    result = alu[inst.alu](rs1, inst.imm & MASK32)
+                elif op == OP_R:
+                    result = alu[inst.alu](rs1, regs[inst.rs2])
+                elif op == OP_B:
+                    rs2 = regs[inst.rs2]
+                    funct3 = inst.funct3
+                    if funct3 == 0:
+                        branch = rs1 == rs2
+                    elif funct3 == 1:
+                        branch = rs1 != rs2
+                    elif funct3 == 4:
+                        branch = _signed(rs1) < _signed(rs2)
+                    elif funct3 == 5:
+                        branch = _signed(rs1) >= _signed(rs2)
+                    elif funct3 == 6:
+                        branch = rs1 < rs2
+                    else:
+                        branch = rs1 >= rs2
+                    if branch:
+                        next_pc = (pc + inst.imm) & MASK32
+                elif op == OP_L:
+                    addr = (rs1 + inst.imm) & MASK32
+                    if dcache is not None:
+                        dcache(addr, False, pc)
+                    result = load(addr, inst.funct3)
+                elif op == OP_S:
+                    addr = (rs1 + inst.imm) & MASK32
+                    if dcache is not None:
+                        dcache(addr, True, pc)
+                    if undo is not None:
+                        undo.memory_write(addr, data.read_bytes(
+                            addr, STORE_WIDTHS[inst.funct3]))
+                    try:
+                        store(addr, regs[inst.rs2], inst.funct3)
+                    except GuestExit:
+                        count += 1
+                        pc = next_pc
+                        reason = self.halt_reason = STOP_EXIT
+                        break
+                elif op == OP_JAL:
+                    result = next_pc
+                    next_pc = (pc + inst.imm) & MASK32
+                elif op == OP_JALR:
+                    result = next_pc
+                    next_pc = (rs1 + inst.imm) & MASK32 & ~1
+                elif op == OP_LUI:
+                    result = inst.imm & MASK32
+                elif op == OP_AUI:
+                    result = (pc + inst.imm) & MASK32
+                elif is_halt(word):  # ecall/ebreak, stays put
+                    next_pc = pc
+                else:  # system, this one is counted already
+                    result = self._read_counter(inst, -1, -MVP_CYCLES[OP_SYSTEM])
+
+                rd = inst.rd
+                if result is not None and rd:
+                    if undo is not None:
+                        undo.register_write(rd, regs[rd])
+                    regs[rd] = result
+                    dirty |= 1 << rd
+                count += 1
+                if next_pc == pc:  # nothing moves the pc from here
+                    reason = self.halt_reason = halt_reason(word)
+                    break
+                pc = next_pc
+
+                if pc == stop_pc:
+                    reason = STOP_PC
+                    break
+                if predicate is not None:
+                    self._pc = pc
+                    self._dirty |= dirty
+                    if predicate(self):
+                        reason = STOP_PREDICATE
+                        break
+        finally:
+            # write the locals back even if an instruction raised
+            self._pc = pc
+            self._dirty |= dirty
+            cache.hits += hits
+            if count:
+                self._current_instruction = BitArray(uint=word, length=32) if word else None
+        return count, reason
+
+    def _undo_instruction(self, record):
+        """puts back the pc, register and memory word from an undo record"""
+        pc, rd, old_rd, addr, old_mem = record
+        if rd:
+            self._regs[rd] = old_rd
+            self._dirty |= 1 << rd
+        if addr is not None:
+            self._undo_memory(addr, old_mem)
+        self._pc = pc
+
+    def _load(self, addr, funct3):
+        """reads from data memory as an int (funct3 is the load's width)"""
+        return self._controller.data_memory.load(addr, funct3)
+
+    def _store(self, addr, value, funct3):
+        """writes an int to data memory (funct3 is the store's width)"""
+        self._controller.data_memory.store(addr, value, funct3)
+
+
+class Block_Model(Functional_Model):
+    """
+    A version of the functional model that translates the program into basic
+    blocks and runs each block as one compiled python function. Every clock
+    runs a whole block, so the pc is only ever at the start of a block.
+    With tracing, an undo log, a heat map or caches on it runs one
+    instruction at a time like the functional model so that every
+    instruction can be seen.
+    """
+
+    def __init__(self, register_file) -> None:
+        """inits the model with a register file"""
+        super().__init__(register_file)
+        self._translator = BlockTranslator()
+
+    @property
+    def translator(self):
+        """returns the block translator (has the translated blocks)"""
+        return self._translator
+
+    def block_counts(self):
+        """returns a dict of how many times each block (by entry pc) was run"""
+        return self._translator.block_counts()
+
+    def _all_op_counts(self):
+        """returns the list of instructions run by opcode class"""
+        # blocks are counted by the translator, single instructions here
+        return [n + m for n, m in zip(self._op_counts, self._translator.op_counts())]
+
+    def reset_counters(self):
+        """sets the performance counters back to 0 (so does do_reset)"""
+        super().reset_counters()
+        self._translator.reset_counts()
+
+    def do_clock(self):
+        """
+        Runs the basic block at the pc. Returns 1 if a block was run and 0 if
+        there is no instruction at the pc.
+        """
+        if self._trace_level or self._undo is not None or self._heat is not None \
+                or self._controller.caches is not None:
+            return super().do_clock()
+        block = self._translator.lookup(self._pc, self._controller.instruction_memory)
+        if block is None:
+            # let the controller flag the end of the program
+            self._controller.get_instruct_mem(self._pc)
+            self.halt_reason = STOP_HALT
+            return 0
+        block.entries += 1
+        try:
+            self._pc = block.function(self._regs, self._load, self._store,
+                                      self._read_counter)
+        except GuestExit as error:
+            pc = self._block_raised(block, error)[1]
+            self._pc = (pc + 4) & MASK32
+            self._current_instruction = self._controller.instruction_memory.get(pc)
+            self.halt_reason = STOP_EXIT
+            return 1
+        except Exception as error:
+            self._pc = self._block_raised(block, error)[1]
+            raise
+        self._dirty |= block.write_mask
+        self._current_instruction = block.last_bits
+        # the last instruction jumped to itself (or was ecall/ebreak)
+        self.halt_reason = halt_reason(block.last_bits.uint) \
+            if self._pc == block.last_pc else None
+        return 1
+
+    def _block_raised(self, block, error):
+        """
+        For a block that raised error part way through, marks the registers
+        it can have written and takes the instructions after the one that
+        raised off the counts (the other models count an instruction when it
+        is decoded). Returns (instructions that ran before it, its pc).
+        """
+        index = fault_index(block, error)
+        self._translator.uncount(block, index + 1)
+        self._dirty |= block.write_mask
+        return index, (block.pc + 4 * index) & MASK32
+
+    def _run(self, max_instructions=None, stop_pc=None, predicate=None):
+        """
+        Runs whole blocks when nothing has to be checked between
+        instructions, otherwise (and for the last partial block of a budget)
+        it falls back to the instruction by instruction loop. If an
+        instruction raises the pc is left at that instruction, like the
+        functional model.
+        """
+        if stop_pc is not None or predicate is not None or self._trace_level \
+                or self._undo is not None or self._heat is not None \
+                or self._controller.caches is not None:
+            return super()._run(max_instructions, stop_pc, predicate)
+        regs = self._regs
+        load = self._controller.data_memory.load
+        store = self._controller.data_memory.store
+        csr = self._read_counter
+        lookup = self._translator.lookup
+        memory = self._controller.instruction_memory
+        pc = self._pc
+        count = 0
+        dirty = 0
+        block = None
+        reason = None
+        self.halt_reason = None
+        try:
+            while True:
+                if count == max_instructions:  # before looking past the end
+                    reason = STOP_MAX_INSTRUCTIONS
+                    break
+                block = lookup(pc, memory)
+                if block is None:
+                    # let the controller flag the end of the program
+                    self._controller.get_instruct_mem(pc)
+                    reason = self.halt_reason = STOP_HALT
+                    break
+                if max_instructions is not None and \
+                        count + block.length > max_instructions:
+                    break
+                block.entries += 1
+                try:
+                    pc = block.function(regs, load, store, csr)
+                except GuestExit as error:
+                    ran, pc = self._block_raised(block, error)
+                    count += ran + 1
+                    self._current_instruction = self._controller.instruction_memory.get(pc)
+                    pc = (pc + 4) & MASK32
+                    reason = self.halt_reason = STOP_EXIT
+                    break
+                except Exception as error:
+                    pc = self._block_raised(block, error)[1]
+                    raise
+                dirty |= block.write_mask
+                count += block.length
+                self._current_instruction = block.last_bits
+                if pc == block.last_pc:  # nothing moves the pc from here
+                    reason = self.halt_reason = halt_reason(block.last_bits.uint)
+                    break
+        finally:
+            self._pc = pc
+            self._dirty |= dirty
+        if reason is None:  # finish the budget one instruction at a time
+            rest, reason = super()._run(max_instructions - count)
+            count += rest
+        return count, reason
+
@@ -1,6 +1,8 @@
 """
 RISC-V register file implementation.
 """
+from array import array
+
 import bitstring
 
 from registers import Register
@@ -13,6 +15,60 @@ BitArray = bitstring.BitArray
 #     reg_names = ["zero", "ra", "sp","gp","tp","t0","t1","t2","s0","s1","a0","a1","a2","a3","a4","a5","a6","s2","s3","s4","s5","s6","s7","s8","s9","s10","s11","t3","t4","t5","t6"]
 
 
+REG_INDEX = ["x00", "x01", "x02", "x03", "x04", "x05", "x06", "x07", "x08", "x09", "x10", "x11", "x12", "x13", "x14",
+             "x15", "x16", "x17", "x18", "x19", "x20", "x21", "x22", "x23", "x24", "x25", "x26", "x27", "x28", "x29", "x30", "x31"]
+REG_NAMES = ["zero", "ra", "sp", "gp", "tp", "t0", "t1", "t2", "s0", "s1", "a0", "a1", "a2", "a3", "a4",
+             "a5", "a6", "a7", "s2", "s3", "s4", "s5", "s6", "s7", "s8", "s9", "s10", "s11", "t3", "t4", "t5", "t6"]
+
+
+def format_register(index, data):
+    """
+    Returns the printout line of register x<index> holding data (a
+    BitArray, or None for xxxxxxxx)
+    """
+    value = "xxxxxxxx" if data is None else data.hex
+    return f"|{REG_INDEX[index]} | {REG_NAMES[index]} | {value}|"
+
+
+def _format_registers(values, fullreg):
+    """
+    Returns the register file printout for a list of 32 register values
+    (BitArrays, None for registers that were never written)
+    """
+    reg_index = REG_INDEX
+    reg_names = REG_NAMES
+
+    title = "+----Register File----+"
+    end_line = "+---------------------+"
+    lines = [title]
+
+    if (fullreg == True):
+        for l in range(32):
+            raw_data = values[l]
+            if (raw_data == None):
+                data = "xxxxxxxx"
+            else:
+                data = raw_data.hex  # '{0:08X}'.format(raw_data.int)
+            if (len(reg_names[l]) == 4):
+                reg_line = f"|{reg_index[l]} | {reg_names[l]} | {data}|"
+                lines.append(reg_line)
+            if (len(reg_names[l]) == 3):
+                reg_line = f"|{reg_index[l]} | {reg_names[l]}  | {data}|"
+                lines.append(reg_line)
+            if (len(reg_names[l]) == 2):
+                reg_line = f"|{reg_index[l]} | {reg_names[l]}   | {data}|"
+                lines.append(reg_line)
+        lines.append(end_line)
+        return "\n".join(lines)
+    else:
+        for n, raw_data in enumerate(values):
+            if raw_data == None:
+                continue
+            lines.append(format_register(n, raw_data))
+        lines.append(end_line)
+        return "\n".join(lines)
+
+
 class RegisterFile:
     """
     Register file implementation containing 32 instances of registers
@@ -72,12 +128,7 @@ class RegisterFile:
         for k in self.regfile:
             if (k == a3):
                 self.regfile[k].write_data(wd)
-                if (len(self.modified_regs) == 0):
-                    self.modified_regs.append(k)
-                else:
-                    for m in len(self.modified_regs):
-                        if (k == self.modified_regs[m]):
-                            break
+                if k not in self.modified_regs:
                     self.modified_regs.append(k)
 
     def switch_display(self):
@@ -96,12 +147,8 @@ class RegisterFile:
     def set_data(self, addr, data):
         if addr.uint == 0:
             return None
-        if (len(self.modified_regs) == 0):
-            self.modified_regs.append(addr)
-        else:
-            for m in range(len(self.modified_regs)):
-                if (addr == self.modified_regs[m]):
-                    break
+        # each register is listed once, however many times it is written
+        if addr not in self.modified_regs:
             self.modified_regs.append(addr)
         return self.regfile[addr.uint].write_data(data)
 
@@ -109,46 +156,134 @@ class RegisterFile:
         """
         Return a string representing the data in the register
         """
-        reg_index = ["x00", "x01", "x02", "x03", "x04", "x05", "x06", "x07", "x08", "x09", "x10", "x11", "x12", "x13", "x14",
-                     "x15", "x16", "x17", "x18", "x19", "x20", "x21", "x22", "x23", "x24", "x25", "x26", "x27", "x28", "x29", "x30", "x31"]
-        reg_names = ["zero", "ra", "sp", "gp", "tp", "t0", "t1", "t2", "s0", "s1", "a0", "a1", "a2", "a3", "a4",
-                     "a5", "a6", "a7", "s2", "s3", "s4", "s5", "s6", "s7", "s8", "s9", "s10", "s11", "t3", "t4", "t5", "t6"]
-
-        title = "+----Register File----+"
-        end_line = "+---------------------+"
-        lines = [title]
-
-        if (self.fullreg == True):
-            for l in range(32):
-                raw_data = self.regfile[l].data
-                if (raw_data == None):
-                    data = "xxxxxxxx"
-                else:
-                    data = raw_data.hex  # '{0:08X}'.format(raw_data.int)
-                if (len(reg_names[l]) == 4):
-                    reg_line = f"|{reg_index[l]} | {reg_names[l]} | {data}|"
-                    lines.append(reg_line)
-                if (len(reg_names[l]) == 3):
-                    reg_line = f"|{reg_index[l]} | {reg_names[l]}  | {data}|"
-                    lines.append(reg_line)
-                if (len(reg_names[l]) == 2):
-                    reg_line = f"|{reg_index[l]} | {reg_names[l]}   | {data}|"
-                    lines.append(reg_line)
-            lines.append(end_line)
-            return "\n".join(lines)
-        else:
-            # self.modified_regs.sort()
-            for n, reg in enumerate(self.regfile):
-                raw_data = reg.data
-                if raw_data == None:
-                    continue
-                data = raw_data.hex
-                reg_line = f"|{reg_index[n]} | {reg_names[n]} | {data}|"
-                lines.append(reg_line)
-            lines.append(end_line)
-            return "\n".join(lines)
+        return _format_registers([reg.data for reg in self.regfile], self.fullreg)
 
     def __eq__(self, __o: object) -> bool:
         if isinstance(__o, RegisterFile):
             return self.regfile == __o.regfile
         return False
+
+
+class _RegisterView:
+    """a Register like view of one slot of a CompactRegisterFile"""
+    __slots__ = ('_file', '_address')
+
+    def __init__(self, register_file, address):
+        self._file = register_file
+        self._address = address
+
+    @property
+    def address(self):
+        return self._address
+
+    @property
+    def data(self):
+        return self._file.get_data(self._address)
+
+    def write_data(self, new_data):
+        self._file.write(self._address, new_data)
+
+    def __repr__(self):
+        return str(self.data)
+
+    def __eq__(self, __o):
+        if isinstance(__o, (_RegisterView, Register)):
+            return self.data == __o.data and self._address == __o.address
+        return False
+
+
+class CompactRegisterFile:
+    """
+    A register file with the same get_data/set_data API and printout as
+    RegisterFile that keeps the 32 registers as ints in one array('I'). A
+    bitmask says which registers hold a value (the rest read None like a
+    Register that was never written) and another which have been written
+    since clear_modified, so a write never allocates.
+
+    Attributes:
+        modified: Bitmask of the registers written (bit n is xn).
+        fullreg: Show all 32 registers in the printout.
+    """
+    __slots__ = ('_values', '_valid', '_bits', 'modified', 'fullreg')
+
+    def __init__(self):
+        self._values = array('I', bytes(4 * 32))
+        self._valid = 1  # x0 is always 0
+        self._bits = [None] * 32  # BitArrays handed out by get_data
+        self.modified = 0
+        self.fullreg = False
+
+    def get_data(self, addr):
+        """returns register addr (a BitArray or int) as a BitArray, or None"""
+        index = addr if isinstance(addr, int) else addr.uint
+        if not self._valid >> index & 1:
+            return None
+        bits = self._bits[index]
+        if bits is None:
+            bits = self._bits[index] = BitArray(uint=self._values[index], length=32)
+        return bits
+
+    def get_int(self, index):
+        """returns register x<index> as an int (0 if it was never written)"""
+        return self._values[index]
+
+    def set_data(self, addr, data):
+        """writes data (a BitArray or int) to register addr, x0 stays 0"""
+        index = addr if isinstance(addr, int) else addr.uint
+        if index == 0:
+            return None
+        self.write(index, data)
+
+    def write(self, index, data):
+        """writes register x<index> without the x0 check (None clears it)"""
+        if data is None:
+            self._valid &= ~(1 << index)
+            self._values[index] = 0
+            self._bits[index] = None
+        elif isinstance(data, int):
+            self._valid |= 1 << index
+            self._values[index] = data & 0xFFFFFFFF
+            self._bits[index] = None
+        else:
+            self._valid |= 1 << index
+            self._values[index] = data.uint
+            self._bits[index] = data
+        self.modified |= 1 << index
+
+    @property
+    def modified_regs(self):
+        """returns the list of registers written, like RegisterFile's"""
+        return [index for index in range(32) if self.modified >> index & 1]
+
+    def clear_modified(self):
+        self.modified = 0
+
+    def snapshot(self):
+        """returns (valid mask, copy of the values) to compare with later"""
+        return self._valid, array('I', self._values)
+
+    @property
+    def regfile(self):
+        """returns Register like views of the 32 registers"""
+        return [_RegisterView(self, index) for index in range(32)]
+
+    def switch_display(self):
+        """
+        Method to switch between full register-file print out and
+        the non empty
+        """
+        self.fullreg = not self.fullreg
+
+    def __repr__(self):
+        """
+        Return a string representing the data in the register
+        """
+        return _format_registers([self.get_data(index) for index in range(32)],
+                                 self.fullreg)
+
+    def __eq__(self, __o: object) -> bool:
+        if isinstance(__o, CompactRegisterFile):
+            return self._values == __o._values and self._valid == __o._valid
+        if isinstance(__o, RegisterFile):
+            return [reg.data for reg in self.regfile] == [reg.data for reg in __o.regfile]
+        return False
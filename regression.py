@@ -0,0 +1,328 @@
+"""
+Randomized regression runner. Runs seeded line-by-line emulation sessions
+(random I, R, S type instructions, each one checked against a python
+model of the instruction) on a process pool, one independent session per
+seed, and reports which seeds failed and where. A failing seed replays
+exactly with `python3 regression.py --replay SEED`.
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from bitstring import BitArray
+
+from controller import Controller, Prompt
+from cpu_view import NullView
+from model import MVP_Model, Functional_Model, Block_Model
+from register_file import RegisterFile
+
+MODELS = {
+    'mvp': MVP_Model,
+    'functional': Functional_Model,
+    'block': Block_Model,
+}
+
+possible_instructions = ['lw','addi','slli','slti','sltiu','xori','srli',
+'srai','ori','andi','sw','add','sub','sll','slt','sltu','xor','srl',#'auipc',
+'sra','or','and','lui']
+reg_index = ["x00","x01","x02","x03","x04","x05","x06","x07","x08","x09","x10","x11","x12","x13","x14","x15","x16","x17","x18","x19","x20","x21","x22","x23","x24","x25","x26","x27","x28","x29","x30","x31"]
+reg_names = ["zero", "ra", "sp","gp","tp","t0","t1","t2","s0","s1","a0","a1","a2","a3","a4","a5","a6","a7", "s2","s3","s4","s5","s6","s7","s8","s9","s10","s11","t3","t4","t5","t6"]
+reg_sim = [0]*32
+
+args_data = {
+            'lw':'rd imm(rs1)',
+            'addi':'rd rs1 imm',
+            'slli':'rd rs1 imm',
+            'slti':'rd rs1 imm',
+            'sltiu':'rd rs1 imm',
+            'xori':'rd rs1 imm',
+            'srli':'rd rs1 imm',
+            'srai':'rd rs1 imm',
+            'ori':'rd rs1 imm',
+            'andi':'rd rs1 imm',
+            'auipc':'rd imm',
+            'sw':'rs2 imm(rs1)',
+            'add':'rd rs1 rs2',
+            'sub':'rd rs1 rs2',
+            'sll':'rd rs1 rs2',
+            'slt':'rd rs1 rs2',
+            'sltu':'rd rs1 rs2',
+            'xor':'rd rs1 rs2',
+            'srl':'rd rs1 rs2',
+            'sra':'rd rs1 rs2',
+            'or':'rd rs1 rs2',
+            'and':'rd rs1 rs2',
+            'lui':'rd imm'
+        }
+class PromptEmulation(Prompt):
+    """
+    Prompt that makes up random instructions instead of asking the user, and
+    checks the result of each one before sending the next. Everything random
+    comes from self.random so a session with a seeded rng replays exactly.
+    """
+    def __init__(self, model=None, controller=None, rng=None, count=1000) -> None:
+        self.data = False
+        self.count = 0
+        self.max_count = count
+        self.model = model
+        self.controller = controller
+        self.random = rng if rng is not None else random.Random()
+        self.sent = 0  # instructions sent
+        self.last_instruction = None
+        self.stored = []  # data memory addresses sw has written
+
+    def get_instruction(self):
+        self.check_prev_data()
+        self.good_to_send = False
+        while not self.good_to_send:
+            self.count +=1
+            pre_sent = {}
+            pre_sent['intr'] = self.random.choice(possible_instructions)
+            pre_sent['rs1'] = self.get_modified_reg()
+            pre_sent['rs2'] = self.get_modified_reg()
+            pre_sent['rd']  = self.random.randint(0,31)
+            pre_sent['imm'] = self.random.randint(0,2047)
+            self.good_to_send = True
+            self.data = self.check_instruction(pre_sent)
+            if self.data == None:
+                self.good_to_send = False
+            if self.count >self.max_count:
+                print("everything worked correctly")
+                return 'stop'
+
+        self.sent += 1
+        self.last_instruction = self.make_instruction()
+        return self.last_instruction
+
+    def get_file(self):
+        filename = input('Enter file name: ')
+        return filename
+
+    def make_instruction(self):
+        args = args_data[self.data['intr']]
+        data = self.data.copy()
+        if 'rd' in data.keys():
+            data['rd'] = 'x'+str(data['rd'])
+        if 'rs1' in data.keys():
+            data['rs1'] = 'x'+str(data['rs1'])
+        if 'rs2' in data.keys():
+            data['rs2'] = 'x'+str(data['rs2'])
+        for key, val in data.items():
+            #if key in args:
+            args = args.replace(key, str(val))
+        return (data['intr']+" " + args)
+        
+
+    def check_prev_data(self):
+        if self.data:
+            if 'rd' in self.data.keys():
+                rd = self.data['rd']
+                future = self.data['future']
+                if isinstance(future,BitArray):
+                    future = future.uint
+                if self.data['rd'] == 0:
+                    future = 0
+                if not self.model.get_registers.get_data(BitArray(uint=rd,length=5)).uint == future and\
+                    not self.model.get_registers.get_data(BitArray(uint=rd,length=5)).int == future :
+                    raise ValueError("wrong register value")
+            if 'next pc' in self.data.keys():
+                if not self.model.get_pc.uint == self.data['next pc']:
+                    raise ValueError("wrong pc value")
+            if 'data mem addr' in self.data.keys():
+                if not self.controller.get_data_mem(BitArray(uint=self.data['data mem addr'],length=32).uint) == self.model.get_registers.get_data(BitArray(uint=self.data['rs2'],length=5)):
+                    raise ValueError("wrong data mem value")
+
+    def get_modified_reg(self):
+        reg_data = None
+        while reg_data is None:
+            r = self.random.randint(0,31)
+            reg_data = self.model.get_registers.get_data(BitArray(uint=r,length=32))
+        return r
+
+
+    def check_instruction(self,data):
+        match(data['intr']):
+            case 'lui':
+                return self.check_lui(data)
+            case 'lw':
+                return self.check_lw(data)
+            case 'addi'|'slli'|'slti'|'sltiu'|'xori'|'srli'|'srai'|'ori'|'andi'|'add'|'sub'|'sll'|'slt'|'sltu'|'xor'|'srl'|'sra'|'or'|'and':
+                return self.check_ir(data)
+            case 'auipc':
+                return self.check_auipc(data)
+            case 'sw':
+                return self.check_sw(data)
+            case _:
+                None
+
+
+    def check_lui(self,data):
+        out = data
+        out['future'] = out['imm']*4096
+        out['next pc'] = self.model.get_pc.uint + 4 
+        return out
+
+    def check_lw(self,data):
+        out = data
+        if len(self.stored)<1:
+            self.good_to_send = False
+            return
+        goal_mem_adr = self.random.choice(self.stored)
+        reg_offset = self.model.get_registers.get_data(BitArray(uint=data['rs1'],length=5)).uint
+        count = 0
+        while goal_mem_adr-reg_offset >2047 or goal_mem_adr-reg_offset<-2048:
+            count +=1
+            out['rs1'] = self.get_modified_reg()
+            reg_offset = self.model.get_registers.get_data(BitArray(uint=out['rs1'],length=5)).int
+            if count >20:
+                return
+            None
+        
+        out['imm'] = BitArray(int=(goal_mem_adr-reg_offset),length=12).int
+        if out['imm'] not in self.stored:
+            return
+        out['future'] = self.controller.get_data_mem(out['imm'])
+        out['next pc'] = self.model.get_pc.uint + 4 
+        return out
+
+    def check_ir(self,data):
+        out = data
+        a = self.model.get_registers.get_data(BitArray(uint=data['rs1'],length=5))
+        b = self.model.get_registers.get_data(BitArray(uint=data['rs2'],length=5))
+        intr = data['intr']
+        if intr in ('slli', 'srli', 'srai'):
+            # shamt is 5 bits, a bigger imm sets bit 30 and is a different shift
+            out['imm'] = data['imm'] & 31
+        if 'i' in intr:
+            b = BitArray(int=data['imm'],length =32)
+            intr= intr.replace('i','')
+        match intr:
+            case 'add':
+                out['future'] = BitArray(uint=(a.int+b.int) & 0xFFFFFFFF,length=32)
+            case 'sub':
+                out['future'] = BitArray(uint=(a.int-b.int) & 0xFFFFFFFF,length=32)
+            case 'sll':
+                out['future'] = a<<(b.uint & 31)
+            case 'slt':
+                out['future'] = BitArray(int=a.int<b.int,length=32)
+            case 'sltu':
+                out['future'] = BitArray(int=a.uint<b.uint,length=32)
+            case 'xor':
+                out['future'] = a^b
+            case 'srl':
+                out['future'] = a.uint>>(b.uint & 31)
+            case 'sra':
+                out['future'] = sra(a.int,32,b.uint & 31)#BitArray(int=a.int//(2^b.uint),length=32)
+            case 'or':
+                out['future'] = a|b
+            case 'and':
+                out['future'] = a&b
+        out['next pc'] = self.model.get_pc.uint + 4
+        return out
+
+    def check_auipc(self,data):
+        out = data
+        out['future'] = self.model.get_pc.uint +(BitArray(uint=out['imm'],length=32)<<12).uint
+        out['next pc'] = self.model.get_pc.uint + 4 
+        return out
+
+    def check_sw(self,data):
+        out = data
+        a = BitArray(uint=out['rs1'],length=5)
+        b = self.model.get_registers.get_data(a)
+        out['imm'] = ((out['imm']+b).uint %4)-out['imm']
+        dmaddr = BitArray(uint=(BitArray(int=out['imm'],length=32).uint+self.model.get_registers.get_data(BitArray(uint=out['rs1'],length=5)).uint),length=33)
+        c = dmaddr[-32:]
+        out['data mem addr'] = c.uint
+        if c.uint not in self.stored:
+            self.stored.append(c.uint)
+        out['future'] = self.model.get_registers.get_data(BitArray(uint=out['rs2'],length=5))
+        out['next pc'] = self.model.get_pc.uint + 4 
+        del out['rd']
+        return out
+
+
+
+# x is an n-bit number to be shifted m times
+def sra(x,n,m):
+    # same as x//(2**m) but without building 2**m for huge shift amounts
+    return BitArray(int=x >> m, length=n)
+
+
+def run_seed(seed, count=1000, model='mvp'):
+    """
+    Runs one emulation session seeded with `seed` and returns a dict with
+    the seed, whether it passed, how many instructions were sent and, for
+    a failure, the error, the instruction that went wrong, the pc and the
+    register file (as hex strings by register number).
+    """
+    model = MODELS[model](register_file=RegisterFile())
+    controller = Controller(model, NullView(model))
+    prompt = PromptEmulation(model, controller, random.Random(seed), count)
+    controller.prompt = prompt
+    result = {"seed": seed, "passed": True, "instructions": 0}
+    try:
+        # the controller prints every instruction it gets
+        with contextlib.redirect_stdout(io.StringIO()):
+            controller.run()
+    except Exception as e:
+        registers = {}
+        for number, reg in enumerate(model.get_registers.regfile):
+            if reg.data is not None:
+                registers[number] = reg.data.hex
+        result.update({
+            "passed": False,
+            "error": f"{type(e).__name__}: {e}",
+            "instruction": prompt.last_instruction,
+            "pc": model.get_pc.hex,
+            "registers": registers,
+        })
+    result["instructions"] = prompt.sent
+    return result
+
+
+def run_seeds(seeds, count=1000, model='mvp', workers=None):
+    """
+    Runs run_seed for every seed on a process pool (one process per core
+    by default) and returns the results in seed order.
+    """
+    seeds = list(seeds)
+    chunksize = max(1, len(seeds) // (4 * (workers or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run_seed, seeds, repeat(count), repeat(model),
+                             chunksize=chunksize))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--seeds", default="0:100",
+                        help="range of seeds to run as start:stop (default 0:100)")
+    parser.add_argument("--replay", type=int,
+                        help="run a single seed in this process and print the result")
+    parser.add_argument("-n", "--count", type=int, default=1000,
+                        help="instructions to try per session")
+    parser.add_argument("--model", choices=sorted(MODELS), default="mvp")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes (default: cores)")
+    args = parser.parse_args()
+    if args.replay is not None:
+        result = run_seed(args.replay, args.count, args.model)
+        print(result)
+        sys.exit(0 if result["passed"] else 1)
+    start, stop = (int(x) for x in args.seeds.split(":"))
+    results = run_seeds(range(start, stop), args.count, args.model, args.workers)
+    failed = [r for r in results if not r["passed"]]
+    for r in failed:
+        print(f"seed {r['seed']}: {r['error']} after {r['instructions']} "
+              f"instructions, last was '{r['instruction']}' at pc {r['pc']}")
+    print(f"{len(results) - len(failed)}/{len(results)} seeds passed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
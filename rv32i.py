@@ -95,6 +95,18 @@ stypes = ["sb", "sh", "sw"]
 btypes = ["beq", "bne", "blt", "bge", "bltu", "bgeu"]
 jtypes = ["jal"]
 utypes = ["lui", "auipc"]
+systypes = ["csrrs"]
+
+# the counter csrs (Zicntr)
+csr_codes = {
+    "cycle": 0xC00,
+    "time": 0xC01,
+    "instret": 0xC02,
+    "cycleh": 0xC80,
+    "timeh": 0xC81,
+    "instreth": 0xC82,
+}
+csr_names = {v: k for k, v in csr_codes.items()}
 
 psuedo_instructions = [
     "nop",
@@ -106,6 +118,13 @@ psuedo_instructions = [
     "bgez",
     "call",
     "ret",
+    "csrr",
+    "rdcycle",
+    "rdcycleh",
+    "rdtime",
+    "rdtimeh",
+    "rdinstret",
+    "rdinstreth",
 ]
 
 op_codes = {}
@@ -123,8 +142,9 @@ op_codes["jal"] = BitArray("0b1101111")
 op_codes["jalr"] = BitArray("0b1100111")
 op_codes["lui"] = BitArray("0b0110111")
 op_codes["auipc"] = BitArray("0b0010111")
-# op_codes["ecall"] = BitArray("0b1110011")
-# op_codes["ebreak"] = BitArray("0b1110011")
+op_codes["csrrs"] = BitArray("0b1110011")
+op_codes["ecall"] = BitArray("0b1110011")
+op_codes["ebreak"] = BitArray("0b1110011")
 
 bits_to_op_code = {v.bin: k for k, v in op_codes.items()}
 
@@ -133,7 +153,7 @@ for i in ["add", "sub", "addi", "lb", "sb", "beq", "jalr"]:
     funct3_codes[i] = BitArray("0b000")
 for i in ["sll", "slli", "lh", "sh", "bne"]:
     funct3_codes[i] = BitArray("0b001")
-for i in ["slt", "slti", "lw", "sw"]:
+for i in ["slt", "slti", "lw", "sw", "csrrs"]:
     funct3_codes[i] = BitArray("0b010")
 for i in ["sltu", "sltiu"]:
     funct3_codes[i] = BitArray("0b011")
@@ -156,7 +176,7 @@ def check_imm(imm, bits):
         raise LineException(f"Immediate {imm} does not fit into {bits} bits.")
 
 
-def line_to_bits(line, labels={}, address=0):
+def line_to_bits(line, labels={}, address=0, trace=None):
     instruction = line["instruction"]
     args = line["args"]
     bits = None
@@ -188,7 +208,14 @@ def line_to_bits(line, labels={}, address=0):
         rs1 = register_to_bits(rs1)
         imm12 = int(imm12)
         check_imm(imm12, 12)
+        if instruction in ["slli", "srli", "srai"] and not 0 <= imm12 < 32:
+            raise LineException(
+                "Shift amounts have to be from 0 to 31.",
+            )
         imm12 = BitArray(int=imm12, length=12)
+        # the top 7 bits of a shift are funct7
+        if instruction == "srai":
+            imm12[0:7] = "0b0100000"
         bits = (
             imm12
             + rs1
@@ -208,10 +235,6 @@ def line_to_bits(line, labels={}, address=0):
         imm12 = int(match.group(1))
         check_imm(imm12, 12)
         imm12 = BitArray(int=int(match.group(1)), length=12)
-        if instruction in ["slli", "srli"]:
-            imm12[0:7] = "0b0000000"
-        if instruction == "srai":
-            imm12[0:7] = "0b0100000"
         rs = register_to_bits(match.group(2))
         rd = register_to_bits(rd)
         bits = (
@@ -274,9 +297,10 @@ def line_to_bits(line, labels={}, address=0):
         # imm[20|10:1|11|19:12] in normal bit order, this library makes us flip that
         # imm20,10:1,11,19:12
         imm20 = imm[0:1] + imm[10:20] + imm[9:10] + imm[1:9]
-        print(
-            f"Found a jal: offset = {offset}, imm={imm.bin}, imm20={imm20.bin} | {label}"
-        )
+        if trace is not None and trace.level:
+            trace.message(
+                f"Found a jal: offset = {offset}, imm={imm.bin}, imm20={imm20.bin} | {label}"
+            )
         bits = imm20 + rd + op_codes[instruction]
     if instruction in utypes:
         rd, upimm = args
@@ -285,6 +309,41 @@ def line_to_bits(line, labels={}, address=0):
         upimm = BitArray(int=int(upimm), length=20)
         bits = upimm + rd + op_codes[instruction]
 
+    if instruction in systypes:
+        # ex: csrrs rd, cycle, rs1 (the csr can be a name or a number)
+        if len(args) != 3:
+            raise LineException(
+                "CSR instructions require 3 arguments.",
+            )
+        rd, csr, rs1 = args
+        rd = register_to_bits(rd)
+        rs1 = register_to_bits(rs1)
+        if csr in csr_codes:
+            csr = csr_codes[csr]
+        else:
+            csr = int(csr, 0)
+        if csr < 0 or csr >= 2 ** 12:
+            raise LineException(f"CSR {csr} does not fit into 12 bits.")
+        bits = (
+            BitArray(uint=csr, length=12)
+            + rs1
+            + funct3_codes[instruction]
+            + rd
+            + op_codes[instruction]
+        )
+
+    if instruction in ["ecall", "ebreak"]:
+        # all of it is fixed, imm12 is 0 for ecall and 1 for ebreak
+        if args != [""]:
+            raise LineException(
+                f"{instruction} does not take arguments.",
+            )
+        bits = (
+            BitArray(uint=int(instruction == "ebreak"), length=12)
+            + BitArray(length=13)
+            + op_codes[instruction]
+        )
+
     if not bits:
         raise LineException(
             f"Instruction {instruction} was not handled.",
@@ -417,6 +476,17 @@ def bits_to_line(bits, labels=None):
         if address not in labels:
             labels[address] = f"LABEL_{len(labels)}"
         return f"{op} {rs1}, {rs2}, {labels[address]} # {labels[address]} <- {address}"
+    if op_code == op_codes["csrrs"]:
+        if bits.uint == 0x00000073:
+            return "ecall"
+        if bits.uint == 0x00100073:
+            return "ebreak"
+        if funct3.bin != "010":
+            raise ValueError(f"Invalid system funct3: {funct3.bin}")
+        csr = imm12.uint
+        if rs1 == "x0" and csr in csr_names:
+            return f"rd{csr_names[csr]} {rd}"
+        return f"csrrs {rd}, {csr_names.get(csr, hex(csr))}, {rs1}"
     imm20 = BitArray(length=21)
     imm20 = bits[31] + bits[19:12] + bits[20] + bits[30:25]
     imm20 = imm20 * 2
@@ -0,0 +1,66 @@
+import random
+
+import pytest
+from bitstring import BitArray
+
+from cpu_view import TextView
+from model import MVP_Model, Functional_Model
+from test_strings import memh_str_f, memh_str_ls, memh_str_b
+from testutil import WIDTHS_PROGRAM, DONE as WIDTHS_DONE, assemble, load_memh, make_controller
+
+np = pytest.importorskip("numpy")
+batch_sim = pytest.importorskip("batch_sim")
+
+SUM_PROGRAM = """
+add a1, zero, zero
+LOOP: beq a0, zero, DONE
+add a1, a1, a0
+addi a0, a0, -1
+j LOOP
+DONE: beq zero, zero, DONE
+"""
+
+
+def test_vector_alu_matches_mvp():
+    alu = MVP_Model.ALU(None)
+    rand = random.Random(3410)
+    for code, function in batch_sim.VECTOR_ALU.items():
+        for _ in range(200):
+            # full range operands, so wrap around and shift masking are compared too
+            a = rand.getrandbits(32)
+            b = rand.getrandbits(32)
+            expected = alu.calculate(code, BitArray(uint=a, length=32),
+                                     BitArray(uint=b, length=32)).uint
+            got = function(np.array([a], dtype=np.uint32), np.array([b], dtype=np.uint32))
+            assert int(got[0]) == expected, (code, a, b)
+
+
+def test_programs_match_functional_model():
+    for memh_str, stop_pc in [(memh_str_f, 0xd4), (memh_str_ls, None), (memh_str_b, 0x54)]:
+        memory = load_memh(memh_str)
+        controller = make_controller(Functional_Model, memory, view=TextView)
+        model = controller.model
+        model.run_until(pc=stop_pc)
+        sim = batch_sim.BatchSimulator(memory, 3)
+        sim.run()
+        assert sim.halted.all()
+        for result in sim.results():
+            assert result["registers"] == [model.read_register(i) for i in range(32)]
+
+
+def test_different_inputs():
+    sim = batch_sim.BatchSimulator(assemble(SUM_PROGRAM), 100)
+    sim.set_register(10, np.arange(100))
+    sim.run()
+    assert sim.regs[:, 11].tolist() == [n * (n + 1) // 2 for n in range(100)]
+    assert sim.instret.tolist() == [4 * n + 3 for n in range(100)]
+
+
+def test_load_store_widths():
+    memory = assemble(WIDTHS_PROGRAM)
+    controller = make_controller(Functional_Model, memory, view=TextView)
+    model = controller.model
+    model.run_until(pc=WIDTHS_DONE)
+    sim = batch_sim.BatchSimulator(memory, 2)
+    sim.run()
+    assert sim.results()[0]["registers"] == [model.read_register(i) for i in range(32)]
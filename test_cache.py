@@ -0,0 +1,48 @@
+import pytest
+
+from assembler import AssemblyProgram
+from cache import Cache, CacheHierarchy
+from model import MVP_Model, Functional_Model, Block_Model
+from testutil import WIDTHS_PROGRAM, DONE, make_controller
+
+
+def test_lru():
+    l2 = Cache("L2", size=1024, line_size=16, ways=4)
+    l1 = Cache("L1", size=256, line_size=16, ways=2, next_level=l2)  # 8 sets
+    a, b, c = 0x0, 0x80, 0x100  # all in set 0
+    assert [l1.access(a, True), l1.access(b), l1.access(a + 4), l1.access(c),
+            l1.access(b), l1.access(a)] == [False, False, True, False, False, False]
+    # c evicted b, b evicted a (written back), a evicted c
+    assert (l1.hits, l1.misses, l1.evictions, l1.writebacks) == (1, 5, 3, 1)
+    assert (l2.hits, l2.misses) == (3, 3)  # b and a come back from l2
+
+
+def test_write_policies():
+    l2 = Cache("L2", size=1024, line_size=16, ways=4)
+    l1 = Cache("L1", size=256, line_size=16, ways=2, write_back=False,
+               write_allocate=False, next_level=l2)
+    assert not l1.access(0x40, True)
+    assert not l1.access(0x40)  # the write did not bring the line in
+    assert l1.access(0x40, True)  # a write hit goes through to l2
+    assert l2.stats()["accesses"] == 3 and l1.writebacks == 0
+
+
+def run(model_class):
+    ap = AssemblyProgram()
+    for line in WIDTHS_PROGRAM.strip().split("\n"):
+        ap.parse_line(line)
+    controller = make_controller(model_class, ap.return_mem())
+    model = controller.model
+    controller.caches = CacheHierarchy(Cache("L1I", 256, 16, 2), Cache("L1D", 256, 16, 2),
+                                       Cache("L2", 4096, 32, 4))
+    model.run_until(pc=DONE)
+    return controller.caches.report(), controller.caches.line_report(ap)
+
+
+@pytest.mark.parametrize("model_class", [Functional_Model, Block_Model])
+def test_models_agree(model_class):
+    report, lines = run(model_class)
+    assert (report, lines) == run(MVP_Model)
+    assert report[1]["accesses"] == 10  # the loads and stores
+    assert report[0]["accesses"] == sum(line["accesses"] for line in lines
+                                        if line["level"] == "L1I")
@@ -0,0 +1,37 @@
+import pytest
+
+from checkpoint import snapshot, restore, save, load
+from model import MVP_Model, Functional_Model, Block_Model
+from test_strings import memh_str_f, memh_str_ls
+from testutil import load_memh, make_controller, machine_state
+
+
+@pytest.mark.parametrize("model_class, cycles", [
+    (MVP_Model, 301),  # stops part way through an instruction
+    (Functional_Model, 77),
+    (Block_Model, 77),
+])
+def test_restore_resumes(model_class, cycles):
+    for memh_str in (memh_str_f, memh_str_ls):
+        first = make_controller(model_class, load_memh(memh_str))
+        first.model.run_until(max_cycles=cycles)
+        data = snapshot(first)
+        first.model.run_until(max_cycles=2000)
+
+        second = make_controller(model_class, load_memh(memh_str))
+        restore(second, data)
+        assert snapshot(second) == data
+        second.model.run_until(max_cycles=2000)
+        assert machine_state(first) == machine_state(second)
+        assert repr(first.model.counters()) == repr(second.model.counters())
+
+
+def test_file_checkpoint(tmp_path):
+    first = make_controller(MVP_Model, load_memh(memh_str_f))
+    first.model.run_until(max_instructions=40)
+    save(first, tmp_path / "machine.ckpt")
+    second = make_controller(MVP_Model, load_memh("00000013"))
+    load(second, tmp_path / "machine.ckpt")
+    assert machine_state(first) == machine_state(second)
+    with pytest.raises(ValueError):
+        restore(make_controller(Functional_Model, load_memh(memh_str_f)), snapshot(first))
@@ -0,0 +1,98 @@
+import pytest
+
+from decoder import MVP_CYCLES, decode
+from model import MVP_Model, Functional_Model, Block_Model, STATE_FETCH, STATE_NAMES
+from testutil import assemble, make_controller
+
+CSR_PROGRAM = """
+addi t0, zero, 5
+rdcycle s0
+rdinstret s1
+LOOP: addi t0, t0, -1
+bne t0, zero, LOOP
+rdcycle s2
+rdinstret s3
+rdinstreth s4
+DONE: beq zero, zero, DONE
+"""
+DONE = 32
+
+# one instruction of each opcode class
+ONE_OF_EACH = """
+addi t0, zero, 8
+add t1, t0, t0
+sw t1, 0(t0)
+lw t2, 0(t0)
+beq t0, zero, END
+lui t3, 1
+auipc t4, 1
+jal ra, NEXT
+NEXT: jalr zero, zero, 36
+END: rdcycle s0
+"""
+
+
+def run_csr_program(model_class):
+    controller = make_controller(model_class, assemble(CSR_PROGRAM))
+    model = controller.model
+    model.run_until(pc=DONE)
+    return model, [model.read_register(i) for i in (8, 9, 18, 19, 20)]
+
+
+def test_counter_reads():
+    mvp, expected = run_csr_program(MVP_Model)
+    # addi takes 4 cycles, then rdcycle has retired by the rdinstret
+    assert expected[:2] == [4, 2]
+    assert expected[3] == 14 and expected[4] == 0
+    for model_class in (Functional_Model, Block_Model):
+        assert run_csr_program(model_class)[1] == expected
+    counters = mvp.counters()
+    assert counters.instret == 16
+    assert sum(counters.state_cycles.values()) == counters.cycles
+    assert counters.state_cycles['CSR read'] == 5
+    assert counters.op_mix['system type'] == 5
+
+
+def test_counters_match_mvp():
+    mvp = run_csr_program(MVP_Model)[0].counters()
+    for model_class in (Functional_Model, Block_Model):
+        counters = run_csr_program(model_class)[0].counters()
+        assert (counters.cycles, counters.instret) == (mvp.cycles, mvp.instret)
+        assert counters.op_mix == mvp.op_mix
+    model = run_csr_program(Block_Model)[0]
+    model.reset_counters()
+    assert model.counters().instret == 0
+
+
+def test_batch_counter_reads():
+    pytest.importorskip("numpy")
+    batch_sim = pytest.importorskip("batch_sim")
+    sim = batch_sim.BatchSimulator(assemble(CSR_PROGRAM), 3)
+    sim.run()
+    expected = run_csr_program(Functional_Model)[1]
+    for hart in sim.results():
+        assert [hart["registers"][i] for i in (8, 9, 18, 19, 20)] == expected
+
+
+def test_state_cycles_follow_dispatch():
+    controller = make_controller(MVP_Model, assemble(ONE_OF_EACH))
+    model = controller.model
+    expected = dict.fromkeys(STATE_NAMES, 0)
+    for _ in range(10):
+        # the states the dispatch table takes this opcode class through
+        op = decode(controller.instruction_memory.get(model.get_pc.uint).uint).op
+        path = []
+        state = STATE_FETCH
+        while not path or state != STATE_FETCH:
+            path.append(STATE_NAMES[state])
+            state = model._dispatch[state][op][1]
+        assert len(path) == MVP_CYCLES[op]
+        seen = []
+        while not seen or model.fsm_state_name != 'Fetch':
+            seen.append(model.fsm_state_name)
+            model.do_clock()
+        assert seen == path
+        for name in path:
+            expected[name] += 1
+    counters = model.counters()
+    assert counters.state_cycles == expected and counters.instret == 10
@@ -0,0 +1,45 @@
+import io
+
+import pytest
+
+from cpu_view import DiffTextView
+
+from model import MVP_Model, Functional_Model
+from register_file import RegisterFile, CompactRegisterFile
+from testutil import WIDTHS_PROGRAM, assemble, make_controller
+
+
+@pytest.mark.parametrize("register_class", [RegisterFile, CompactRegisterFile])
+@pytest.mark.parametrize("model_class", [MVP_Model, Functional_Model])
+def test_diff_view(model_class, register_class):
+    out = io.StringIO()
+    controller = make_controller(model_class, assemble(WIDTHS_PROGRAM), register_class(),
+                                 view=lambda model: DiffTextView(model, out=out))
+    model, view = controller.model, controller.view
+    for _ in range(13):
+        model.do_instruction()
+        view.draw()
+    registers = [line for line in out.getvalue().splitlines() if line.startswith("|")]
+    # x0 in the first frame, then t0, t1 (twice) and the seven loads
+    assert len(registers) == 11
+    assert registers.count("|x06 | t1 | fffffffe|") == 1
+    assert view.table() == repr(model.get_registers)
+    if register_class is CompactRegisterFile:  # drawing left the mask alone
+        assert model.get_registers.modified_regs == [5, 6, 8, 9, 18, 19, 20, 21, 22]
+
+
+def test_coalesce():
+    out = io.StringIO()
+    controller = make_controller(Functional_Model, assemble(WIDTHS_PROGRAM),
+                                 CompactRegisterFile(),
+                                 view=lambda model: DiffTextView(model, coalesce=5, out=out))
+    model, view = controller.model, controller.view
+    for _ in range(12):
+        model.do_instruction()
+        view.draw()
+    assert out.getvalue().count("PC :") == 2
+    view.flush()
+    frames = out.getvalue()
+    assert frames.count("PC :") == 3 and "(2 steps)" in frames
+    view.flush()  # nothing left to draw
+    assert out.getvalue() == frames
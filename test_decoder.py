@@ -0,0 +1,82 @@
+import random
+
+import pytest
+from bitstring import BitArray
+
+import rv32i
+from decoder import (OPCODE_CLASS, Decoded, DecodeCache, decode, decode_imm, WORD_ECALL,
+                     WORD_EBREAK)
+from model import IMM_DICT
+
+
+def gather_imm(word):
+    """the old way, gathers the imm bits one at a time using IMM_DICT"""
+    bits = BitArray(uint=word, length=32)
+    order = IMM_DICT[bits[-7:].bin]
+    imm = [bits[index] if index is not None else False for index in order]
+    return BitArray(imm).int
+
+
+def test_imm_extractors():
+    rand = random.Random(3410)
+    for opcode in OPCODE_CLASS:
+        if opcode == 0b0110011:  # r types have no imm
+            continue
+        if f"{opcode:07b}" not in IMM_DICT:  # csrs are not sign extended
+            continue
+        for _ in range(500):
+            word = (rand.getrandbits(25) << 7) | opcode
+            assert decode_imm(word) == gather_imm(word), hex(word)
+
+
+def test_imm_edges():
+    assert decode_imm(0xfff00113) == -1  # addi sp, zero, -1
+    assert decode_imm(0xfe512e23) == -4  # sw t0, -4(sp)
+    assert decode_imm(0xfe5ff06f) == -28  # j -28
+    assert decode_imm(0x80000037) == -2 ** 31  # lui x0, 0x80000
+    assert decode_imm(0x00b502b3) == 0  # add
+    assert decode_imm(0xc8202573) == 0xc82  # rdinstreth a0
+
+
+def test_vector_decode():
+    vector_decode = pytest.importorskip("vector_decode")
+    rand = random.Random(3410)
+    memory = {}
+    for i in range(2000):
+        opcode = rand.choice(list(OPCODE_CLASS))
+        memory[i * 4] = BitArray(uint=(rand.getrandbits(25) << 7) | opcode, length=32)
+    del memory[40]  # leave a hole
+    program = vector_decode.decode_program(memory)
+    assert len(program) == 2000
+    assert program.record(10) is None
+    for pc, bits in memory.items():
+        expected = decode(bits.uint)
+        record = program.record(pc >> 2)
+        for field in Decoded.__slots__:
+            assert getattr(record, field) == getattr(expected, field), (field, bits)
+
+
+def test_preload():
+    vector_decode = pytest.importorskip("vector_decode")
+    words = [0x00500293, 0x00128313, 0x00500293, 0x0000006F]  # one repeated
+    cache = DecodeCache()
+    cache.preload(vector_decode.decode_program(
+        dict((4 * i, BitArray(uint=word, length=32)) for i, word in enumerate(words))))
+    assert len(cache) == 3 and (cache.hits, cache.misses) == (0, 0)
+    for word in words:
+        assert cache.lookup(word).rd == decode(word).rd
+    assert (cache.hits, cache.misses) == (4, 0)
+
+
+def test_preload_words():
+    cache = DecodeCache()
+    cache.preload_words([0x00500293, 0, 0xFFFFFFFF, 0x00500293])
+    assert list(cache.records) == [0x00500293]
+    assert cache.lookup(0x00500293).rd == 5 and (cache.hits, cache.misses) == (1, 0)
+
+
+def test_ecall_ebreak_round_trip():
+    for word, line in [(WORD_ECALL, "ecall"), (WORD_EBREAK, "ebreak")]:
+        bits = rv32i.line_to_bits({"instruction": line, "args": [""]})
+        assert bits.uint == word
+        assert rv32i.bits_to_line(bits) == line
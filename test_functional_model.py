@@ -0,0 +1,143 @@
+import pytest
+from bitstring import BitArray
+
+from cpu_view import TextView
+from decoder import WORD_ECALL, WORD_EBREAK
+from model import MVP_Model, Functional_Model, Block_Model
+from test_strings import memh_str_f, memh_str_ls, memh_str_b
+from testutil import load_memh, make_controller, machine_state
+
+
+def run_program(model_class, memh_str, count):
+    controller = make_controller(model_class, load_memh(memh_str), view=TextView)
+    model = controller.model
+    for _ in range(count):
+        if controller._at_end_of_mem:
+            break
+        model.do_instruction()
+    return machine_state(controller)
+
+
+def check_same(memh_str, count, check_pc=True):
+    mvp = run_program(MVP_Model, memh_str, count)
+    functional = run_program(Functional_Model, memh_str, count)
+    if check_pc:  # the MVP moves the pc past the end of the program
+        assert mvp[0] == functional[0]
+    assert mvp[1] == functional[1]
+    assert mvp[2] == functional[2]
+
+
+def test_function_calls():
+    check_same(memh_str_f, 400)
+
+
+def test_load_store():
+    check_same(memh_str_ls, 30, check_pc=False)
+
+
+def test_branches():
+    check_same(memh_str_b, 30)
+
+
+def run_to_pc(model_class, memh_str, stop_pc):
+    controller = make_controller(model_class, load_memh(memh_str), view=TextView)
+    model = controller.model
+    while model.get_pc.uint != stop_pc and model.do_instruction():
+        pass
+    return machine_state(controller)
+
+
+def test_blocks():
+    for memh_str, stop_pc in [(memh_str_f, 0xd4), (memh_str_ls, 0x5c), (memh_str_b, 0x54)]:
+        assert run_to_pc(Functional_Model, memh_str, stop_pc) == \
+            run_to_pc(Block_Model, memh_str, stop_pc)
+
+
+def test_run_until():
+    for model_class in [MVP_Model, Functional_Model, Block_Model]:
+        controller = make_controller(model_class, load_memh(memh_str_b), view=TextView)
+        model = controller.model
+        summary = controller.run_batch(until_pc=0x54)
+        assert (summary.instructions, summary.stop_reason) == (15, 'pc')
+        # the pc is at INFINITE_LOOP, a branch to itself
+        summary = controller.run_batch(max_instructions=5)
+        assert (summary.instructions, summary.stop_reason) == (1, 'self loop')
+        assert model.halt_reason == 'self loop'
+        assert model.read_register(15) == 1
+        model.do_reset()
+        summary = controller.run_batch(max_instructions=5)
+        assert (summary.instructions, summary.stop_reason) == (5, 'max instructions')
+        assert model.halt_reason is None
+
+
+@pytest.mark.parametrize("model_class", [MVP_Model, Functional_Model, Block_Model])
+@pytest.mark.parametrize("word, reason", [(WORD_ECALL, 'ecall'), (WORD_EBREAK, 'ebreak'),
+                                          (0x0000006F, 'self loop'), (None, 'halt')])
+def test_halt(model_class, word, reason):
+    program = load_memh(memh_str_b)
+    program = dict((pc, bits) for pc, bits in program.items() if pc < 0x54)
+    if word is not None:  # in place of INFINITE_LOOP
+        program[0x54] = BitArray(uint=word, length=32)
+    controller = make_controller(model_class, program)
+    model = controller.model
+    summary = controller.run_batch(max_instructions=1000)
+    assert (summary.instructions, summary.stop_reason) == \
+        (16 if word is not None else 15, reason)
+    assert model.halt_reason == reason and model.read_register(15) == 1
+    if word is not None:
+        assert summary.pc == 0x54
+
+
+@pytest.mark.parametrize("model_class", [MVP_Model, Functional_Model, Block_Model])
+def test_run_file_budget(model_class, tmp_path, capsys):
+    program = tmp_path / "sum.s"
+    program.write_text("addi t0, zero, 0\nLOOP: addi t0, t0, 1\naddi t1, t0, 2\n"
+                       "addi t2, t0, 3\nbeq zero, zero, LOOP\n")
+    controller = make_controller(model_class)
+    model = controller.model
+    assert controller.run(str(program), max_instructions=10) == 'max instructions'
+    assert model.counters().instret == 10 and model.read_register(5) == 3
+
+
+@pytest.mark.parametrize("model_class", [MVP_Model, Functional_Model, Block_Model])
+def test_budget_at_end_of_program(model_class):
+    # the first four instructions, the budget runs out at the end
+    controller = make_controller(model_class, dict(
+        (pc, bits) for pc, bits in load_memh(memh_str_b).items() if pc < 4 * 4))
+    summary = controller.run_batch(max_instructions=4)
+    assert (summary.instructions, summary.stop_reason) == (4, 'max instructions')
+    assert not controller._at_end_of_mem
+
+
+@pytest.mark.parametrize("model_class", [Functional_Model, Block_Model])
+@pytest.mark.parametrize("word, instret", [(0x300020F3, 3), (0xFFFFFFFF, 2)])
+def test_raise_inside_block(model_class, word, instret):
+    controller = make_controller(model_class)
+    model = controller.model
+    # addi x5, x0, 7; addi x6, x5, 1; then csrrs x1, mstatus, x0 (not
+    # supported) or a word that does not decode
+    controller.instruction_memory = dict(
+        (4 * i, BitArray(uint=w, length=32))
+        for i, w in enumerate([0x00700293, 0x00128313, word, 0x00000013]))
+    with pytest.raises(ValueError):
+        controller.run_batch(max_instructions=100)
+    assert model.get_pc.uint == 8
+    assert model.read_register(5) == 7 and model.read_register(6) == 8
+    # counted once it has decoded, like the other models
+    assert model.counters().instret == instret
+
+
+def test_wire_states():
+    controller = make_controller(MVP_Model, load_memh(memh_str_b))
+    model = controller.model
+    registers = {"PC", "old PC", "instruction", "alu_result_old", "rs1_data", "rs2_data"}
+    while model.fsm_state_name != 'Execute I':
+        model.do_clock()
+    # nothing worked out yet this cycle, only the registers
+    assert set(model.wire_states()) == registers
+    result = model._alu_result
+    wires = model.wire_states()
+    assert wires["alu_result"] is result and model._alu_result is result
+    assert registers < set(wires)
+    model.do_clock()  # the clock edge drops the nets
+    assert set(model.wire_states()) == registers
@@ -0,0 +1,45 @@
+import json
+
+from assembler import AssemblyProgram
+from heatmap import HeatMap, HeatReport
+from model import MVP_Model, Functional_Model, Block_Model
+from testutil import make_controller
+
+LOOP_PROGRAM = """
+addi a0, zero, 10
+add a1, zero, zero
+LOOP: beq a0, zero, DONE
+add a1, a1, a0
+addi a0, a0, -1
+j LOOP
+DONE: beq zero, zero, DONE
+"""
+
+
+def profile(model_class):
+    ap = AssemblyProgram()
+    for line in LOOP_PROGRAM.strip().split("\n"):
+        ap.parse_line(line)
+    controller = make_controller(model_class, ap.return_mem())
+    model = controller.model
+    heat = HeatMap(2)  # has to grow
+    model.set_heat_map(heat)
+    model.run_until(pc=24)
+    return heat, ap
+
+
+def test_heat_map():
+    for model_class in (MVP_Model, Functional_Model, Block_Model):
+        heat, ap = profile(model_class)
+        assert [heat.count(pc) for pc in range(0, 28, 4)] == [1, 1, 11, 10, 10, 10, 0]
+    report = HeatReport(heat, ap)
+    assert report.total == 43
+    assert report.lines[0] == {"pc": 8, "line": 3, "source": "LOOP: beq a0, zero, DONE",
+                               "label": "LOOP", "count": 11, "percent": 25.58}
+    assert [(label["label"], label["count"]) for label in report.labels] == \
+        [("LOOP", 41), ("DONE", 0)]
+    assert json.loads(report.to_json())["lines"] == report.lines
+    listing = report.listing().splitlines()
+    assert len(listing) == 7
+    assert listing[2] == (f"{ap.return_mem()[8].hex} // PC=0x8 line=3: "
+                          "LOOP: beq a0, zero, DONE // count=11 (25.58%)")
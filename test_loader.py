@@ -0,0 +1,79 @@
+import struct
+
+from loader import load_data, load_program, parse_memh
+from model import Functional_Model, Block_Model
+from testutil import assemble, make_controller
+
+# sums the words from 0x1000_0000 up to the first 0 into a1
+SUM_PROGRAM = """
+lui t0, 65536
+add a1, zero, zero
+LOOP: lw t1, 0(t0)
+beq t1, zero, DONE
+add a1, a1, t1
+addi t0, t0, 4
+beq zero, zero, LOOP
+DONE: beq zero, zero, DONE
+"""
+
+
+def test_parse_memh():
+    text = "00000013 // PC=0x0\n\n1 2 // two words\n@10\nffffffff\n"
+    assert list(parse_memh(text)) == [(0, 0x13), (1, 1), (2, 2), (16, 0xFFFFFFFF)]
+
+
+def test_map_binary(tmp_path):
+    image = tmp_path / "data.bin"
+    image.write_bytes(struct.pack("<5I", 1, 2, 3, 4, 0) + bytes(5000))
+    controller = make_controller(Functional_Model)
+    assert load_data(controller, str(image), 0x1000_0000) == 5020
+    assert controller.data_memory.read_word(0x1000_0008) == 3
+    # copy on write, the file does not change
+    controller.data_memory.write_word(0x1000_0000, 10)
+    assert controller.data_memory.read_word(0x1000_0000) == 10
+    assert image.read_bytes()[:4] == struct.pack("<I", 1)
+
+    shared = make_controller(Functional_Model)
+    load_data(shared, str(image), 0x2000_0000, shared=True)
+    shared.data_memory.write_word(0x2000_0000, 10)
+    shared.data_memory.clear()  # drops the mapping
+    assert image.read_bytes()[:4] == struct.pack("<I", 10)
+
+
+def test_load_images(tmp_path):
+    program = tmp_path / "sum.bin"
+    words = [bits.uint for bits in assemble(SUM_PROGRAM).values()]
+    program.write_bytes(struct.pack(f"<{len(words)}I", *words))
+    data = tmp_path / "data.memh"
+    data.write_text("00000005 // first\n00000007\n00000009\n00000000\n")
+    controller = make_controller(Functional_Model)
+    assert load_program(controller, str(program)) == len(words)
+    assert load_data(controller, str(data), 0x1000_0000) == 16
+    controller.model.run_until(pc=4 * (len(words) - 1))
+    assert controller.model.read_register(11) == 21
+
+
+def test_load_preloads(tmp_path):
+    program = tmp_path / "sum.bin"
+    words = [bits.uint for bits in assemble(SUM_PROGRAM).values()]
+    program.write_bytes(struct.pack(f"<{len(words)}I", *words))
+    controller = make_controller(Functional_Model)
+    load_program(controller, str(program))
+    cache = controller.model.decode_cache
+    assert len(cache) == len(set(words))
+    controller.model.run_until(max_instructions=20)
+    assert cache.misses == 0
+
+
+def test_load_second_program(tmp_path):
+    controller = make_controller(Block_Model)
+    model = controller.model
+    for value in (1, 2):
+        program = tmp_path / f"p{value}.memh"
+        # addi a0, zero, value; a jump to itself
+        program.write_text(f"{value << 20 | 0x00000513:08x}\n0000006f\n")
+        load_program(controller, str(program))
+        model.do_reset()
+        # the block translated from the first program is not run again
+        assert model.run_until(max_instructions=10).stop_reason == 'self loop'
+        assert model.read_register(10) == value
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from main import main, EXIT_HALTED, EXIT_ERROR, EXIT_BUDGET
+from testutil import WIDTHS_PROGRAM, DONE
+
+
+@pytest.mark.parametrize("model", ["mvp", "functional", "block"])
+def test_json(model, tmp_path, capsys):
+    program = tmp_path / "widths.s"
+    program.write_text(WIDTHS_PROGRAM)
+    assert main([str(program), "--model", model, "--format", "json", "--stats"]) == EXIT_HALTED
+    result = json.loads(capsys.readouterr().out)
+    assert (result["stop_reason"], result["instructions"], result["pc"]) == ('self loop', 14, DONE)
+    assert result["registers"][20] == 0x81000481
+    assert result["stats"]["instret"] == 14
+    # the same number of cycles on every model
+    assert result["cycles"] == result["stats"]["cycles"] == 61
+    # decoded when it was loaded
+    assert result["stats"]["decode_cache"]["misses"] == 0
+
+
+def test_exit_codes(tmp_path, capsys):
+    program = tmp_path / "widths.s"
+    program.write_text(WIDTHS_PROGRAM)
+    assert main([str(program), "-n", "5"]) == EXIT_BUDGET
+    assert "Stopped: max instructions after 5 instructions" in capsys.readouterr().out
+    assert main([str(tmp_path / "missing.s")]) == EXIT_ERROR
+
+
+@pytest.mark.parametrize("model", ["mvp", "functional", "block"])
+@pytest.mark.parametrize("halt", ["ecall", "ebreak"])
+def test_ecall_ebreak(model, halt, tmp_path, capsys):
+    program = tmp_path / "halt.s"
+    program.write_text(f"addi a0, zero, 3\naddi a0, a0, 4\n{halt}\naddi a0, zero, 0\n")
+    assert main([str(program), "--model", model, "--format", "json"]) == EXIT_HALTED
+    result = json.loads(capsys.readouterr().out)
+    assert (result["stop_reason"], result["instructions"], result["pc"]) == (halt, 3, 8)
+    assert result["registers"][10] == 7
+
+
+def test_high_memh_image(tmp_path, capsys):
+    image = tmp_path / "high.memh"
+    image.write_text("@08000000\n00000013\n")
+    assert main([str(image)]) == EXIT_ERROR
+    assert "too high" in capsys.readouterr().err
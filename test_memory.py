@@ -0,0 +1,76 @@
+import pytest
+
+from bitstring import BitArray
+
+from memory import FlatMemory, InstructionMemory, PagedMemory
+from model import MVP_Model, Functional_Model, Block_Model
+from testutil import WIDTHS_PROGRAM, DONE, assemble, make_controller
+
+def test_flat_memory():
+    memory = FlatMemory(64)
+    memory.write_word(8, 0x80FF1234)
+    assert memory.read_bytes(8, 4) == bytes([0x34, 0x12, 0xFF, 0x80])
+    assert memory.read_half(10) == 0x80FF
+    assert memory.load(10, 1) == 0xFFFF80FF  # lh sign extends
+    assert memory.load(10, 0) == 0xFFFFFFFF  # lb
+    assert memory.load(9, 4) == 0x12  # lbu
+    memory.write_byte(9, 0x1AB)
+    assert memory.read_word(8) == 0x80FFAB34
+    assert memory.words() == {8: 0x80FFAB34}
+    with pytest.raises(IndexError):
+        memory.read_word(62)
+    memory.clear()
+    assert memory.read_word(8) == 0 and memory.words() == {}
+
+
+@pytest.mark.parametrize("memory_class", [FlatMemory, PagedMemory])
+def test_wrap_around(memory_class):
+    memory = memory_class()
+    memory.write_word(0xFFFFFFFE, 0x11223344)
+    assert memory.read_half(0xFFFFFFFE) == 0x3344
+    assert memory.read_half(0) == 0x1122
+    assert memory.read_word(0xFFFFFFFE) == 0x11223344
+
+
+def test_paged_memory():
+    memory = PagedMemory()
+    assert memory.read_word(0x3000_03FC) == 0
+    assert memory.resident_pages() == []  # reads do not make pages
+    memory.write_word(0x3000_03FC, 0xDEADBEEF)
+    memory.write_half(0x8000_0FFF, 0xABCD)  # runs onto the next page
+    memory.write_byte(0x10, 7)
+    assert memory.resident_pages() == [0, 0x3000_0000, 0x8000_0000, 0x8000_1000]
+    assert memory.resident_bytes() == 4 * 4096
+    assert memory.read_byte(0x8000_0FFF) == 0xCD
+    assert memory.load(0x8000_0FFF, 1) == 0xFFFFABCD
+    assert memory.words() == {0x10: 7, 0x3000_03FC: 0xDEADBEEF,
+                              0x8000_0FFC: 0xCD000000, 0x8000_1000: 0xAB}
+    memory.clear()
+    assert memory.resident_pages() == [] and memory.read_word(0x3000_03FC) == 0
+
+
+def test_instruction_memory():
+    program = assemble(WIDTHS_PROGRAM)
+    memory = InstructionMemory(program)
+    assert list(memory.words) == [bits.uint for bits in program.values()]
+    assert memory.items() == list(program.items())
+    assert memory.word(4) == program[4].uint and memory.get(4) is memory[4]
+    assert memory.word(4 * len(program)) is None and 4 * len(program) not in memory
+    assert memory.word(6) is None  # not word aligned
+    memory[4] = 0x13
+    assert memory[4] == BitArray(uint=0x13, length=32)
+    memory[0x100] = program[0]  # leaves a gap of pcs with no instruction
+    assert 0x80 not in memory and len(memory) == len(program) + 1
+    with pytest.raises(ValueError):  # would allocate the 512 MiB below it
+        memory[0x2000_0000] = 0x13
+
+
+@pytest.mark.parametrize("model_class", [MVP_Model, Functional_Model, Block_Model])
+def test_load_store_widths(model_class):
+    controller = make_controller(model_class, assemble(WIDTHS_PROGRAM))
+    model = controller.model
+    model.run_until(pc=DONE)
+    assert [model.read_register(i) for i in (8, 9, 18, 19, 20, 21, 22)] == \
+        [0xFFFFFF81, 0x81, 0xFFFFFFFE, 0xFFFE, 0x81000481, 0xFFFF8100, 0xFF]
+    assert controller.data_memory.words() == {0x30000000: 0xFFFFFFFE,
+                                              0x30000004: 0x81000481}
@@ -0,0 +1,70 @@
+import io
+
+import pytest
+
+from mmio import Bus, Device, add_default_devices
+from model import MVP_Model, Functional_Model, Block_Model
+from testutil import assemble, make_controller
+
+# prints "Hi", reads the console status and the timer, then exits with the
+# status as the exit code
+HELLO_PROGRAM = """
+lui t0, 65536
+addi t1, zero, 72
+sb t1, 0(t0)
+addi t1, zero, 105
+sb t1, 0(t0)
+lw t2, 4(t0)
+lui t3, 8192
+lw t4, 0(t3)
+lui t5, 256
+sw t2, 0(t5)
+sw t2, 64(t0)
+DONE: beq zero, zero, DONE
+"""
+
+
+@pytest.mark.parametrize("model_class", [MVP_Model, Functional_Model, Block_Model])
+def test_devices(model_class):
+    controller = make_controller(model_class, assemble(HELLO_PROGRAM))
+    model = controller.model
+    out = io.StringIO()
+    bus, console, timer, exit_device = add_default_devices(controller, out)
+    # the exit store stops the run, then the output is flushed
+    summary = controller.run_batch(max_instructions=100)
+    assert (summary.instructions, summary.stop_reason) == (10, 'exit')
+    assert model.halt_reason == 'exit' and summary.pc == 40
+    assert exit_device.code == 1
+    assert model.read_register(29) > 0  # the timer counts cycles
+    assert out.getvalue() == "Hi"
+    # the page the console is on is still RAM outside the console
+    model.run_until(max_instructions=1)
+    assert bus.ram.read_word(0x1000_0040) == 1
+
+
+@pytest.mark.parametrize("model_class", [MVP_Model, Functional_Model, Block_Model])
+def test_console_buffered(model_class):
+    controller = make_controller(model_class, assemble(HELLO_PROGRAM))
+    model = controller.model
+    out = io.StringIO()
+    bus, console, timer, exit_device = add_default_devices(controller, out)
+    model.run_until(max_instructions=100)
+    assert model.halt_reason == 'exit'
+    assert out.getvalue() == ""  # still buffered
+    bus.flush()
+    assert out.getvalue() == "Hi"
+
+
+def test_bus_regions():
+    class Echo(Device):
+        def read(self, offset, size):
+            return 0x80 + offset
+
+    bus = Bus(make_controller(MVP_Model).data_memory)
+    bus.add_device(0x2000, 16, Echo())
+    with pytest.raises(ValueError):
+        bus.add_device(0x200C, 16, Echo())
+    assert bus.load(0x2001, 4) == 0x81  # lbu
+    assert bus.load(0x2001, 0) == 0xFFFFFF81  # lb sign extends
+    bus.store(0x2010, 5)
+    assert bus.load(0x2010) == 5 and bus.ram.read_word(0x2010) == 5
@@ -0,0 +1,44 @@
+import pytest
+
+from bitstring import BitArray
+
+from model import MVP_Model, Functional_Model, Block_Model
+from register_file import RegisterFile, CompactRegisterFile
+from testutil import WIDTHS_PROGRAM, DONE, assemble, make_controller
+
+
+def test_compact_register_file():
+    registers = CompactRegisterFile()
+    assert registers.get_data(BitArray(uint=0, length=5)).uint == 0
+    assert registers.get_data(5) is None
+    data = BitArray(uint=0xDEADBEEF, length=32)
+    registers.set_data(BitArray(uint=5, length=5), data)
+    registers.set_data(7, -1)
+    registers.set_data(0, 3)  # x0 stays 0
+    assert registers.get_data(5) is data
+    assert registers.get_data(7).uint == 0xFFFFFFFF
+    assert registers.get_data(0).uint == 0
+    assert registers.modified_regs == [5, 7]
+    registers.set_data(5, 1)
+    assert registers.modified_regs == [5, 7]
+
+
+def test_modified_regs_bounded():
+    registers = RegisterFile()
+    for _ in range(10):
+        registers.set_data(BitArray(uint=5, length=5), BitArray(uint=1, length=32))
+    assert len(registers.modified_regs) == 1
+
+
+@pytest.mark.parametrize("model_class", [MVP_Model, Functional_Model, Block_Model])
+def test_same_as_register_file(model_class):
+    results = []
+    for register_file in (RegisterFile(), CompactRegisterFile()):
+        controller = make_controller(model_class, assemble(WIDTHS_PROGRAM), register_file)
+        model = controller.model
+        model.run_until(pc=DONE)
+        registers = model.get_registers
+        registers.switch_display()
+        results.append((repr(registers), [model.read_register(i) for i in range(32)],
+                        [reg.data for reg in registers.regfile]))
+    assert results[0] == results[1]
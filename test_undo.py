@@ -0,0 +1,56 @@
+import pytest
+
+from model import MVP_Model, Functional_Model, Block_Model
+from test_strings import memh_str_f, memh_str_ls
+from testutil import load_memh, make_controller, machine_state
+from undo import UndoLog
+
+
+@pytest.mark.parametrize("model_class", [MVP_Model, Functional_Model, Block_Model])
+def test_step_back(model_class):
+    for memh_str, count in ((memh_str_f, 40), (memh_str_ls, 20)):
+        controller = make_controller(model_class, load_memh(memh_str))
+        model = controller.model
+        model.set_undo(UndoLog(16))
+        states = []
+        for _ in range(count):
+            states.append(machine_state(controller))
+            model.do_instruction()
+        end = machine_state(controller)
+        # only the last 16 instructions can be undone
+        for state in reversed(states[-16:]):
+            assert model.step_back() == 1
+            assert machine_state(controller) == state
+        assert model.step_back() == 0
+        # running forward again ends up in the same place
+        for _ in states[-16:]:
+            model.do_instruction()
+        assert machine_state(controller) == end
+
+
+@pytest.mark.parametrize("model_class", [MVP_Model, Functional_Model, Block_Model])
+def test_step_back_from_end(model_class):
+    controller = make_controller(model_class, load_memh(memh_str_ls))
+    model = controller.model
+    model.set_undo(UndoLog())
+    model.run()
+    end = machine_state(controller)
+    assert model.step_back(3) == 3
+    assert not controller._at_end_of_mem
+    model.run()
+    assert machine_state(controller) == end
+
+
+def test_run_back_until():
+    controller = make_controller(Functional_Model, load_memh(memh_str_f))
+    model = controller.model
+    model.set_undo(UndoLog())
+    model.run(max_instructions=10)
+    start = machine_state(controller)
+    model.run(max_instructions=50)
+    assert model.run_back_until(start[0]) >= 1
+    assert model.get_pc.uint == start[0]
+    model.set_undo(UndoLog())
+    model.run(max_instructions=30)
+    assert model.step_back(100) == 30
+    assert model.get_pc.uint == start[0]
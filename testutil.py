@@ -0,0 +1,65 @@
+"""
+Helpers shared by the tests: turning assembly or memh text into an
+instruction memory, building a controller around a model and reading back
+the state of the machine. The memh programs are in test_strings.py.
+"""
+from bitstring import BitArray
+
+from assembler import AssemblyProgram
+from controller import Controller
+from cpu_view import NullView
+from register_file import RegisterFile
+
+# stores a word, a halfword and a byte then loads them back at every width
+WIDTHS_PROGRAM = """
+lui t0, 196608
+addi t1, zero, -2
+sw t1, 0(t0)
+addi t1, zero, 1153
+sh t1, 4(t0)
+sb t1, 7(t0)
+lb s0, 4(t0)
+lbu s1, 4(t0)
+lh s2, 0(t0)
+lhu s3, 0(t0)
+lw s4, 4(t0)
+lh s5, 6(t0)
+lbu s6, 3(t0)
+DONE: beq zero, zero, DONE
+"""
+DONE = 52
+
+
+def assemble(text):
+    """assembles text and returns the {pc: BitArray} that return_mem gives"""
+    ap = AssemblyProgram()
+    for line in text.strip().split("\n"):
+        ap.parse_line(line)
+    return ap.return_mem()
+
+
+def load_memh(memh_str):
+    """turns a memh string into the same dict that return_mem gives"""
+    return dict((i * 4, BitArray("0x" + line.split(" ")[0], length=32))
+                for i, line in enumerate(memh_str.split("\n")))
+
+
+def make_controller(model_class, program=None, register_file=None, view=NullView):
+    """
+    returns a Controller for a new model_class (with a RegisterFile unless
+    register_file is given) drawn by view, with program (anything the
+    instruction_memory setter takes) loaded
+    """
+    model = model_class(register_file=register_file if register_file is not None
+                        else RegisterFile())
+    controller = Controller(model, view(model))
+    if program is not None:
+        controller.instruction_memory = program
+    return controller
+
+
+def machine_state(controller):
+    """returns (pc, registers, data memory words) to compare machines with"""
+    model = controller.model
+    return (model.get_pc.uint, [model.read_register(i) for i in range(32)],
+            controller.data_memory.words())
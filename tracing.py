@@ -0,0 +1,125 @@
+"""
+Trace sinks for the RISC-V simulator. The models hand trace events to a sink
+instead of printing them, and only when the sink's level asks for them, so
+with tracing off the hot loops do no formatting at all.
+"""
+import sys
+from abc import ABC, abstractmethod
+
+# trace levels
+TRACE_OFF = 0
+TRACE_INSTRUCTION = 1  # one event per instruction
+TRACE_CYCLE = 2  # one event per clock cycle (fsm state) as well
+
+TRACE_LEVELS = {
+    'off': TRACE_OFF,
+    'instruction': TRACE_INSTRUCTION,
+    'cycle': TRACE_CYCLE,
+}
+
+
+class TraceSink(ABC):
+    """
+    Abstract class for trace sinks.
+
+    Attributes:
+        level: The trace level the sink wants (one of the TRACE_* constants).
+    """
+
+    def __init__(self, level=TRACE_INSTRUCTION):
+        self.level = level
+
+    @abstractmethod
+    def cycle(self, pc, state):
+        """called once per clock cycle with the pc (int) and the fsm state name"""
+        pass
+
+    @abstractmethod
+    def instruction(self, pc, word):
+        """called once per instruction with its pc and word (ints)"""
+        pass
+
+    @abstractmethod
+    def message(self, text):
+        """called with any other text (like assembler notes)"""
+        pass
+
+    def flush(self):
+        """writes out anything that is buffered"""
+        pass
+
+
+class NullSink(TraceSink):
+    """
+    Sink that drops everything. Its level is off so nothing is even sent.
+    """
+
+    def __init__(self):
+        super().__init__(TRACE_OFF)
+
+    def cycle(self, pc, state):
+        pass
+
+    def instruction(self, pc, word):
+        pass
+
+    def message(self, text):
+        pass
+
+
+class TextSink(TraceSink):
+    """
+    Sink that formats events as text and writes them to a stream in batches
+    of buffer_lines lines (1 writes every line straight away).
+    """
+
+    def __init__(self, stream=None, level=TRACE_INSTRUCTION, buffer_lines=1024):
+        super().__init__(level)
+        self.stream = stream if stream is not None else sys.stdout
+        self.buffer_lines = buffer_lines
+        self._lines = []
+
+    def _write(self, line):
+        self._lines.append(line)
+        if len(self._lines) >= self.buffer_lines:
+            self.flush()
+
+    def cycle(self, pc, state):
+        self._write(f"{pc:#010x}\n{state}")
+
+    def instruction(self, pc, word):
+        self._write(f"{pc:#010x}: {word:08x}")
+
+    def message(self, text):
+        self._write(text)
+
+    def flush(self):
+        if self._lines:
+            self.stream.write("\n".join(self._lines) + "\n")
+            self._lines = []
+        self.stream.flush()
+
+
+class ListSink(TraceSink):
+    """
+    Sink that keeps the raw events in memory, no formatting is done.
+    Events are tuples of ('cycle', pc, state), ('instruction', pc, word)
+    or ('message', text).
+    """
+
+    def __init__(self, level=TRACE_INSTRUCTION):
+        super().__init__(level)
+        self.events = []
+
+    def cycle(self, pc, state):
+        self.events.append(('cycle', pc, state))
+
+    def instruction(self, pc, word):
+        self.events.append(('instruction', pc, word))
+
+    def message(self, text):
+        self.events.append(('message', text))
+
+    def clear(self):
+        """drops the recorded events"""
+        self.events = []
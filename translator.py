@@ -0,0 +1,301 @@
+"""
+Basic block translator for the RISC-V simulator. Splits the program in
+instruction memory into basic blocks (straight line code ending at a branch,
+jal or jalr), writes python source for each block and compiles it once into
+a function that works directly on a list of 32 int registers.
+
+Each block function has the signature `block(r, load, store, csr)` where
+`r` is the register list, `load(addr, funct3)` returns the byte, halfword
+or word at addr as an int, `store(addr, value, funct3)` writes one (funct3
+is the width, like FlatMemory) and `csr(inst, instret, cycles)` does a
+counter read (see BlockTranslator.lookup). It returns the pc of the next
+block. ecall and ebreak end a block and return their own pc, so a block that
+returns the pc of its last instruction has halted (see decoder.halt_reason).
+"""
+from bisect import bisect_right
+
+from decoder import (decode, check_counter_read, is_halt, MVP_CYCLES, OP_NAMES, OP_L,
+                     OP_I, OP_S, OP_R, OP_B, OP_JALR, OP_JAL, OP_LUI, OP_AUI,
+                     OP_SYSTEM)
+
+MASK32 = 0xFFFFFFFF
+SIGN = 0x80000000
+
+# expressions for the ALU codes, `a` and `b` get replaced with the operands
+# (signed compares flip the sign bit so they can be done on unsigned ints)
+ALU_EXPRESSIONS = {
+    '0000': "({a} + {b}) & 0xFFFFFFFF",
+    '0001': "({a} - {b}) & 0xFFFFFFFF",
+    '0010': "({a} << {sh}) & 0xFFFFFFFF",
+    '0100': "int(({a} ^ 0x80000000) < ({b} ^ 0x80000000))",
+    '0110': "int({a} < {b})",
+    '1000': "{a} ^ {b}",
+    '1010': "{a} >> {sh}",
+    '1011': "((({a} ^ 0x80000000) - 0x80000000) >> {sh}) & 0xFFFFFFFF",
+    '1100': "{a} | {b}",
+    '1110': "{a} & {b}",
+}
+
+# branch conditions keyed by funct3
+BRANCH_EXPRESSIONS = {
+    0: "{a} == {b}",
+    1: "{a} != {b}",
+    4: "({a} ^ 0x80000000) < ({b} ^ 0x80000000)",
+    5: "({a} ^ 0x80000000) >= ({b} ^ 0x80000000)",
+    6: "{a} < {b}",
+    7: "{a} >= {b}",
+}
+
+# instructions that end a basic block
+TERMINATORS = (OP_B, OP_JAL, OP_JALR)
+
+
+class Block:
+    """
+    A translated basic block.
+
+    Attributes:
+        pc: The entry pc of the block.
+        length: The number of instructions in the block.
+        write_mask: Bitmask of the registers the block can write.
+        function: The compiled block function.
+        source: The python source the function was compiled from.
+        last_pc: The pc of the last instruction.
+        last_bits: The last instruction of the block (a BitArray).
+        op_counts: How many instructions of each opcode class it has.
+        lines: (line number in the source, opcode class) of each instruction.
+        entries: How many times the block has been run.
+    """
+    __slots__ = ('pc', 'length', 'write_mask', 'function', 'source',
+                 'last_pc', 'last_bits', 'op_counts', 'lines', 'entries')
+
+    def __init__(self, pc, length, write_mask, function, source, last_bits,
+                 op_counts, lines):
+        self.pc = pc
+        self.length = length
+        self.write_mask = write_mask
+        self.function = function
+        self.source = source
+        self.last_pc = (pc + 4 * (length - 1)) & MASK32
+        self.last_bits = last_bits
+        self.op_counts = op_counts
+        self.lines = lines
+        self.entries = 0
+
+    def __repr__(self):
+        return f"Block(pc={self.pc:#x}, length={self.length}, entries={self.entries})"
+
+
+def find_block(memory, pc, max_length=64):
+    """
+    Returns the list of (pc, bits, Decoded) that make up the basic block
+    starting at pc. The block ends after a branch, jump, ecall or ebreak, at
+    the end of instruction memory or after max_length instructions. It also
+    ends before a word that does not decode, so the instructions before it
+    run; the ValueError is raised when that word starts a block.
+    """
+    instructions = []
+    while len(instructions) < max_length:
+        bits = memory.get(pc)
+        if bits is None:
+            break
+        try:
+            inst = decode(bits.uint)
+        except ValueError:
+            if instructions:
+                break
+            raise
+        instructions.append((pc, bits, inst))
+        if inst.op in TERMINATORS or is_halt(inst.word):
+            break
+        pc = (pc + 4) & MASK32
+    return instructions
+
+
+def _instruction_source(pc, inst, rest=()):
+    """
+    returns the python lines for one instruction, rest is the list of
+    instructions from this one to the end of the block
+    """
+    op = inst.op
+    rd = inst.rd
+    rs1 = f"r[{inst.rs1}]"
+    rs2 = f"r[{inst.rs2}]"
+    imm = inst.imm & MASK32
+    next_pc = (pc + 4) & MASK32
+    if op == OP_I:
+        expr = ALU_EXPRESSIONS[inst.alu].format(a=rs1, b=hex(imm), sh=imm & 31)
+        return [f"r[{rd}] = {expr}"] if rd else []
+    if op == OP_R:
+        expr = ALU_EXPRESSIONS[inst.alu].format(a=rs1, b=rs2, sh=f"({rs2} & 31)")
+        return [f"r[{rd}] = {expr}"] if rd else []
+    if op == OP_L:
+        # the load still runs for x0 in case the address is bad
+        load = f"load(({rs1} + {imm:#x}) & 0xFFFFFFFF, {inst.funct3})"
+        return [f"r[{rd}] = {load}" if rd else load]
+    if op == OP_S:
+        return [f"store(({rs1} + {imm:#x}) & 0xFFFFFFFF, {rs2}, {inst.funct3})"]
+    if op == OP_LUI:
+        return [f"r[{rd}] = {imm:#x}"] if rd else []
+    if op == OP_AUI:
+        return [f"r[{rd}] = {(pc + imm) & MASK32:#x}"] if rd else []
+    if op == OP_B:
+        cond = BRANCH_EXPRESSIONS[inst.funct3].format(a=rs1, b=rs2)
+        return [f"if {cond}:",
+                f"    return {(pc + imm) & MASK32:#x}",
+                f"return {next_pc:#x}"]
+    if op == OP_JAL:
+        lines = [f"r[{rd}] = {next_pc:#x}"] if rd else []
+        return lines + [f"return {(pc + imm) & MASK32:#x}"]
+    if op == OP_JALR:
+        # work out the target first in case rd is the same as rs1
+        lines = [f"target = ({rs1} + {imm:#x}) & 0xFFFFFFFE"]
+        if rd:
+            lines.append(f"r[{rd}] = {next_pc:#x}")
+        return lines + ["return target"]
+    if op == OP_SYSTEM:
+        if is_halt(inst.word):  # stays put, the model sees it has halted
+            return [f"return {pc:#x}"]
+        try:
+            check_counter_read(inst)
+        except ValueError as e:  # only fails if it is run
+            return [f"raise ValueError({str(e)!r})"]
+        # the block is counted as a whole before it runs, so take off what
+        # is left of it to get the counts at the start of this instruction
+        instret = -len(rest)
+        cycles = -sum(MVP_CYCLES[other.op] for _, _, other in rest)
+        read = f"csr(inst_{pc:08x}, {instret}, {cycles})"
+        return [f"r[{rd}] = {read}" if rd else read]
+    raise ValueError(f"Can not translate {OP_NAMES[op]}")
+
+
+def fault_index(block, error):
+    """
+    Returns the index in block of the instruction that raised error (the
+    instructions before it have run), from the line the block function was
+    on in the traceback.
+    """
+    code = block.function.__code__
+    line = 0
+    tb = error.__traceback__
+    while tb is not None:
+        if tb.tb_frame.f_code is code:
+            line = tb.tb_lineno
+        tb = tb.tb_next
+    starts = [start for start, _ in block.lines]
+    return max(bisect_right(starts, line) - 1, 0)
+
+
+def block_source(instructions):
+    """
+    returns the python source of the function for a list of instructions
+    and the line number (from 1) each instruction starts on
+    """
+    entry = instructions[0][0]
+    lines = [f"def block_{entry:08x}(r, load, store, csr):"]
+    starts = []
+    for i, (pc, bits, inst) in enumerate(instructions):
+        starts.append(len(lines) + 1)
+        lines.append(f"    # {pc:#x}: {bits.hex}")
+        lines.extend("    " + line for line in
+                     _instruction_source(pc, inst, instructions[i:]))
+    last_pc, _, last = instructions[-1]
+    if last.op not in TERMINATORS and not is_halt(last.word):  # fell off the end of the block
+        lines.append(f"    return {(last_pc + 4) & MASK32:#x}")
+    return "\n".join(lines) + "\n", starts
+
+
+def translate(instructions):
+    """compiles a list of instructions into a Block"""
+    entry = instructions[0][0]
+    source, starts = block_source(instructions)
+    # counter reads get their decoded instruction as a global
+    namespace = dict((f"inst_{pc:08x}", inst) for pc, _, inst in instructions
+                     if inst.op == OP_SYSTEM)
+    exec(compile(source, f"<block {entry:#x}>", "exec"), namespace)
+    write_mask = 0
+    op_counts = [0] * len(OP_NAMES)
+    for _, _, inst in instructions:
+        if inst.op not in (OP_S, OP_B) and inst.rd:
+            write_mask |= 1 << inst.rd
+        op_counts[inst.op] += 1
+    lines = [(start, inst.op) for start, (_, _, inst) in zip(starts, instructions)]
+    return Block(entry, len(instructions), write_mask,
+                 namespace[f"block_{entry:08x}"], source, instructions[-1][1],
+                 op_counts, lines)
+
+
+class BlockTranslator:
+    """
+    Translates and caches basic blocks by entry pc. The cache is flushed
+    when the instruction memory is swapped out for a different program.
+    """
+
+    def __init__(self, max_length=64):
+        self.max_length = max_length
+        self._blocks = {}
+        self._memory = None
+        # from blocks dropped since, less what blocks that raised did not run
+        self._flushed_counts = [0] * len(OP_NAMES)
+
+    def lookup(self, pc, memory):
+        """
+        Returns the Block starting at pc (translating it the first time) or
+        None if there is no instruction at pc.
+        """
+        if memory is not self._memory:
+            self._flush()
+            self._memory = memory
+        block = self._blocks.get(pc)
+        if block is None:
+            instructions = find_block(memory, pc, self.max_length)
+            if not instructions:
+                return None
+            block = translate(instructions)
+            self._blocks[pc] = block
+        return block
+
+    @property
+    def blocks(self):
+        """returns the dict of translated blocks keyed by entry pc"""
+        return self._blocks
+
+    def block_counts(self):
+        """returns a dict of how many times each block (by entry pc) was run"""
+        return {pc: block.entries for pc, block in self._blocks.items()}
+
+    def op_counts(self):
+        """
+        returns a list of how many instructions of each opcode class the
+        blocks have run (blocks are counted as a whole when they are entered)
+        """
+        counts = list(self._flushed_counts)
+        for block in self._blocks.values():
+            if block.entries:
+                for op, n in enumerate(block.op_counts):
+                    counts[op] += n * block.entries
+        return counts
+
+    def uncount(self, block, start):
+        """
+        takes the instructions of block from index start on off the counts,
+        for a block that was counted when it was entered but stopped part way
+        """
+        for _, op in block.lines[start:]:
+            self._flushed_counts[op] -= 1
+
+    def reset_counts(self):
+        """sets the entry counts (and so op_counts) back to 0"""
+        self._flushed_counts = [0] * len(OP_NAMES)
+        for block in self._blocks.values():
+            block.entries = 0
+
+    def _flush(self):
+        """drops every translated block, keeping what they ran in the counts"""
+        self._flushed_counts = self.op_counts()
+        self._blocks = {}
+
+    def clear(self):
+        """drops every translated block"""
+        self._flush()
+        self._memory = None
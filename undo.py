@@ -0,0 +1,88 @@
+"""
+Undo log for reverse stepping. The models write one small record per
+instruction into a fixed size ring buffer: the pc the instruction started
+at, the register it wrote and that register's old value, and the address
+and old bytes of any store. Rewinding just plays records back, newest
+first, so stepping back never re-runs the program, and once the buffer is
+full the oldest records are overwritten so memory use stays the same no
+matter how long the run is.
+"""
+
+
+class UndoLog:
+    """
+    Ring buffer of undo records, one per instruction.
+
+    Attributes:
+        capacity: The most records kept (how far back you can step).
+    """
+
+    def __init__(self, capacity=4096):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        # one slot per record, the lists are never resized
+        self._pc = [None] * capacity
+        self._rd = [0] * capacity
+        self._old_rd = [None] * capacity
+        self._addr = [None] * capacity
+        self._old_mem = [None] * capacity
+        self._head = -1  # slot of the newest record
+        self._size = 0
+
+    def begin(self, pc):
+        """
+        starts the record for an instruction at pc (whatever the model needs
+        to put its pc back, the MVP keeps its instruction latches with it)
+        """
+        head = self._head + 1
+        if head == self.capacity:
+            head = 0
+        self._head = head
+        self._pc[head] = pc
+        self._rd[head] = 0
+        self._old_rd[head] = None
+        self._addr[head] = None
+        self._old_mem[head] = None
+        if self._size < self.capacity:
+            self._size += 1
+
+    def register_write(self, rd, old):
+        """notes that the current instruction writes x<rd>, which held old"""
+        self._rd[self._head] = rd
+        self._old_rd[self._head] = old
+
+    def memory_write(self, addr, old):
+        """
+        notes that the current instruction stores to addr, which held the
+        bytes old (as many as the store writes)
+        """
+        self._addr[self._head] = addr
+        self._old_mem[self._head] = old
+
+    def pop(self):
+        """
+        Removes the newest record and returns it as (pc, rd, old rd value,
+        store address, old memory bytes). rd is 0 if no register was written
+        and the address is None if nothing was stored.
+        """
+        if not self._size:
+            raise IndexError("undo log is empty")
+        head = self._head
+        record = (self._pc[head], self._rd[head], self._old_rd[head],
+                  self._addr[head], self._old_mem[head])
+        # drop the references so old values can be freed
+        self._old_rd[head] = self._old_mem[head] = None
+        self._head = head - 1 if head else self.capacity - 1
+        self._size -= 1
+        return record
+
+    def clear(self):
+        """drops every record"""
+        self._old_rd = [None] * self.capacity
+        self._old_mem = [None] * self.capacity
+        self._head = -1
+        self._size = 0
+
+    def __len__(self):
+        return self._size
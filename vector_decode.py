@@ -0,0 +1,136 @@
+"""
+Vectorized decoder for whole programs. Packs instruction memory into a NumPy
+uint32 array (indexed by pc >> 2) and decodes every field of every word in
+one pass with array wide shifts and masks, so large images decode almost
+instantly. Needs numpy, which the rest of the simulator does not.
+"""
+try:
+    import numpy as np
+except ImportError:
+    raise Exception(
+        "Missing a library, try `pip install numpy`"
+    )
+
+from decoder import Decoded, OPCODE_CLASS, OP_I, OP_R, OP_LUI, OP_SYSTEM
+from memory import InstructionMemory
+
+# opcode -> opcode class (-1 for opcodes the simulator does not support)
+_OP_CLASS_TABLE = np.full(128, -1, dtype=np.int8)
+for _opcode, _op in OPCODE_CLASS.items():
+    _OP_CLASS_TABLE[_opcode] = _op
+
+# opcode class -> which of the immediate columns it uses (same order as
+# decoder.IMM_EXTRACTORS), 6 means no immediate
+_IMM_I, _IMM_S, _IMM_B, _IMM_J, _IMM_U, _IMM_CSR, _IMM_NONE = range(7)
+_IMM_FORMAT = np.array([_IMM_I, _IMM_I, _IMM_S, _IMM_NONE, _IMM_B, _IMM_I,
+                        _IMM_J, _IMM_U, _IMM_U, _IMM_CSR], dtype=np.int8)
+
+
+def _sign_extend(values, bits):
+    """sign extends the lowest `bits` bits of an int64 array"""
+    sign = 1 << (bits - 1)
+    return (values & (2 * sign - 1) ^ sign) - sign
+
+
+def pack_program(memory):
+    """
+    Packs an InstructionMemory or a {address: BitArray} instruction memory
+    (what AssemblyProgram.return_mem gives) into a uint32 array indexed by
+    address >> 2. Returns (words, valid) where valid marks the addresses
+    that hold an instruction.
+    """
+    if isinstance(memory, InstructionMemory):
+        words = np.frombuffer(memory.words, dtype=np.uint32).copy()
+        return words, words != 0
+    if not memory:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=bool)
+    size = max(memory) // 4 + 1
+    index = np.fromiter((addr >> 2 for addr in memory), dtype=np.int64,
+                        count=len(memory))
+    packed = np.frombuffer(b"".join(bits.bytes for bits in memory.values()),
+                           dtype=">u4")
+    words = np.zeros(size, dtype=np.uint32)
+    valid = np.zeros(size, dtype=bool)
+    words[index] = packed
+    valid[index] = True
+    return words, valid
+
+
+class DecodedProgram:
+    """
+    Columnar decode tables for a whole program, every column is an array
+    indexed by pc >> 2.
+
+    Attributes:
+        words: The instruction words (uint32).
+        valid: True where there is an instruction.
+        opcode, rd, rs1, rs2, funct3, funct7: The raw fields (uint8).
+        op_class: The opcode class (decoder.OP_* or -1 if unsupported).
+        imm_i, imm_s, imm_b, imm_j, imm_u: Every immediate format (int64).
+        imm: The immediate for the instruction's own format (int64).
+        alu: The ALU code as funct3 << 1 | bit 30 (-1 if the op has none).
+    """
+
+    def __init__(self, words, valid=None):
+        words = np.asarray(words, dtype=np.uint32)
+        self.words = words
+        self.valid = np.ones(len(words), dtype=bool) if valid is None else valid
+        w = words.astype(np.int64)
+        self.opcode = (w & 0x7F).astype(np.uint8)
+        self.rd = ((w >> 7) & 0x1F).astype(np.uint8)
+        self.funct3 = ((w >> 12) & 0x7).astype(np.uint8)
+        self.rs1 = ((w >> 15) & 0x1F).astype(np.uint8)
+        self.rs2 = ((w >> 20) & 0x1F).astype(np.uint8)
+        self.funct7 = ((w >> 25) & 0x7F).astype(np.uint8)
+        self.op_class = _OP_CLASS_TABLE[self.opcode]
+
+        self.imm_i = _sign_extend(w >> 20, 12)
+        self.imm_s = _sign_extend(((w >> 20) & 0xFE0) | ((w >> 7) & 0x1F), 12)
+        self.imm_b = _sign_extend(((w >> 19) & 0x1000) | ((w << 4) & 0x800)
+                                  | ((w >> 20) & 0x7E0) | ((w >> 7) & 0x1E), 13)
+        self.imm_j = _sign_extend(((w >> 11) & 0x100000) | (w & 0xFF000)
+                                  | ((w >> 9) & 0x800) | ((w >> 20) & 0x7FE), 21)
+        self.imm_u = _sign_extend(w & 0xFFFFF000, 32)
+        imm_format = np.where(self.op_class >= 0,
+                              _IMM_FORMAT[np.maximum(self.op_class, 0)], _IMM_NONE)
+        self.imm = np.choose(imm_format, [self.imm_i, self.imm_s, self.imm_b,
+                                          self.imm_j, self.imm_u, w >> 20,
+                                          np.zeros_like(w)])
+
+        # alu code like the MVP uses, bit 30 only counts for r types and srai
+        alt = (w >> 30) & 1
+        alt = np.where((self.op_class == OP_R)
+                       | ((self.op_class == OP_I) & (self.funct3 == 5)), alt, 0)
+        self.alu = np.where((self.op_class == OP_R) | (self.op_class == OP_I),
+                            (self.funct3.astype(np.int64) << 1) | alt, -1)
+
+    def __len__(self):
+        return len(self.words)
+
+    def record(self, index):
+        """
+        Returns a decoder.Decoded for the instruction at pc = index * 4,
+        or None if there is no (supported) instruction there.
+        """
+        op = int(self.op_class[index])
+        if not self.valid[index] or op < 0:
+            return None
+        alu = int(self.alu[index])
+        if alu >= 0:
+            alu = f"{alu:04b}"
+        elif op in (OP_LUI, OP_SYSTEM):
+            alu = None
+        else:
+            alu = 'add'
+        return Decoded(int(self.words[index]), op, int(self.rd[index]),
+                       int(self.rs1[index]), int(self.rs2[index]),
+                       int(self.funct3[index]), int(self.imm[index]), alu)
+
+
+def decode_program(memory):
+    """
+    Decodes a whole {address: BitArray} instruction memory and returns a
+    DecodedProgram.
+    """
+    words, valid = pack_program(memory)
+    return DecodedProgram(words, valid)